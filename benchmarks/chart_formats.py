@@ -0,0 +1,48 @@
+"""Compares render time and size of charts per output format and resolution, and the cost of a cache hit.
+
+Renders the same bar chart `--repeats` times per variant in the calling process and reports the
+median render time and the bytes that would be uploaded and downloaded. A cache hit only hashes the
+chart spec and looks the URL up in `CHART_CACHE`.
+
+Usage:
+    python -m benchmarks.chart_formats [--repeats 5] [--points 30]
+"""
+import argparse
+import statistics
+import time
+
+from src.submission.tools.charts import CHART_CACHE, _init_worker, chart_key, render_chart
+
+VARIANTS = [('png', 300), ('png', 150), ('png', 100), ('webp', 150), ('webp', 100), ('svg', 100)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--points', type=int, default=30, help='bars per chart')
+    args = parser.parse_args()
+
+    _init_worker()
+    data = [{'country': f'Country {i}', 'score': 400 + (i * 37) % 200} for i in range(args.points)]
+    spec = {'chart_type': 'bar', 'data': data, 'x_axis': 'country', 'y_axis': 'score', 'palette': 'dark',
+            'rotate_xticks': True, 'xticks_rotation': 45}
+    render_chart({**spec, 'format': 'png', 'dpi': 100})
+
+    for chart_format, dpi in VARIANTS:
+        times = []
+        for _ in range(args.repeats):
+            start_time = time.perf_counter()
+            image = render_chart({**spec, 'format': chart_format, 'dpi': dpi})
+            times.append(time.perf_counter() - start_time)
+        print(f'{chart_format:4s} {dpi:3d} dpi: render {statistics.median(times) * 1000:7.1f} ms, {len(image) / 1024:7.1f} KiB')
+
+    cached = {**spec, 'format': 'png', 'dpi': 300}
+    CHART_CACHE.put(chart_key(cached), 'https://bucket_name.s3.amazonaws.com/charts/cached.png')
+    start_time = time.perf_counter()
+    for _ in range(args.repeats):
+        CHART_CACHE.get(chart_key(cached))
+    print(f'cache hit: {(time.perf_counter() - start_time) / args.repeats * 1000:7.3f} ms, no render and no upload')
+
+
+if __name__ == '__main__':
+    main()
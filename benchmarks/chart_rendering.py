@@ -0,0 +1,59 @@
+"""Measures chart rendering throughput under concurrency and checks that no chart gets corrupted.
+
+Renders `--charts` bar charts from `--threads` threads, as concurrent crews do, first in the calling
+threads (`CHART_WORKERS=0`) and then on the worker process pool. Every chart has its own data and is
+compared with the image rendered for that data alone, so a chart drawn onto another's figure is caught.
+
+Usage:
+    python -m benchmarks.chart_rendering [--charts 24] [--threads 8] [--workers 4]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.submission.tools.charts import ChartRenderer, render_chart
+
+
+def spec(i: int) -> dict:
+    countries = ['Poland', 'Spain', 'Italy', 'Norway', 'Egypt', 'Brazil', 'Qatar', 'Serbia']
+    return {
+        'chart_type': 'bar',
+        'data': [{'country': country, 'score': 400 + (i * 37 + j * 11) % 200} for j, country in enumerate(countries)],
+        'x_axis': 'country',
+        'y_axis': 'score',
+        'palette': 'dark',
+        'rotate_xticks': True,
+        'xticks_rotation': 45
+    }
+
+
+def run(renderer: ChartRenderer, specs: list[dict], threads: int, expected: list[bytes]) -> tuple[float, int]:
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        images = list(executor.map(renderer.render, specs))
+    elapsed = time.perf_counter() - start_time
+    return len(specs) / elapsed, sum(image != expected[i] for i, image in enumerate(images))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--charts', type=int, default=24)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    specs = [spec(i) for i in range(args.charts)]
+    expected = [render_chart(chart) for chart in specs]
+
+    for name, renderer in (('in threads', ChartRenderer(workers=0)), (f'{args.workers} workers', ChartRenderer(workers=args.workers))):
+        start_time = time.perf_counter()
+        renderer.warm_up()
+        warm_up = time.perf_counter() - start_time
+        throughput, corrupted = run(renderer, specs, args.threads, expected)
+        renderer.shutdown()
+        print(f'{name:12s}: {throughput:6.2f} charts/s from {args.threads} threads, '
+              f'{corrupted} of {args.charts} corrupted, warm-up {warm_up:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
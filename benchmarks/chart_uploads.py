@@ -0,0 +1,75 @@
+"""Load-tests the visualization tool without AWS: charts go to a `LocalObjectStore` in a temporary directory.
+
+Calls the tool `--charts` times with distinct data (so the chart cache never hits), uploading in the
+calling thread and then through the background queue. The store waits `--upload-latency` seconds per
+upload, as a remote store would, and fails every `--fail-every`-th attempt to exercise the retries. Reports
+the tool latency seen by the agent, the time until every upload landed and that every chart URL exists.
+
+Usage:
+    python -m benchmarks.chart_uploads [--charts 20] [--upload-latency 0.3] [--fail-every 5]
+"""
+import argparse
+import itertools
+import json
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from src.static.object_store import UPLOADER, LocalObjectStore
+from src.submission.tools.charts import CHART_CACHE
+from src.submission.tools.visualization import visualization
+
+
+class RemoteLikeStore(LocalObjectStore):
+    def __init__(self, directory: str, latency: float, fail_every: int):
+        super().__init__(directory)
+        self.latency = latency
+        self.fail_every = fail_every
+        self._attempts = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def put(self, name: str, data: bytes, content_type: str):
+        time.sleep(self.latency)
+        with self._lock:
+            attempt = next(self._attempts)
+        if self.fail_every and attempt % self.fail_every == 0:
+            raise ConnectionError('simulated upload failure')
+        super().put(name, data, content_type)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--charts', type=int, default=20)
+    parser.add_argument('--upload-latency', type=float, default=0.3)
+    parser.add_argument('--fail-every', type=int, default=5, help='fail every n-th upload attempt, 0 never')
+    args = parser.parse_args()
+
+    UPLOADER.backoff = 0.05
+    for asynchronous in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            UPLOADER.store = RemoteLikeStore(directory, args.upload_latency, args.fail_every)
+            UPLOADER.asynchronous = asynchronous
+            CHART_CACHE.clear()
+            latencies, urls = [], []
+            start_time = time.perf_counter()
+            for i in range(args.charts):
+                data = [{'country': country, 'score': 400 + (i * 37 + j * 11) % 200}
+                        for j, country in enumerate(['Poland', 'Spain', 'Italy', 'Norway'])]
+                call_start = time.perf_counter()
+                answer = visualization.invoke({'chart_type': 'bar', 'data_json': json.dumps(data),
+                                               'filename': f'chart_{i}.png', 'x_axis': 'country', 'y_axis': 'score'})
+                latencies.append(time.perf_counter() - call_start)
+                urls.append(answer[answer.index('(') + 1:-1])
+            UPLOADER.flush()
+            total = time.perf_counter() - start_time
+            stored = sum(Path(unquote(urlparse(url).path)).exists() for url in urls)
+            print(f'{"background" if asynchronous else "in the tool":11s}: tool latency median '
+                  f'{statistics.median(latencies) * 1000:7.1f} ms, all uploaded after {total:6.2f}s, '
+                  f'{stored} of {args.charts} charts stored, {UPLOADER.stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Compares token accounting and cost of agent LLM calls with and without Bedrock prompt caching.
+
+Runs `--calls` streamed calls that share a static prefix (as the agents' role, backstory and schema do)
+through `ChatBedrockWrapper` and reports the prompt, cache write and cache read tokens and the cost
+recorded for the call. By default the calls go to `StubBedrockClient`, so no AWS access is needed;
+`--live` sends them to Bedrock.
+
+Usage:
+    python -m benchmarks.prompt_caching [--calls 10] [--model-id ...] [--prefix-chars 24000] [--live]
+"""
+import argparse
+import time
+
+import dotenv
+
+from src.static import bedrock_client
+from src.static.ChatBedrockWrapper import ChatBedrockWrapper, get_token_details, get_total_cost
+from src.static.bedrock_stub import StubBedrockClient
+from src.static.metrics import end_call, start_call
+
+
+def run(model_id: str, calls: int, prefix: str, caching: bool, live: bool) -> dict:
+    bedrock_client.BEDROCK_PROMPT_CACHING = caching
+    if not live:
+        # The stub caches for any model, Bedrock only for BEDROCK_PROMPT_CACHE_MODELS
+        bedrock_client.BEDROCK_PROMPT_CACHE_MODELS.add(model_id)
+    call_id = f'benchmark_caching_{caching}_{time.time_ns()}'
+    start_call(call_id)
+    client = {} if live else {'client': StubBedrockClient()}
+    llm = ChatBedrockWrapper(model_id=model_id, model_kwargs={'temperature': 0}, call_id=call_id, **client)
+
+    start_time = time.perf_counter()
+    for i in range(calls):
+        for _ in llm.stream(f'{prefix}{bedrock_client.BEDROCK_PROMPT_CACHE_MARKER} question {i}'):
+            pass
+    result = {
+        'time': time.perf_counter() - start_time,
+        'cost': get_total_cost(call_id),
+        **get_token_details(call_id)[model_id]
+    }
+    end_call(call_id)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-id', default='anthropic.claude-3-5-sonnet-20240620-v1:0')
+    parser.add_argument('--calls', type=int, default=10)
+    parser.add_argument('--prefix-chars', type=int, default=24_000, help='size of the static prompt prefix')
+    parser.add_argument('--live', action='store_true', help='call Bedrock instead of the stub client')
+    args = parser.parse_args()
+
+    if args.live and not bedrock_client.supports_prompt_caching(args.model_id):
+        print(f'{args.model_id} is not in BEDROCK_PROMPT_CACHE_MODELS, its prompts are sent without cache markers')
+    prefix = ('You are PostgreSQL engineer. ' + 'Table description. ' * args.prefix_chars)[:args.prefix_chars]
+    for caching in (False, True):
+        result = run(args.model_id, args.calls, prefix, caching, args.live)
+        print(f'caching {"on " if caching else "off"}: prompt {result["prompt_tokens"]:7d}, '
+              f'cache write {result["cache_write_tokens"]:6d}, cache read {result["cache_read_tokens"]:7d}, '
+              f'completion {result["completion_tokens"]:5d} tokens, ${result["cost"]:.4f}, {result["time"]:.2f}s')
+
+
+if __name__ == '__main__':
+    dotenv.load_dotenv()
+    main()
@@ -0,0 +1,60 @@
+"""Compares running the queries of a comparison question one by one with `query_database_batch`.
+
+Runs the mean reading score of girls and of boys in `--countries` countries, one query per country and
+gender, as the PostgreSQL engineer would: one `query_database` call after the other, and then as a single
+batch. Needs the database from `.env`; the SQL cache is off, so both runs reach the database. Reports
+wall time, the agent turns the queries take (one tool call each) and the output tokens.
+
+Usage:
+    python -m benchmarks.query_batch [--countries 5] [--concurrency 4]
+"""
+import argparse
+import time
+
+from src.submission.tools import database
+from src.submission.tools.result_format import estimate_tokens
+
+COUNTRIES = ['Poland', 'Spain', 'Norway', 'Egypt', 'Chinese Taipei', 'Hong Kong SAR', 'Singapore', 'Ireland',
+             'Finland', 'Brazil']
+
+QUERY = '''-- {gender}, {country}
+SELECT AVG(SSR.Score) AS mean_score, COUNT(*) AS students
+FROM StudentScoreResults AS SSR
+JOIN Students AS S ON S.Student_ID = SSR.Student_ID
+JOIN Countries AS C ON C.Country_ID = S.Country_ID
+JOIN StudentQuestionnaireAnswers AS SQA ON SQA.Student_ID = S.Student_ID
+WHERE SSR.Code = 'ASRREA_avg' AND SQA.Code = 'ASBG01' AND SQA.Answer = '{gender}' AND C.Name = '{country}'
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--countries', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=database.QUERY_BATCH_CONCURRENCY,
+                        help='QUERY_BATCH_CONCURRENCY')
+    args = parser.parse_args()
+    database.SQL_CACHE_ENABLED = False
+    database.QUERY_BATCH_CONCURRENCY = args.concurrency
+
+    queries = [QUERY.format(gender=gender, country=country)
+               for country in COUNTRIES[:args.countries] for gender in ('Girl', 'Boy')]
+    queries = queries[:database.QUERY_BATCH_MAX_QUERIES]
+
+    start_time = time.perf_counter()
+    serial = [database.query_database.invoke({'query': query}) for query in queries]
+    serial_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    batch = database.query_database_batch.invoke({'queries': queries})
+    batch_time = time.perf_counter() - start_time
+
+    print(f'{len(queries)} queries')
+    print(f'one by one: {serial_time:6.2f} s, {len(queries):2d} agent turns, '
+          f'{sum(map(estimate_tokens, serial)):5d} output tokens')
+    print(f'batch:      {batch_time:6.2f} s,  1 agent turn,  {estimate_tokens(batch):5d} output tokens '
+          f'(concurrency {args.concurrency})')
+    print(batch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Measures the per-request setup of a crew run: everything that happens before the first LLM call.
+
+- per request: a new `ChatBedrockWrapper` with its own boto3 session and client, and a new crew with its
+  agents and tasks (how every request used to start),
+- template: acquiring a prebuilt crew from `CREW_TEMPLATES`, binding the call ID and releasing it,
+
+reporting the time and the memory allocated per request, and the memory still held after all of them.
+No AWS access is needed: creating a client does not call Bedrock.
+
+Usage:
+    python -m benchmarks.request_setup [--requests 20]
+"""
+import argparse
+import gc
+import os
+import time
+import tracemalloc
+
+import dotenv
+
+from src.static.ChatBedrockWrapper import ChatBedrockWrapper
+from src.submission.create_submission import CREW_TEMPLATES, MODEL_ID
+from src.submission.crews.learningVoyager import learningVoyager
+
+
+def per_request(call_id: str):
+    llm = ChatBedrockWrapper(model_id=MODEL_ID, model_kwargs={'temperature': 0}, call_id=call_id)
+    learningVoyager(llm=llm)
+
+
+def template(call_id: str):
+    crew = CREW_TEMPLATES.acquire()
+    crew.llm.call_id = call_id
+    CREW_TEMPLATES.release(crew)
+
+
+def measure(setup, requests: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    times = []
+    allocated = 0
+    for i in range(requests):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        setup(f'benchmark_setup_{i}')
+        times.append(time.perf_counter() - start_time)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    times.sort()
+    return {
+        'median_ms': times[len(times) // 2] * 1000,
+        'max_ms': times[-1] * 1000,
+        'allocated_kb': allocated / requests / 1024,
+        'retained_kb': retained / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    start_time = time.perf_counter()
+    CREW_TEMPLATES.prebuild(1)
+    print(f'prebuilding one crew template: {(time.perf_counter() - start_time) * 1000:.1f} ms (once, at startup)')
+    for name, setup in (('per request', per_request), ('template', template)):
+        result = measure(setup, args.requests)
+        print(f'{name:12s}: median {result["median_ms"]:8.2f} ms, max {result["max_ms"]:8.2f} ms, '
+              f'peak allocation {result["allocated_kb"]:8.1f} KiB per request, '
+              f'{result["retained_kb"]:8.1f} KiB retained after {args.requests} requests')
+
+
+if __name__ == '__main__':
+    dotenv.load_dotenv()
+    main()
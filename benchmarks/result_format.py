@@ -0,0 +1,70 @@
+"""Compares the size of `query_database` output before and after the compact result formatter.
+
+Formats typical results (a per-country aggregate, a long per-student result, a wide per-school result)
+with the old comma-joined rows cut at 3,000 characters and with `ResultFormatter`, and reports
+estimated tokens, whether column names and the total row count are included, and the formatting time.
+
+Usage:
+    python -m benchmarks.result_format [--students 20000] [--budget 800]
+"""
+import argparse
+import random
+import time
+from decimal import Decimal
+
+from src.submission.tools.result_format import ResultFormatter, estimate_tokens
+
+COUNTRIES = ['Poland', 'Spain', 'Iran, Islamic Rep. of', 'Moscow City, Russian Fed.', 'Egypt', 'Norway',
+             'Chinese Taipei', 'Hong Kong SAR', 'Quebec, Canada', 'South Africa (6)'] * 6
+
+
+def results(students: int) -> dict[str, tuple[list[str], list[tuple]]]:
+    random.seed(7)
+    return {
+        'per country': (
+            ['country_name', 'mean_score', 'std_score', 'students'],
+            [(country, Decimal(random.gauss(500, 40)), Decimal(random.gauss(70, 5)), random.randint(3000, 9000))
+             for country in COUNTRIES]
+        ),
+        'per student': (
+            ['student_id', 'country_name', 'score'],
+            [(i, random.choice(COUNTRIES), random.gauss(500, 70)) for i in range(students)]
+        ),
+        'per school': (
+            ['school_id', 'country_name', 'code', 'answer', 'students', 'mean_score'],
+            [(i, random.choice(COUNTRIES), 'ACBG19', random.choice(['Yes', 'No', 'More than eight weeks of instruction']),
+              random.randint(10, 200), Decimal(random.gauss(500, 60))) for i in range(students // 10)]
+        )
+    }
+
+
+def old_format(query: str, rows: list[tuple]) -> str:
+    # What query_database returned before
+    ret = '\n'.join(', '.join(map(str, row)) for row in rows)
+    if len(ret) > 3000:
+        ret = ret[:3000] + f'...\n(results too long. Output truncated. The query returned {len(rows)} rows.)'
+    return f'Query: {query}\nResult: {ret}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=20_000)
+    parser.add_argument('--budget', type=int, default=800, help='QUERY_RESULT_TOKENS')
+    args = parser.parse_args()
+
+    query = 'SELECT ... FROM country_score_stats WHERE Score_Code = \'ASRREA_avg\''
+    for name, (columns, rows) in results(args.students).items():
+        old = old_format(query, rows)
+        start_time = time.perf_counter()
+        formatter = ResultFormatter(columns, budget=args.budget)
+        formatter.add(rows)
+        new = formatter.render(exhausted=True)
+        elapsed = time.perf_counter() - start_time
+        print(f'{name:12s} ({len(rows):6d} rows): old {estimate_tokens(old):5d} tokens, no columns, '
+              f'{"complete" if len(old) < 3100 else "cut mid-row"}; new {estimate_tokens(new):5d} tokens, '
+              f'"{new.splitlines()[0]}"{" + column summary" if "Summary" in new else ""}, '
+              f'formatted in {elapsed * 1000:6.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Checks that `eval_sql_code` snippets neither see each other's output nor slow each other down.
+
+Runs `--snippets` well-behaved snippets, each printing its own id, from `--threads` threads, first
+alone and then alongside misbehaving ones: an endless loop, a CPU-bound loop, a huge allocation and a
+hard crash. Reports the median latency of the well-behaved snippets, how many returned output that
+was not their own, what the misbehaving ones returned and how many workers were replaced.
+
+The old in-process `exec` is not run with the misbehaving snippets, it would hang the benchmark.
+
+Usage:
+    python -m benchmarks.sandbox [--snippets 40] [--threads 4] [--workers 2]
+"""
+import argparse
+import io
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.submission.tools.sandbox import SandboxPool
+
+MISBEHAVING = {
+    'endless loop': 'while True:\n    pass',
+    'cpu bound': 'import time\nx = 0\nwhile True:\n    x += 1',
+    'huge allocation': 'data = bytearray(64 * 1024 ** 3)',
+    'crash': 'import os\nos._exit(3)'
+}
+
+
+def snippet(i: int) -> str:
+    return f'for _ in range(3):\n    print({i})\nprint(sum(range(200_000)))'
+
+
+def expected(i: int) -> str:
+    return f'{i}\n{i}\n{i}\n{sum(range(200_000))}\n'
+
+
+def in_process(code: str) -> str:
+    # What eval_sql_code did before: swap the process-wide stdout
+    old_stdout = sys.stdout
+    redirected_output = sys.stdout = io.StringIO()
+    try:
+        exec(code, {})
+        return redirected_output.getvalue()
+    finally:
+        sys.stdout = old_stdout
+
+
+def timed(run, i: int) -> tuple[float, str]:
+    start_time = time.perf_counter()
+    output = run(snippet(i))
+    return time.perf_counter() - start_time, output
+
+
+def run_snippets(run, count: int, threads: int) -> tuple[float, int]:
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda i: timed(run, i), range(count)))
+    wrong = sum(output != expected(i) for i, (_, output) in enumerate(results))
+    return statistics.median(elapsed for elapsed, _ in results), wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--snippets', type=int, default=40)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--wall-seconds', type=float, default=3)
+    args = parser.parse_args()
+
+    stdout = sys.stdout
+    latency, wrong = run_snippets(in_process, args.snippets, args.threads)
+    # Threads restoring each other's buffers can leave one of them in place of the real stdout
+    stdout_lost, sys.stdout = sys.stdout is not stdout, stdout
+    print(f'in process        : median {latency * 1000:7.1f} ms, {wrong} of {args.snippets} with foreign output'
+          f'{", server stdout lost" if stdout_lost else ""}')
+
+    # One worker more than the misbehaving snippets, so that the good ones always have one
+    pool = SandboxPool(workers=args.workers + len(MISBEHAVING), cpu_seconds=1, wall_seconds=args.wall_seconds,
+                       memory_mb=256)
+    start_time = time.perf_counter()
+    started = pool.warm_up()
+    print(f'sandbox warm-up   : {started} workers in {time.perf_counter() - start_time:.2f}s')
+
+    def sandboxed(code: str) -> str:
+        return pool.run(code)['stdout']
+
+    latency, wrong = run_snippets(sandboxed, args.snippets, args.threads)
+    print(f'sandbox           : median {latency * 1000:7.1f} ms, {wrong} of {args.snippets} with foreign output')
+
+    with ThreadPoolExecutor(max_workers=len(MISBEHAVING)) as executor:
+        bad = {name: executor.submit(pool.run, code) for name, code in MISBEHAVING.items()}
+        time.sleep(0.2)
+        latency, wrong = run_snippets(sandboxed, args.snippets, args.threads)
+        print(f'sandbox, with bad : median {latency * 1000:7.1f} ms, {wrong} of {args.snippets} with foreign output')
+        for name, future in bad.items():
+            result = future.result()
+            print(f'  {name:16s}: {result["error"]} (limit: {result["limit"]})')
+
+    latency, wrong = run_snippets(sandboxed, args.snippets, args.threads)
+    print(f'sandbox, after    : median {latency * 1000:7.1f} ms, {wrong} of {args.snippets} with foreign output')
+    print(pool.stats())
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
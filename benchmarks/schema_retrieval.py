@@ -0,0 +1,109 @@
+"""Compares the full schema prompt with retrieved schema context.
+
+Offline (default) it reports, per question, the schema tokens sent to the PostgreSQL engineer (the
+overview in the cached backstory plus the chunks retrieved into the task description) and the
+retrieval time. With `--live` it also runs the crew in both modes and reports tokens, cost, time and
+answer accuracy: the share of expected keywords found in the answer when the questions file provides
+them, otherwise the agreement of the numbers in both answers.
+
+Usage:
+    python -m benchmarks.schema_retrieval [--questions questions.json] [--live]
+
+The questions file is a JSON list of {"question": ..., "expected": [keywords]} objects.
+"""
+import argparse
+import json
+import re
+import time
+
+import dotenv
+
+from src.submission.crews import schema_context
+from src.submission.crews.learningVoyager import SCHEMA_INDEX, db_info
+
+DEFAULT_QUESTIONS = [
+    {'question': 'What percentage of students in Poland reached the Advanced International Benchmark?'},
+    {'question': 'What is the average reading score by country?'},
+    {'question': 'How do boys and girls differ in overall reading scores?'},
+    {'question': 'Which country had all schools closed for more than eight weeks during COVID-19?'},
+    {'question': 'How many countries had at least 55% of students reaching the Low International Benchmark?'},
+    {'question': 'Is there a relation between the number of books at home and reading scores?'},
+]
+
+
+def count_tokens(text: str) -> int:
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding('cl100k_base').encode(text))
+    except ImportError:
+        return len(text) // 4
+
+
+def numbers(text: str) -> set[str]:
+    return set(re.findall(r'\d+(?:\.\d+)?', text or ''))
+
+
+def accuracy(answer: str, expected: list[str]) -> float:
+    answer = (answer or '').lower()
+    return sum(keyword.lower() in answer for keyword in expected) / len(expected)
+
+
+def run_crew(question: str, retrieval: bool) -> dict:
+    from src.static.ChatBedrockWrapper import get_total_cost, get_total_number_of_tokens
+    from src.static.metrics import end_call, start_call
+    from src.submission.create_submission import create_submission
+
+    schema_context.SCHEMA_RETRIEVAL = retrieval
+    call_id = f'benchmark_{retrieval}_{time.time_ns()}'
+    start_call(call_id)
+    start_time = time.perf_counter()
+    answer = create_submission(call_id=call_id).run(question)
+    result = {
+        'answer': answer,
+        'time': time.perf_counter() - start_time,
+        'tokens': get_total_number_of_tokens(call_id),
+        'cost': get_total_cost(call_id)
+    }
+    end_call(call_id)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', help='JSON file with the questions')
+    parser.add_argument('--live', action='store_true', help='also run the crew in both modes (calls Bedrock)')
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = json.load(f)
+
+    full_tokens = count_tokens(db_info)
+    overview_tokens = count_tokens(SCHEMA_INDEX.overview)
+    print(f'Full schema prompt: {full_tokens} tokens, overview: {overview_tokens} tokens\n')
+    for item in questions:
+        start_time = time.perf_counter()
+        context = SCHEMA_INDEX.context(item['question'])
+        retrieval_time = time.perf_counter() - start_time
+        tokens = overview_tokens + count_tokens(context)
+        print(f'{item["question"]}\n    retrieved: {tokens} tokens ({tokens / full_tokens:.0%} of full), '
+              f'retrieval {retrieval_time * 1000:.1f}ms')
+
+        if args.live:
+            baseline = run_crew(item['question'], retrieval=False)
+            retrieved = run_crew(item['question'], retrieval=True)
+            for name, result in (('full', baseline), ('retrieved', retrieved)):
+                print(f'    {name:9s}: {result["tokens"]:6d} tokens, ${result["cost"]:.4f}, {result["time"]:.1f}s')
+            if item.get('expected'):
+                print(f'    accuracy: full {accuracy(baseline["answer"], item["expected"]):.0%}, '
+                      f'retrieved {accuracy(retrieved["answer"], item["expected"]):.0%}')
+            else:
+                both = numbers(baseline['answer']) | numbers(retrieved['answer'])
+                shared = numbers(baseline['answer']) & numbers(retrieved['answer'])
+                print(f'    numbers agreeing with the full-prompt answer: {len(shared) / len(both) if both else 1:.0%}')
+
+
+if __name__ == '__main__':
+    dotenv.load_dotenv()
+    main()
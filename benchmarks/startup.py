@@ -0,0 +1,67 @@
+"""Measures how long importing the server takes, with `python -X importtime`, and fails on regressions.
+
+Imports `--module` in a fresh interpreter `--runs` times and reports the fastest run, the slowest
+imports and whether any module that must load lazily was imported. Exits with status 1 when
+the import takes longer than `--max-ms` or a lazy module was imported, so it can run in CI.
+
+Usage:
+    python -m benchmarks.startup [--module src.static.app] [--runs 3] [--max-ms 1500] [--top 10]
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Loaded on first use (crews, charts, uploads) or by the warm-up, never by importing the server
+LAZY_MODULES = ('crewai', 'langchain', 'langchain_aws', 'langchain_core', 'boto3', 'pandas', 'matplotlib', 'seaborn')
+
+
+def import_times(module: str) -> dict[str, tuple[int, int]]:
+    """Microseconds spent importing every module, as (depth, cumulative), from one fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=REPO_ROOT, env={**os.environ, 'WARM_UP': 'off'}, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed:\n{result.stderr[-2000:]}')
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = (depth, int(cumulative))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='src.static.app')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--max-ms', type=float, default=1500, help='regression threshold for the whole import')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    def total_ms(times: dict[str, tuple[int, int]]) -> float:
+        return sum(cumulative for depth, cumulative in times.values() if depth == 0) / 1000
+
+    fastest = min((import_times(args.module) for _ in range(args.runs)), key=total_ms)
+    # Top-level imports and what they import directly
+    slowest = sorted(((cumulative, name) for name, (depth, cumulative) in fastest.items() if depth <= 1), reverse=True)
+    loaded_lazy = sorted(name for name in fastest if name.split('.')[0] in LAZY_MODULES and '.' not in name)
+
+    print(f'importing {args.module}: {total_ms(fastest):.0f} ms (fastest of {args.runs}, threshold {args.max_ms:.0f} ms)')
+    for cumulative, name in slowest[:args.top]:
+        print(f'    {cumulative / 1000:8.1f} ms  {name}')
+    print(f'lazy modules imported: {", ".join(loaded_lazy) or "none"}')
+
+    if total_ms(fastest) > args.max_ms or loaded_lazy:
+        print('FAILED: startup regressed')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Measures the token accounting overhead per LLM call of a growing agent conversation.
+
+Each call resends the agent's static prompt plus the conversation so far, as CrewAI does, and streams a
+completion back. Per call it times:
+
+- per message: tokenizing every message and every streamed chunk (how accounting used to work),
+- memoized: counting locally through the content-hash memo, the completion once at the end,
+- reported: recording the usage reported by Bedrock,
+
+and the wall time of a whole streamed call through `StubBedrockClient` with and without reported usage.
+
+Usage:
+    python -m benchmarks.token_accounting [--calls 20] [--prefix-chars 24000]
+"""
+import argparse
+import time
+
+from src.static.ChatBedrockWrapper import TOKEN_COUNT_MEMO, ChatBedrockWrapper
+from src.static.bedrock_stub import StubBedrockClient
+from src.static.metrics import end_call, start_call
+
+MODEL_ID = 'anthropic.claude-3-5-sonnet-20240620-v1:0'
+COMPLETION = ('Thought: I need to query the database.\nAction: query_database\n'
+              'Action Input: {"query": "SELECT c.Name, AVG(r.Score) FROM Countries c JOIN Students s '
+              'ON s.Country_ID = c.Country_ID JOIN StudentScoreResults r ON r.Student_ID = s.Student_ID '
+              'GROUP BY c.Name"}')
+
+
+def conversation(prefix: str, calls: int) -> list[list[dict]]:
+    """The messages sent by each call: the static prompt, then one more exchange per call."""
+    history = [{'role': 'user', 'content': prefix}]
+    turns = []
+    for i in range(calls):
+        turns.append(list(history))
+        history += [{'role': 'assistant', 'content': COMPLETION},
+                    {'role': 'user', 'content': f'Observation: result of query {i}\n' + 'Poland | 549.0\n' * 20}]
+    return turns
+
+
+def per_call_ms(fn, turns: list[list[dict]]) -> float:
+    start_time = time.perf_counter()
+    for messages in turns:
+        fn(messages)
+    return (time.perf_counter() - start_time) / len(turns) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20)
+    parser.add_argument('--prefix-chars', type=int, default=24_000, help='size of the static prompt')
+    args = parser.parse_args()
+    start_call('benchmark_accounting')
+
+    prefix = ('You are PostgreSQL engineer. ' + 'Table description. ' * args.prefix_chars)[:args.prefix_chars]
+    turns = conversation(prefix, args.calls)
+    chunks = [word if i == 0 else ' ' + word for i, word in enumerate(COMPLETION.split(' '))]
+    llm = ChatBedrockWrapper(model_id=MODEL_ID, call_id='benchmark_accounting', client=StubBedrockClient())
+    usage = {'input_tokens': 1000, 'output_tokens': 100, 'cache_write_tokens': 0, 'cache_read_tokens': 0}
+
+    def per_message(messages):
+        sum(llm.get_num_tokens(message['content']) for message in messages)
+        sum(llm.get_num_tokens(chunk) for chunk in chunks)
+
+    def memoized(messages):
+        sum(llm._count_tokens(message['content']) for message in messages)
+        llm._count_tokens(''.join(chunks))
+
+    TOKEN_COUNT_MEMO.clear()
+    print(f'{args.calls} calls, static prompt of {args.prefix_chars} chars, accounting time per call:')
+    print(f'    per message: {per_call_ms(per_message, turns):8.2f} ms')
+    print(f'    memoized:    {per_call_ms(memoized, turns):8.2f} ms  (memo {TOKEN_COUNT_MEMO.stats()["hit_rate"]:.0%} hits)')
+    print(f'    reported:    {per_call_ms(lambda messages: llm._update_token_counter(usage), turns):8.2f} ms')
+
+    for report_usage in (True, False):
+        TOKEN_COUNT_MEMO.clear()
+        stream_llm = ChatBedrockWrapper(model_id=MODEL_ID, call_id='benchmark_accounting',
+                                        client=StubBedrockClient(text=COMPLETION, report_usage=report_usage))
+
+        def call(messages):
+            for _ in stream_llm.stream([(message['role'], message['content']) for message in messages]):
+                pass
+
+        name = 'reported usage' if report_usage else 'local counting'
+        print(f'streamed call through the stub, {name}: {per_call_ms(call, turns):8.2f} ms')
+    end_call('benchmark_accounting')
+
+
+if __name__ == '__main__':
+    main()
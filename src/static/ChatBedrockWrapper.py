@@ -1,5 +1,6 @@
+import hashlib
 import logging
-from collections import defaultdict
+import time
 from typing import Dict, Any, Optional, List, Tuple, Iterator, AsyncIterator, Union
 
 from langchain_aws import ChatBedrock
@@ -10,38 +11,21 @@ from langchain_core.outputs import GenerationChunk
 from langchain_core.pydantic_v1 import Field
 from langchain_core.runnables import RunnableConfig
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-TOKEN_COUNTER: dict[str, dict[str, dict[str, int]]] = defaultdict(lambda: {})
-
-
-def get_total_number_of_tokens(call_id: str) -> int:
-    return sum(map(lambda d: d['total_tokens'], TOKEN_COUNTER[call_id].values()))
-
-
-def get_total_cost(call_id: str) -> float:
-    return sum(map(lambda d: d['total_cost'], TOKEN_COUNTER[call_id].values()))
+from src.static.bedrock_client import TOKEN_COUNT_MEMO, TOKEN_COUNT_MEMO_SIZE, UsageRecordingClient, pop_usage
+from src.static.cancellation import get_token
+from src.static.events import answer_streamer
+from src.static.metrics import LLM_CALL_LATENCY, call_metrics, get_token_details, get_total_cost, get_total_number_of_tokens
+from src.static.tracing import Span, start_span
 
+# The token count memo and the per-call accessors live in modules that load without langchain; they stay
+# importable from here for the callers that used to find them in this module
+__all__ = [
+    'ChatBedrockWrapper', 'get_token_cost', 'compute_llm_call_cost',
+    'TOKEN_COUNT_MEMO', 'TOKEN_COUNT_MEMO_SIZE', 'get_token_details', 'get_total_cost', 'get_total_number_of_tokens'
+]
 
-def get_token_details(call_id: str) -> dict:
-    return {
-        model_id: {
-            'prompt_tokens': values['prompt_tokens'],
-            'completion_tokens': values['completion_tokens']
-        }
-        for model_id, values in TOKEN_COUNTER[call_id].items()
-    }
-
-
-def _empty_metrics() -> dict[str, int | float]:
-    return {
-        'total_tokens': 0,
-        'prompt_tokens': 0,
-        'completion_tokens': 0,
-        'successful_requests': 0,
-        'total_cost': 0
-    }
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
 class ChatBedrockWrapper(ChatBedrock):
@@ -49,6 +33,10 @@ class ChatBedrockWrapper(ChatBedrock):
     model_name: str = Field(exclude=False, default='AWS_Bedrock')
     model_id: str = Field(exclude=False)
 
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        if not isinstance(self.client, UsageRecordingClient):
+            self.client = UsageRecordingClient(self.client)
 
     def invoke(
             self,
@@ -58,13 +46,9 @@ class ChatBedrockWrapper(ChatBedrock):
             stop: Optional[List[str]] = None,
             **kwargs: Any,
     ) -> BaseMessage:
-        messages = map(lambda m: m.content, self._convert_input(input).to_messages())
-        messages = [{'content': message} for message in messages]
-        self._update_token_counter_prompt(None, None, messages)
-        ret = super().invoke(input, config, stop=stop, **kwargs)
-        content = ret.content if isinstance(ret.content, str) else ''
-        self._update_token_counter_completion(content)
-        return ret
+        # Tokens are counted by _prepare_input_and_invoke(_stream), which every invocation goes through
+        get_token(self.call_id).raise_if_cancelled()
+        return super().invoke(input, config, stop=stop, **kwargs)
 
     def _prepare_input_and_invoke(
             self,
@@ -75,16 +59,25 @@ class ChatBedrockWrapper(ChatBedrock):
             run_manager: Optional[CallbackManagerForLLMRun] = None,
             **kwargs: Any,
     ) -> Tuple[str, List[ToolCall], Dict[str, Any]]:
-        self._update_token_counter_prompt(prompt, system, messages)
-        text, tool_calls, metadata = super()._prepare_input_and_invoke(prompt, system, messages, stop, run_manager, **kwargs)
-        self._update_token_counter_completion(text)
+        get_token(self.call_id).raise_if_cancelled()
+        pop_usage()
+        llm_span = start_span('llm.call', model=self.model_id, prompt_chars=self.__prompt_chars(prompt, system, messages))
+        start_time = time.perf_counter()
+        try:
+            text, tool_calls, metadata = super()._prepare_input_and_invoke(prompt, system, messages, stop, run_manager, **kwargs)
+        except BaseException as e:
+            llm_span.end(e)
+            raise
+        self.__record_call(llm_span, start_time, pop_usage() or self.__estimate_usage(prompt, system, messages, text), text)
         return text, tool_calls, metadata
 
-    def __process_chunk_content(self, chunk: Union[GenerationChunk, AIMessageChunk]):
+    @staticmethod
+    def __process_chunk_content(chunk: Union[GenerationChunk, AIMessageChunk]) -> str:
         if isinstance(chunk, GenerationChunk):
-            self._update_token_counter_completion(chunk.text)
+            return chunk.text
         elif isinstance(chunk, AIMessageChunk):
-            self._update_token_counter_completion(chunk.content)
+            return chunk.content if isinstance(chunk.content, str) else ''
+        return ''
 
     def _prepare_input_and_invoke_stream(
             self,
@@ -95,12 +88,33 @@ class ChatBedrockWrapper(ChatBedrock):
             run_manager: Optional[CallbackManagerForLLMRun] = None,
             **kwargs: Any,
     ) -> Iterator[Union[GenerationChunk, AIMessageChunk]]:
-        self._update_token_counter_prompt(prompt, system, messages)
+        token = get_token(self.call_id)
+        token.raise_if_cancelled()
         stream = super()._prepare_input_and_invoke_stream(prompt, system, messages, stop, run_manager, **kwargs)
+        streamer = answer_streamer()
         def inner() -> Iterator[Union[GenerationChunk, AIMessageChunk]]:
-            for chunk in stream:
-                self.__process_chunk_content(chunk)
-                yield chunk
+            pop_usage()
+            llm_span = start_span('llm.call', model=self.model_id, streamed=True,
+                                  prompt_chars=self.__prompt_chars(prompt, system, messages))
+            start_time = time.perf_counter()
+            completion = []
+            error = None
+            try:
+                for chunk in stream:
+                    token.raise_if_cancelled()
+                    text = self.__process_chunk_content(chunk)
+                    completion.append(text)
+                    if streamer is not None:
+                        streamer.feed(text)
+                    yield chunk
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                # Also when cancelled: the prompt has been sent and is billed
+                completion = ''.join(completion)
+                usage = pop_usage() or self.__estimate_usage(prompt, system, messages, completion)
+                self.__record_call(llm_span, start_time, usage, completion, error)
         return inner()
 
     async def _aprepare_input_and_invoke_stream(
@@ -110,58 +124,116 @@ class ChatBedrockWrapper(ChatBedrock):
             run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
             **kwargs: Any,
     ) -> AsyncIterator[GenerationChunk]:
-        self._update_token_counter_prompt(prompt, None, None)
+        token = get_token(self.call_id)
+        token.raise_if_cancelled()
         stream = super()._aprepare_input_and_invoke_stream(prompt, stop, run_manager, **kwargs)
 
+        streamer = answer_streamer()
+
+        # The client is called on another thread here, so its reported usage is not available
         async def inner() -> AsyncIterator[GenerationChunk]:
-            async for chunk in stream:
-                self._update_token_counter_completion(chunk.text)
-                yield chunk
+            llm_span = start_span('llm.call', model=self.model_id, streamed=True, prompt_chars=len(prompt))
+            start_time = time.perf_counter()
+            completion = []
+            error = None
+            try:
+                async for chunk in stream:
+                    token.raise_if_cancelled()
+                    completion.append(chunk.text)
+                    if streamer is not None:
+                        streamer.feed(chunk.text)
+                    yield chunk
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                completion = ''.join(completion)
+                usage = self.__estimate_usage(prompt, None, None, completion)
+                self.__record_call(llm_span, start_time, usage, completion, error)
 
         return inner()
 
-    def __get_tokens_count(self, prompt: Optional[str], system: Optional[str], messages: Optional[List[Dict]]) -> int:
+    def _count_tokens(self, text: str) -> int:
+        """Local token count of `text`, memoized by content hash; the agents resend the same backstory and
+        conversation history with every call."""
+        if not text:
+            return 0
+        key = (self.model_id, hashlib.blake2b(text.encode(), digest_size=16).digest())
+        tokens = TOKEN_COUNT_MEMO.get(key)
+        if tokens is None:
+            tokens = self.get_num_tokens(text)
+            TOKEN_COUNT_MEMO.put(key, tokens)
+        return tokens
+
+    def __estimate_usage(
+            self,
+            prompt: Optional[str],
+            system: Optional[str],
+            messages: Optional[List[Dict]],
+            completion: str
+    ) -> dict[str, int]:
+        """Usage counted locally, for calls Bedrock reported none for."""
         tokens = 0
         if prompt is not None:
-            tokens += self.get_num_tokens(prompt)
+            tokens += self._count_tokens(prompt)
         if system is not None:
-            tokens += self.get_num_tokens(system)
+            tokens += self._count_tokens(system)
         if messages:
             for message in messages:
-                tokens += self.get_num_tokens(message['content'])
-        return tokens
+                tokens += self._count_tokens(message['content'])
+        return {
+            'input_tokens': tokens,
+            'output_tokens': self._count_tokens(completion),
+            'cache_write_tokens': 0,
+            'cache_read_tokens': 0
+        }
 
-    def _update_token_counter_prompt(self, prompt, system, messages):
-        tokens = self.__get_tokens_count(prompt, system, messages)
-        if self.model_id not in TOKEN_COUNTER[self.call_id]:
-            TOKEN_COUNTER[self.call_id][self.model_id] = _empty_metrics()
-        TOKEN_COUNTER[self.call_id][self.model_id]['total_tokens'] += tokens
-        TOKEN_COUNTER[self.call_id][self.model_id]['prompt_tokens'] += tokens
-        TOKEN_COUNTER[self.call_id][self.model_id]['successful_requests'] += 1
-        TOKEN_COUNTER[self.call_id][self.model_id]['total_cost'] += get_token_cost(
-            tokens=tokens,
-            model_id=self.model_id,
-            mode='prompt'
-        )
+    @staticmethod
+    def __prompt_chars(prompt: Optional[str], system: Optional[str], messages: Optional[List[Dict]]) -> int:
+        chars = len(prompt or '') + len(system or '')
+        for message in messages or []:
+            if isinstance(message['content'], str):
+                chars += len(message['content'])
+        return chars
 
-    def _update_token_counter_completion(self, text):
-        tokens = self.get_num_tokens(text)
-        if self.model_id not in TOKEN_COUNTER[self.call_id]:
-            TOKEN_COUNTER[self.call_id][self.model_id] = _empty_metrics()
-        TOKEN_COUNTER[self.call_id][self.model_id]['total_tokens'] += tokens
-        TOKEN_COUNTER[self.call_id][self.model_id]['completion_tokens'] += tokens
-        TOKEN_COUNTER[self.call_id][self.model_id]['total_cost'] += get_token_cost(
-            tokens=tokens,
-            model_id=self.model_id,
-            mode='completion'
+    def __record_call(
+            self,
+            llm_span: Span,
+            start_time: float,
+            usage: dict[str, int],
+            completion: str,
+            error: Optional[BaseException] = None
+    ):
+        LLM_CALL_LATENCY.observe(time.perf_counter() - start_time, model=self.model_id)
+        self._update_token_counter(usage)
+        llm_span.set(completion_chars=len(completion), **usage)
+        llm_span.end(error)
+
+    def _update_token_counter(self, usage: dict[str, int]):
+        cost = (
+            get_token_cost(tokens=usage['input_tokens'], model_id=self.model_id, mode='prompt')
+            + get_token_cost(tokens=usage['output_tokens'], model_id=self.model_id, mode='completion')
+            + get_token_cost(tokens=usage['cache_write_tokens'], model_id=self.model_id, mode='cache_write')
+            + get_token_cost(tokens=usage['cache_read_tokens'], model_id=self.model_id, mode='cache_read')
         )
+        call_metrics(self.call_id).add_usage(self.model_id, {
+            'prompt_tokens': usage['input_tokens'],
+            'completion_tokens': usage['output_tokens'],
+            'cache_write_tokens': usage['cache_write_tokens'],
+            'cache_read_tokens': usage['cache_read_tokens']
+        }, cost)
 
 
 def get_token_cost(tokens: int, model_id: str, mode: str) -> float:
-    assert mode in ['prompt', 'completion', 'input', 'output'], f'mode "{mode}" is not supported'
+    assert mode in ['prompt', 'completion', 'input', 'output', 'cache_write', 'cache_read'], \
+        f'mode "{mode}" is not supported'
     cost_mapping = {
-        'anthropic.claude-3-5-sonnet-20240620-v1:0': {'input': 0.003, 'output': 0.015},
-        'anthropic.claude-3-haiku-20240307-v1:0': {'input': 0.00025, 'output': 0.00125},
+        'anthropic.claude-3-5-sonnet-20240620-v1:0': {
+            'input': 0.003, 'output': 0.015, 'cache_write': 0.00375, 'cache_read': 0.0003
+        },
+        'anthropic.claude-3-haiku-20240307-v1:0': {
+            'input': 0.00025, 'output': 0.00125, 'cache_write': 0.0003, 'cache_read': 0.00003
+        },
         'amazon.titan-text-premier-v1:0': {'input': 0.0005, 'output': 0.0015},
         'meta.llama3-8b-instruct-v1:0': {'input': 0.0003, 'output': 0.0006},
         'meta.llama3-70b-instruct-v1:0': {'input': 0.00265, 'output': 0.0035},
@@ -172,6 +244,8 @@ def get_token_cost(tokens: int, model_id: str, mode: str) -> float:
         mode = 'input'
     elif mode == 'completion':
         mode = 'output'
+    if not tokens:
+        return 0.0
     return tokens / 1000 * cost_mapping[model_id][mode]
 
 
@@ -185,7 +259,7 @@ def compute_llm_call_cost(model_id: str, call_id: str) -> float:
         'amazon.titan-text-premier-v1:0': {'input': 0.0005, 'output': 0.0015}
     }
 
-    token_counts = TOKEN_COUNTER[str(call_id)][model_id]
+    token_counts = get_token_details(str(call_id))[model_id]
     prompt_tokens = token_counts['prompt_tokens']
     completion_tokens = token_counts['completion_tokens']
 
@@ -196,7 +270,13 @@ def compute_llm_call_cost(model_id: str, call_id: str) -> float:
 
     logging.info(f"Input cost: ${input_cost}, Output cost: ${output_cost}")
 
-    total_cost = input_cost + output_cost
+    cache_cost = (get_token_cost(token_counts['cache_write_tokens'], model_id, 'cache_write')
+                  + get_token_cost(token_counts['cache_read_tokens'], model_id, 'cache_read'))
+    if cache_cost:
+        logging.info(f"Prompt cache - Written: {token_counts['cache_write_tokens']}, "
+                     f"Read: {token_counts['cache_read_tokens']}, cost: ${cache_cost}")
+
+    total_cost = input_cost + output_cost + cache_cost
 
     logging.info(f"Total cost for call ID {call_id}: ${total_cost}")
 
@@ -0,0 +1,42 @@
+import os
+import re
+import unicodedata
+from typing import Optional
+
+from src.static.cache import LRUCache
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', '1') == '1'
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', 6 * 60 * 60))  # 6 hours
+ANSWER_CACHE_MAX_BYTES = int(os.getenv('ANSWER_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+ANSWER_CACHE = LRUCache(max_bytes=ANSWER_CACHE_MAX_BYTES, ttl=ANSWER_CACHE_TTL)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalizes a prompt so trivially different spellings of the same question share a cache entry."""
+    prompt = unicodedata.normalize('NFKC', prompt).casefold()
+    prompt = re.sub(r'\s+', ' ', prompt)
+    return prompt.strip(' ?!.')
+
+
+def answer_key(prompt: str, model_id: str, dataset_version: str) -> tuple[str, str, str]:
+    return normalize_prompt(prompt), model_id, dataset_version
+
+
+def get_answer(prompt: str, model_id: str, dataset_version: str) -> Optional[str]:
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    return ANSWER_CACHE.get(answer_key(prompt, model_id, dataset_version))
+
+
+def put_answer(prompt: str, model_id: str, dataset_version: str, answer: str):
+    if ANSWER_CACHE_ENABLED and answer:
+        ANSWER_CACHE.put(answer_key(prompt, model_id, dataset_version), answer)
+
+
+def invalidate_answers(prompt: Optional[str] = None) -> int:
+    """Drops the cached answers of `prompt` for every model and dataset version, or all answers without a prompt."""
+    if prompt is None:
+        return ANSWER_CACHE.clear()
+    normalized = normalize_prompt(prompt)
+    return ANSWER_CACHE.invalidate_where(lambda key: key[0] == normalized)
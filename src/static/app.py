@@ -1,16 +1,34 @@
 import asyncio
 import datetime as dt
+import json
 import random
+import os
+import time
+from typing import Optional
+
 import dotenv
 import uvicorn
 
 from async_timeout import timeout
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
-from src.submission.create_submission import create_submission
-from src.static.ChatBedrockWrapper import TOKEN_COUNTER, get_total_number_of_tokens, get_total_cost, get_token_details
+from src.submission.create_submission import CREW_TEMPLATES, MODEL_ID, create_submission
+from src.static.answer_cache import ANSWER_CACHE, get_answer, invalidate_answers, put_answer
+from src.static.bedrock_client import TOKEN_COUNT_MEMO
+from src.static.cancellation import create_token, release_token
+from src.static.events import open_event_stream
+from src.static.executor import CrewExecutor, PoolSaturatedError
+from src.static.tracing import finish_trace, start_trace, tracing_enabled
+from src.static.object_store import UPLOADER
+from src.static.metrics import (REQUEST_LATENCY, Gauge, end_call, get_call, get_token_details, get_total_cost,
+                                get_total_number_of_tokens, register, render_metrics, start_call)
+from src.static.util import DATASET_VERSION, pool_stats
+from src.static.warmup import WARM_UP, warm_up, warm_up_status
+from src.submission.tools.charts import CHART_CACHE, CHART_RENDERER
+from src.submission.tools.sandbox import SANDBOX_POOL
+from src.submission.tools.sql_cache import SQL_CACHE
 
 dotenv.load_dotenv()
 
@@ -18,9 +36,113 @@ dotenv.load_dotenv()
 class Payload(BaseModel):
     prompt: str
     timeout: int = 7*60  # 7 minutes
+    trace: bool = False  # return the spans of the run (LLM calls, tools, SQL) in the response
+
+
+class InvalidationPayload(BaseModel):
+    prompt: Optional[str] = None  # all entries when not given
 
 
 app = FastAPI()
+CREW_EXECUTOR = CrewExecutor()
+CACHES = {'answer': ANSWER_CACHE, 'sql': SQL_CACHE, 'token_count': TOKEN_COUNT_MEMO, 'chart': CHART_CACHE}
+
+
+def _cache_stat(stat: str) -> dict:
+    return {(name,): cache.stats()[stat] for name, cache in CACHES.items()}
+
+
+register(Gauge('gdsc_cache_hits_total', 'Cache hits', ('cache',), lambda: _cache_stat('hits'), kind='counter'))
+register(Gauge('gdsc_cache_misses_total', 'Cache misses', ('cache',), lambda: _cache_stat('misses'), kind='counter'))
+register(Gauge('gdsc_cache_hit_rate', 'Share of cache lookups that were hits', ('cache',), lambda: _cache_stat('hit_rate')))
+register(Gauge('gdsc_cache_bytes', 'Memory used by cached values', ('cache',), lambda: _cache_stat('bytes')))
+register(Gauge(
+    'gdsc_crew_pool', 'Crew runs by state and the configured capacity', ('state',),
+    lambda: {(state,): value for state, value in CREW_EXECUTOR.stats().items() if state != 'avg_run_time'}
+))
+register(Gauge(
+    'gdsc_crew_templates', 'Prebuilt crews reused across requests', ('state',),
+    lambda: {(state,): value for state, value in CREW_TEMPLATES.stats().items()}
+))
+register(Gauge(
+    'gdsc_uploads', 'Background uploads pending and finished, and bytes uploaded', ('state',),
+    lambda: {(state,): value for state, value in UPLOADER.stats().items()}
+))
+register(Gauge(
+    'gdsc_sandbox', 'Sandbox workers and the snippets they ran, failed or were replaced after', ('state',),
+    lambda: {(state,): value for state, value in SANDBOX_POOL.stats().items()}
+))
+register(Gauge(
+    'gdsc_db_pool', 'Database connections by state', ('state',),
+    lambda: {(state,): pool_stats()[state] for state in ('size', 'in_use', 'idle', 'overflow')}
+))
+
+
+def new_call_id() -> str:
+    return dt.datetime.now().strftime("%Y%m%d%H%M%S%f") + f'_{random.randint(0, 1_000_000)}'
+
+
+def usage(call_id: str) -> dict:
+    metrics = get_call(call_id)
+    return {
+        'tokens': get_total_number_of_tokens(call_id),
+        'cost': get_total_cost(call_id),
+        'token_details': get_token_details(call_id),
+        'tool_calls': metrics.tool_calls() if metrics is not None else {},
+        'sql': metrics.sql() if metrics is not None else {}
+    }
+
+
+def rejected_response(e: PoolSaturatedError) -> JSONResponse:
+    return JSONResponse(status_code=503, headers={'Retry-After': str(e.retry_after)}, content={
+        "result": None,
+        "time": None,
+        "queue_time": None,
+        "timed_out": False,
+        "rejected": True,
+        "retry_after": e.retry_after
+    })
+
+
+def trace_fields(payload: Payload, finished: Optional[dict]) -> dict:
+    # `finished` is what finish_trace returned once the request was done, None for untraced requests
+    return {'trace': finished} if payload.trace and finished is not None else {}
+
+
+def cached_response(result: str) -> dict:
+    return {
+        "result": result,
+        "time": 0,
+        "queue_time": 0,
+        "timed_out": False,
+        "cached": True,
+        'tokens': 0,
+        'cost': 0,
+        'token_details': {},
+        'tool_calls': {},
+        'sql': {}
+    }
+
+
+def server_sent_event(event: str, data: dict) -> str:
+    return f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Database pool, CrewAI, crews, plotting libraries and sandbox workers; requests arriving earlier load what they need themselves
+    if WARM_UP == 'blocking':
+        await asyncio.get_event_loop().run_in_executor(None, warm_up)
+    elif WARM_UP == 'background':
+        asyncio.get_event_loop().run_in_executor(None, warm_up)
+
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    CREW_EXECUTOR.shutdown()
+    CHART_RENDERER.shutdown()
+    UPLOADER.shutdown()
+    SANDBOX_POOL.shutdown()
 
 
 @app.get("/")
@@ -28,47 +150,190 @@ async def health_check():
     return {"message": "Server is running. You may direct queries to api"}
 
 
+@app.get("/stats")
+async def stats():
+    return {
+        "crew_pool": CREW_EXECUTOR.stats(),
+        "crew_templates": CREW_TEMPLATES.stats(),
+        "warm_up": warm_up_status(),
+        "chart_workers": CHART_RENDERER.stats(),
+        "uploads": UPLOADER.stats(),
+        "sandbox": SANDBOX_POOL.stats(),
+        "db_pool": pool_stats(),
+        "answer_cache": ANSWER_CACHE.stats(),
+        "sql_cache": SQL_CACHE.stats(),
+        "token_count_memo": TOKEN_COUNT_MEMO.stats(),
+        "chart_cache": CHART_CACHE.stats()
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
+
+
+@app.post("/admin/cache/invalidate")
+async def invalidate_cache(payload: InvalidationPayload, x_admin_token: Optional[str] = Header(default=None)):
+    admin_token = os.getenv('ADMIN_TOKEN')
+    if not admin_token or x_admin_token != admin_token:
+        raise HTTPException(status_code=403, detail='Admin token missing or invalid')
+    return {"invalidated": invalidate_answers(payload.prompt)}
+
+
 @app.post("/run")
 async def run_task(payload: Payload):
-    call_id = dt.datetime.now().strftime("%Y%m%d%H%M%S%f") + f'_{random.randint(0, 1_000_000)}'
-    TOKEN_COUNTER[call_id] = {}
+    start_time = time.perf_counter()
+    cached = get_answer(payload.prompt, MODEL_ID, DATASET_VERSION)
+    if cached is not None:
+        REQUEST_LATENCY.observe(time.perf_counter() - start_time, endpoint='/run', outcome='cached')
+        return JSONResponse(content=cached_response(cached))
+
+    call_id = new_call_id()
+    outcome = 'error'
+    start_call(call_id)
+    trace = start_trace(call_id) if tracing_enabled(payload.trace) else None
+    # Current for this request, so the crew run picks it up through its copied context
+    token = create_token(call_id, timeout=payload.timeout)
+    job = None
+    finished = None
     try:
         submission = create_submission(call_id=call_id)
 
-        async def run_submission(prompt: str):
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, submission.run, prompt)
+        # can raise PoolSaturatedError before any work is done
+        job = CREW_EXECUTOR.submit(submission.run, payload.prompt)
 
-        # can raise TimeoutError
+        # can raise TimeoutError, the timeout covers both waiting in the queue and running
         async with timeout(payload.timeout):
-            start_time = asyncio.get_event_loop().time()
-            result = await run_submission(payload.prompt)
-            end_time = asyncio.get_event_loop().time()
-            time_diff = end_time - start_time
+            result = await job.wait()
 
-        return JSONResponse(content={
+        put_answer(payload.prompt, MODEL_ID, DATASET_VERSION, result)
+        outcome = 'ok'
+        content = {
             "result": result,
-            "time": time_diff,
+            "time": job.run_time,
+            "queue_time": job.queue_time,
             "timed_out": False,
-            'tokens': get_total_number_of_tokens(call_id),
-            'cost': get_total_cost(call_id),
-            'token_details': get_token_details(call_id)
-        })
+            "cached": False,
+            **usage(call_id)
+        }
 
+    except PoolSaturatedError as e:
+        outcome = 'rejected'
+        return rejected_response(e)
     except asyncio.TimeoutError as e:
-        return JSONResponse(content={
+        outcome = 'timeout'
+        # Stop the crew still running in the worker; cancelling in-flight SQL needs a DB round-trip
+        await asyncio.get_event_loop().run_in_executor(None, token.cancel)
+        content = {
             "result": None,
             "time": None,
+            "queue_time": job.queue_time,
             "timed_out": True,
-            'tokens': get_total_number_of_tokens(call_id),
-            'cost': get_total_cost(call_id),
-            'token_details': get_token_details(call_id)
-        })
+            **usage(call_id)
+        }
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        del TOKEN_COUNTER[call_id]
+        # Finishing also exports the trace when TRACE_EXPORT_PATH is set
+        if trace is not None:
+            finished = finish_trace(trace)
+        end_call(call_id)
+        release_token(call_id)
+        REQUEST_LATENCY.observe(time.perf_counter() - start_time, endpoint='/run', outcome=outcome)
+    return JSONResponse(content={**content, **trace_fields(payload, finished)})
+
+
+@app.post("/run/stream")
+async def run_task_stream(payload: Payload):
+    """Same as /run, but as Server-Sent Events.
+
+    Emits progress events (`agent_started`, `tool_called`, `sql_done`, `task_completed`), then the final answer
+    as `answer` events while it is generated, and ends with a `result` event carrying the same fields as /run.
+    """
+    start_time = time.perf_counter()
+    cached = get_answer(payload.prompt, MODEL_ID, DATASET_VERSION)
+    if cached is not None:
+        REQUEST_LATENCY.observe(time.perf_counter() - start_time, endpoint='/run/stream', outcome='cached')
+
+        async def replay():
+            yield server_sent_event('answer', {'text': cached})
+            yield server_sent_event('result', cached_response(cached))
+
+        return StreamingResponse(replay(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    call_id = new_call_id()
+    start_call(call_id)
+    trace = start_trace(call_id) if tracing_enabled(payload.trace) else None
+    token = create_token(call_id, timeout=payload.timeout)
+    events = open_event_stream()
+
+    def cleanup(outcome: str) -> Optional[dict]:
+        # Finishing also exports the trace when TRACE_EXPORT_PATH is set
+        finished = finish_trace(trace) if trace is not None else None
+        end_call(call_id)
+        release_token(call_id)
+        REQUEST_LATENCY.observe(time.perf_counter() - start_time, endpoint='/run/stream', outcome=outcome)
+        return finished
+
+    try:
+        submission = create_submission(call_id=call_id)
+        job = CREW_EXECUTOR.submit(submission.run, payload.prompt)
+    except PoolSaturatedError as e:
+        cleanup('rejected')
+        return rejected_response(e)
+    except Exception as e:
+        cleanup('error')
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    job.future.add_done_callback(lambda _: events.close())
+
+    async def stream():
+        outcome = 'error'
+        try:
+            async with timeout(payload.timeout):
+                while (event := await events.get()) is not None:
+                    yield server_sent_event(*event)
+                result = await job.wait()
+
+            put_answer(payload.prompt, MODEL_ID, DATASET_VERSION, result)
+            outcome = 'ok'
+            last_event = ('result', {
+                "result": result,
+                "time": job.run_time,
+                "queue_time": job.queue_time,
+                "timed_out": False,
+                "cached": False,
+                **usage(call_id)
+            })
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            last_event = ('result', {
+                "result": None,
+                "time": None,
+                "queue_time": job.queue_time,
+                "timed_out": True,
+                **usage(call_id)
+            })
+        except Exception as e:
+            print(e)
+            last_event = ('error', {'detail': str(e)})
+        finally:
+            # Also reached when the client disconnects, nobody is left to read the answer then
+            if not job.future.done():
+                job.future.cancel()
+                asyncio.get_event_loop().run_in_executor(None, token.cancel)
+                if outcome == 'error':
+                    outcome = 'disconnected'
+            finished = cleanup(outcome)
+
+        name, data = last_event
+        if name == 'result':
+            data.update(trace_fields(payload, finished))
+        yield server_sent_event(name, data)
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,178 @@
+import io
+import json
+import os
+import threading
+from typing import Any, Iterator, Optional
+
+from src.static.cache import LRUCache
+
+BEDROCK_PROMPT_CACHING = os.getenv('BEDROCK_PROMPT_CACHING', '1') == '1'
+# Models Bedrock supports prompt caching for; requests to any other model are sent without `cache_control`,
+# which Bedrock rejects for them
+BEDROCK_PROMPT_CACHE_MODELS = set(filter(None, os.getenv('BEDROCK_PROMPT_CACHE_MODELS', ','.join([
+    'anthropic.claude-3-5-haiku-20241022-v1:0',
+    'anthropic.claude-3-5-sonnet-20241022-v2:0',
+    'anthropic.claude-3-7-sonnet-20250219-v1:0',
+    'anthropic.claude-sonnet-4-20250514-v1:0',
+    'anthropic.claude-opus-4-20250514-v1:0',
+    'anthropic.claude-opus-4-1-20250805-v1:0',
+])).split(',')))
+# CrewAI puts role, backstory, goal and tools first and the task (which changes every request) after this marker
+BEDROCK_PROMPT_CACHE_MARKER = os.getenv('BEDROCK_PROMPT_CACHE_MARKER', '\nCurrent Task:')
+# Anthropic does not cache prefixes shorter than 1024 tokens, roughly 4 characters per token
+BEDROCK_PROMPT_CACHE_MIN_CHARS = int(os.getenv('BEDROCK_PROMPT_CACHE_MIN_CHARS', 4_096))
+# HTTP connections of the client shared by every crew; botocore's default of 10 is below the concurrent LLM calls
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv('BEDROCK_MAX_POOL_CONNECTIONS', 25))
+TOKEN_COUNT_MEMO_SIZE = int(os.getenv('TOKEN_COUNT_MEMO_SIZE', 4096))
+
+# Token counts of texts that had to be counted locally, bounded to TOKEN_COUNT_MEMO_SIZE entries
+TOKEN_COUNT_MEMO = LRUCache(max_bytes=TOKEN_COUNT_MEMO_SIZE, sizeof=lambda tokens: 1)
+
+_CACHE_CONTROL = {'type': 'ephemeral'}
+_USAGE = threading.local()
+_SHARED_CLIENT: Optional['UsageRecordingClient'] = None
+_SHARED_CLIENT_LOCK = threading.Lock()
+
+
+def pop_usage() -> Optional[dict[str, int]]:
+    """Usage reported by Bedrock for the last call made by the current thread, `None` when it reported none."""
+    usage = getattr(_USAGE, 'usage', None)
+    _USAGE.usage = None
+    return usage
+
+
+def _record_usage(usage: dict):
+    _USAGE.usage = {
+        'input_tokens': usage.get('input_tokens') or 0,
+        'output_tokens': usage.get('output_tokens') or 0,
+        'cache_write_tokens': usage.get('cache_creation_input_tokens') or 0,
+        'cache_read_tokens': usage.get('cache_read_input_tokens') or 0
+    }
+
+
+def _invocation_metrics_usage(metrics: dict) -> dict:
+    return {
+        'input_tokens': metrics.get('inputTokenCount'),
+        'output_tokens': metrics.get('outputTokenCount'),
+        'cache_creation_input_tokens': metrics.get('cacheWriteInputTokenCount'),
+        'cache_read_input_tokens': metrics.get('cacheReadInputTokenCount')
+    }
+
+
+def supports_prompt_caching(model_id: str) -> bool:
+    return model_id in BEDROCK_PROMPT_CACHE_MODELS
+
+
+def mark_cacheable_prefix(body: dict) -> dict:
+    """Marks the static prefix of an Anthropic messages request for prompt caching.
+
+    That is the system prompt if there is one, otherwise the part of the first message before
+    `BEDROCK_PROMPT_CACHE_MARKER`. Requests without a long enough static prefix are returned unchanged.
+    """
+    system = body.get('system')
+    if isinstance(system, str) and len(system) >= BEDROCK_PROMPT_CACHE_MIN_CHARS:
+        body['system'] = [{'type': 'text', 'text': system, 'cache_control': _CACHE_CONTROL}]
+        return body
+
+    messages = body.get('messages') or []
+    if not messages or not isinstance(messages[0].get('content'), str):
+        return body
+    content = messages[0]['content']
+    position = content.find(BEDROCK_PROMPT_CACHE_MARKER)
+    if position >= BEDROCK_PROMPT_CACHE_MIN_CHARS:
+        messages[0]['content'] = [
+            {'type': 'text', 'text': content[:position], 'cache_control': _CACHE_CONTROL},
+            {'type': 'text', 'text': content[position:]}
+        ]
+    return body
+
+
+class UsageRecordingClient:
+    """Wraps a bedrock-runtime client to record the usage Bedrock reports for each call (including prompt
+    cache reads and writes of Anthropic models), which langchain does not pass on, and to enable prompt
+    caching for Anthropic models.
+    """
+
+    def __init__(self, client: Any):
+        self._client = client
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+    def invoke_model(self, **kwargs: Any) -> dict:
+        anthropic = self._prepare(kwargs)
+        response = self._client.invoke_model(**kwargs)
+        headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+        if 'x-amzn-bedrock-input-token-count' in headers:
+            _record_usage({
+                'input_tokens': int(headers['x-amzn-bedrock-input-token-count']),
+                'output_tokens': int(headers.get('x-amzn-bedrock-output-token-count', 0))
+            })
+        if anthropic:
+            # Only the body has the cache reads and writes
+            data = response['body'].read()
+            usage = json.loads(data).get('usage')
+            if usage:
+                _record_usage(usage)
+            # The body is a stream that can be read once, langchain reads it again
+            response['body'] = io.BytesIO(data)
+        return response
+
+    def invoke_model_with_response_stream(self, **kwargs: Any) -> dict:
+        self._prepare(kwargs)
+        response = self._client.invoke_model_with_response_stream(**kwargs)
+        response['body'] = self._recording_stream(response['body'])
+        return response
+
+    @staticmethod
+    def _prepare(kwargs: dict) -> bool:
+        model_id = str(kwargs.get('modelId', ''))
+        if not model_id.startswith('anthropic.'):
+            return False
+        if BEDROCK_PROMPT_CACHING and supports_prompt_caching(model_id):
+            kwargs['body'] = json.dumps(mark_cacheable_prefix(json.loads(kwargs['body'])))
+        return True
+
+    @staticmethod
+    def _recording_stream(stream: Any) -> Iterator[dict]:
+        # Usage is recorded as soon as it arrives, langchain stops reading at the message_stop event
+        usage = {}
+        for event in stream:
+            chunk = event.get('chunk')
+            if chunk:
+                chunk_obj = json.loads(chunk.get('bytes').decode())
+                reported = None
+                if chunk_obj.get('type') == 'message_start':
+                    reported = chunk_obj.get('message', {}).get('usage')
+                elif chunk_obj.get('type') == 'message_delta':
+                    reported = chunk_obj.get('usage')
+                if reported:
+                    usage.update(reported)
+                    _record_usage(usage)
+                elif not usage and 'amazon-bedrock-invocationMetrics' in chunk_obj:
+                    _record_usage(_invocation_metrics_usage(chunk_obj['amazon-bedrock-invocationMetrics']))
+            yield event
+
+
+def shared_client() -> UsageRecordingClient:
+    """The bedrock-runtime client of the process, created on first use.
+
+    boto3 clients are thread-safe, so every `ChatBedrockWrapper` passes this one as `client=` instead of
+    creating its own session, client and connection pool per request.
+    """
+    global _SHARED_CLIENT
+    if _SHARED_CLIENT is None:
+        with _SHARED_CLIENT_LOCK:
+            if _SHARED_CLIENT is None:
+                import boto3
+                from botocore.config import Config
+
+                # Same region resolution as langchain-aws uses when it creates the client itself
+                session = boto3.Session()
+                client = session.client(
+                    'bedrock-runtime',
+                    region_name=os.getenv('AWS_DEFAULT_REGION', session.region_name),
+                    config=Config(max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS)
+                )
+                _SHARED_CLIENT = UsageRecordingClient(client)
+    return _SHARED_CLIENT
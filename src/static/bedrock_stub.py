@@ -0,0 +1,96 @@
+import io
+import json
+import time
+from typing import Any, Optional
+
+
+class StubBedrockClient:
+    """Offline stand-in for the bedrock-runtime client, answering Anthropic messages requests.
+
+    Token counts are approximated as 4 characters per token. Prompt caching behaves like Anthropic's:
+    a prefix marked with `cache_control` is written to the cache on first use and read from it afterwards.
+    Every request body is kept in `requests` for inspection. With `report_usage=False` no usage is
+    reported, like for models Bedrock returns no token counts for.
+
+        llm = ChatBedrockWrapper(model_id=..., call_id=..., client=StubBedrockClient())
+    """
+
+    def __init__(
+            self,
+            text: str = 'Thought: I now know the final answer\nFinal Answer: 42',
+            latency: float = 0.0,
+            report_usage: bool = True
+    ):
+        self.text = text
+        self.latency = latency
+        self.report_usage = report_usage
+        self.requests: list[dict] = []
+        self._cached_prefixes: set[str] = set()
+
+    def invoke_model(self, **kwargs: Any) -> dict:
+        usage = self._handle(kwargs)
+        body = {
+            'id': 'msg_stub',
+            'type': 'message',
+            'role': 'assistant',
+            'content': [{'type': 'text', 'text': self.text}],
+            'stop_reason': 'end_turn',
+            'usage': usage
+        }
+        if not self.report_usage:
+            del body['usage']
+            return {'body': io.BytesIO(json.dumps(body).encode()), 'ResponseMetadata': {'HTTPHeaders': {}}}
+        return {
+            'body': io.BytesIO(json.dumps(body).encode()),
+            'ResponseMetadata': {'HTTPHeaders': {
+                'x-amzn-bedrock-input-token-count': str(usage['input_tokens']),
+                'x-amzn-bedrock-output-token-count': str(usage['output_tokens'])
+            }}
+        }
+
+    def invoke_model_with_response_stream(self, **kwargs: Any) -> dict:
+        usage = self._handle(kwargs)
+        words = self.text.split(' ')
+        events = [{'type': 'message_start', 'message': {'usage': {**usage, 'output_tokens': 1}}},
+                  {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}]
+        events += [
+            {'type': 'content_block_delta', 'index': 0,
+             'delta': {'type': 'text_delta', 'text': word if i == 0 else ' ' + word}}
+            for i, word in enumerate(words)
+        ]
+        events += [{'type': 'content_block_stop', 'index': 0},
+                   {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                    'usage': {'output_tokens': usage['output_tokens']}},
+                   {'type': 'message_stop', 'amazon-bedrock-invocationMetrics': {
+                       'inputTokenCount': usage['input_tokens'], 'outputTokenCount': usage['output_tokens']}}]
+        if not self.report_usage:
+            del events[0]['message']['usage'], events[-2]['usage'], events[-1]['amazon-bedrock-invocationMetrics']
+        return {'body': [{'chunk': {'bytes': json.dumps(event).encode()}} for event in events]}
+
+    def _handle(self, kwargs: dict) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.loads(kwargs['body'])
+        self.requests.append(body)
+
+        cached_prefix: Optional[str] = None
+        blocks = []
+        if isinstance(body.get('system'), list):
+            blocks += body['system']
+        for message in body.get('messages', []):
+            if isinstance(message['content'], list):
+                blocks += message['content']
+        prompt = json.dumps(body.get('system', '')) + json.dumps(body.get('messages', []))
+        for block in blocks:
+            if block.get('cache_control'):
+                cached_prefix = block['text']
+
+        usage = {'input_tokens': len(prompt) // 4, 'output_tokens': len(self.text) // 4,
+                 'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0}
+        if cached_prefix is not None:
+            prefix_tokens = len(cached_prefix) // 4
+            key = 'cache_read_input_tokens' if cached_prefix in self._cached_prefixes else 'cache_creation_input_tokens'
+            usage[key] = prefix_tokens
+            usage['input_tokens'] -= prefix_tokens
+            self._cached_prefixes.add(cached_prefix)
+        return usage
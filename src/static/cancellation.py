@@ -0,0 +1,102 @@
+import contextvars
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+
+class CrewCancelledError(Exception):
+    """Raised inside a crew run once its call has been cancelled."""
+
+
+class CancellationToken:
+    """Cooperative cancellation flag shared by everything running on behalf of a single `call_id`.
+
+    Long running code checks `raise_if_cancelled()` at safe points. Code blocked in an external system
+    (e.g. a SQL statement) registers a callback with `on_cancel()` that interrupts it from the outside.
+    """
+
+    def __init__(self, call_id: str, deadline: Optional[float] = None):
+        self.call_id = call_id
+        self.deadline = deadline
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: dict[int, Callable[[], None]] = {}
+        self._next_handle = 0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, `None` when the call has no deadline."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise CrewCancelledError(f'Call {self.call_id} was cancelled')
+
+    def on_cancel(self, callback: Callable[[], None]) -> int:
+        with self._lock:
+            handle = self._next_handle
+            self._next_handle += 1
+            self._callbacks[handle] = callback
+        return handle
+
+    def remove_callback(self, handle: int):
+        with self._lock:
+            self._callbacks.pop(handle, None)
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.warning(f'Cancellation callback for call ID {self.call_id} failed: {e}')
+
+
+_NO_CANCELLATION = CancellationToken(call_id='')
+CURRENT_TOKEN: contextvars.ContextVar[CancellationToken] = contextvars.ContextVar('cancellation_token', default=_NO_CANCELLATION)
+_TOKENS: dict[str, CancellationToken] = {}
+_TOKENS_LOCK = threading.Lock()
+
+
+def create_token(call_id: str, timeout: Optional[float] = None) -> CancellationToken:
+    """Creates the token of `call_id` and makes it current for the calling context and everything started from it."""
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    token = CancellationToken(call_id, deadline)
+    with _TOKENS_LOCK:
+        _TOKENS[call_id] = token
+    CURRENT_TOKEN.set(token)
+    return token
+
+
+def get_token(call_id: str) -> CancellationToken:
+    with _TOKENS_LOCK:
+        token = _TOKENS.get(call_id)
+    return token if token is not None else CURRENT_TOKEN.get()
+
+
+def current_token() -> CancellationToken:
+    return CURRENT_TOKEN.get()
+
+
+def cancel(call_id: str) -> bool:
+    with _TOKENS_LOCK:
+        token = _TOKENS.get(call_id)
+    if token is None:
+        return False
+    token.cancel()
+    return True
+
+
+def release_token(call_id: str):
+    # Workers still running keep their reference through the context, only the lookup by call_id goes away
+    with _TOKENS_LOCK:
+        _TOKENS.pop(call_id, None)
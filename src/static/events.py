@@ -0,0 +1,87 @@
+import asyncio
+import contextvars
+from typing import Any, Optional, Tuple
+
+FINAL_ANSWER_MARKER = 'Final Answer:'
+
+
+class EventStream:
+    """Progress events of a single call, produced in the crew worker thread and consumed on the event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.stream_answer = False
+
+    def emit(self, event: str, **data: Any):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (event, data))
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+
+    async def get(self) -> Optional[Tuple[str, dict]]:
+        """Next `(event, data)` pair, `None` once the stream is closed."""
+        return await self._queue.get()
+
+
+CURRENT_EVENTS: contextvars.ContextVar[Optional[EventStream]] = contextvars.ContextVar('event_stream', default=None)
+
+
+def open_event_stream() -> EventStream:
+    """Creates an event stream and makes it current for the calling context and everything started from it."""
+    stream = EventStream(asyncio.get_event_loop())
+    CURRENT_EVENTS.set(stream)
+    return stream
+
+
+def emit(event: str, **data: Any):
+    """Emits an event to the stream of the current call, a no-op when nobody is listening."""
+    stream = CURRENT_EVENTS.get()
+    if stream is not None:
+        stream.emit(event, **data)
+
+
+def start_answer_streaming():
+    """Marks that from now on the LLM is generating the final answer of the call."""
+    stream = CURRENT_EVENTS.get()
+    if stream is not None:
+        stream.stream_answer = True
+
+
+def answer_streamer() -> Optional['AnswerStreamer']:
+    """Returns an `AnswerStreamer` for the current LLM generation if its answer should be streamed."""
+    stream = CURRENT_EVENTS.get()
+    if stream is None or not stream.stream_answer:
+        return None
+    return AnswerStreamer()
+
+
+class AnswerStreamer:
+    """Picks the final answer out of a ReAct-formatted generation fed chunk by chunk.
+
+    Everything up to and including `Final Answer:` (thoughts, tool calls) is swallowed,
+    everything after it is emitted as `answer` events.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._found = False
+        self._started = False
+
+    def feed(self, text: str):
+        if not text:
+            return
+        if not self._found:
+            self._buffer += text
+            position = self._buffer.find(FINAL_ANSWER_MARKER)
+            if position < 0:
+                return
+            self._found = True
+            text = self._buffer[position + len(FINAL_ANSWER_MARKER):]
+            self._buffer = ''
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return
+            self._started = True
+        emit('answer', text=text)
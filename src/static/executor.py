@@ -0,0 +1,119 @@
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+CREW_POOL_WORKERS = int(os.getenv('CREW_POOL_WORKERS', 4))
+CREW_POOL_QUEUE_SIZE = int(os.getenv('CREW_POOL_QUEUE_SIZE', 8))
+CREW_POOL_RETRY_AFTER = int(os.getenv('CREW_POOL_RETRY_AFTER', 30))
+
+
+class PoolSaturatedError(Exception):
+    """Raised when every worker is busy and the waiting queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f'Crew execution pool is saturated, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class CrewJob:
+    """Handle of a single submission run scheduled on the `CrewExecutor`."""
+
+    def __init__(self, submitted_at: float):
+        self.future: Optional[Future] = None
+        self.submitted_at = submitted_at
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def queue_time(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        return self.started_at - self.submitted_at
+
+    @property
+    def run_time(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    async def wait(self) -> Any:
+        # Cancelling the awaiting coroutine (e.g. on timeout) cancels the job if it is still queued.
+        return await asyncio.wrap_future(self.future)
+
+
+class CrewExecutor:
+    """Dedicated thread pool for crew runs with a bounded waiting queue.
+
+    At most `max_workers` runs execute at once and at most `max_queue` more wait for a worker.
+    Anything beyond that is rejected immediately with `PoolSaturatedError` instead of piling up.
+    """
+
+    def __init__(self, max_workers: int = CREW_POOL_WORKERS, max_queue: int = CREW_POOL_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='crew')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._avg_run_time: Optional[float] = None
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> CrewJob:
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                raise PoolSaturatedError(self._retry_after())
+            self._pending += 1
+
+        job = CrewJob(submitted_at=time.monotonic())
+        # Run in a copy of the caller's context so context variables set by the request are visible in the worker
+        context = contextvars.copy_context()
+
+        def execute():
+            job.started_at = time.monotonic()
+            with self._lock:
+                self._running += 1
+            try:
+                return context.run(fn, *args)
+            finally:
+                job.finished_at = time.monotonic()
+                with self._lock:
+                    self._running -= 1
+                    self._record_run_time(job.run_time)
+
+        job.future = self._executor.submit(execute)
+        job.future.add_done_callback(self._release)
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'queue_size': self.max_queue,
+                'running': self._running,
+                'queued': self._pending - self._running,
+                'avg_run_time': self._avg_run_time
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _: Future):
+        with self._lock:
+            self._pending -= 1
+
+    def _record_run_time(self, run_time: float):
+        # Exponentially weighted average, used only to estimate Retry-After
+        if self._avg_run_time is None:
+            self._avg_run_time = run_time
+        else:
+            self._avg_run_time = 0.8 * self._avg_run_time + 0.2 * run_time
+
+    def _retry_after(self) -> int:
+        if self._avg_run_time is None:
+            return CREW_POOL_RETRY_AFTER
+        waves = (self._pending - self.max_workers) / self.max_workers + 1
+        return max(1, math.ceil(self._avg_run_time * waves))
@@ -0,0 +1,314 @@
+import bisect
+import contextvars
+import math
+import threading
+from collections import Counter as TallyCounter
+from typing import Callable, Iterable, Optional
+
+# Seconds; crew runs take minutes, single LLM calls and SQL queries from milliseconds to a minute
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (1_000, 2_500, 5_000, 10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000)
+ROW_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+BYTE_BUCKETS = (1_000, 10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Process-wide histogram with Prometheus semantics: cumulative buckets, sum and count per label set."""
+
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float], labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labels, key, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class Counter:
+    """Process-wide monotonically increasing counter per label set."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+class Gauge:
+    """Value read from `collect` at scrape time, e.g. pool or cache state owned by another module.
+
+    `collect` returns the value for every label set, as {(label values): value}; `None` values are skipped.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labels: tuple[str, ...],
+            collect: Callable[[], dict[tuple[str, ...], Optional[float]]],
+            kind: str = 'gauge'
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.collect = collect
+        self.kind = kind
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self.collect().items()):
+            if value is not None:
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    'gdsc_request_latency_seconds', 'Latency of /run and /run/stream requests, including queueing',
+    LATENCY_BUCKETS, ('endpoint', 'outcome')
+)
+LLM_CALL_LATENCY = Histogram(
+    'gdsc_llm_call_latency_seconds', 'Latency of single Bedrock calls made by the agents', LATENCY_BUCKETS, ('model',)
+)
+TOKENS_PER_REQUEST = Histogram(
+    'gdsc_tokens_per_request', 'Tokens (prompt, completion and cached) used to answer a request', TOKEN_BUCKETS
+)
+SQL_LATENCY = Histogram(
+    'gdsc_sql_latency_seconds', 'Latency of agent SQL queries that were not answered from the cache',
+    LATENCY_BUCKETS, ('backend', 'outcome')
+)
+# Not rows scanned: reading stops once the output and its column summaries are complete, see result_format.py
+SQL_ROWS_RETURNED = Histogram(
+    'gdsc_sql_rows_returned', 'Result rows read by query_database per agent SQL query not answered from the cache',
+    ROW_BUCKETS, ('backend',)
+)
+TOOL_CALLS = Counter('gdsc_tool_calls_total', 'Tool calls made by the agents', ('tool',))
+SQL_PREFLIGHT = Counter(
+    'gdsc_sql_preflight_total', 'Agent SQL queries refused or limited before they were run', ('outcome',)
+)
+CHART_RENDER_LATENCY = Histogram(
+    'gdsc_chart_render_seconds', 'Time to render a chart, including the wait for a worker', LATENCY_BUCKETS, ('format',)
+)
+CHART_UPLOAD_LATENCY = Histogram('gdsc_chart_upload_seconds', 'Time to upload a rendered chart', LATENCY_BUCKETS, ('format',))
+CHART_BYTES = Histogram('gdsc_chart_bytes', 'Size of rendered charts', BYTE_BUCKETS, ('format',))
+SANDBOX_LATENCY = Histogram(
+    'gdsc_sandbox_seconds', 'Time to run an agent-written Python snippet, including the wait for a worker',
+    LATENCY_BUCKETS, ('outcome',)
+)
+
+METRICS: list = [
+    REQUEST_LATENCY, LLM_CALL_LATENCY, TOKENS_PER_REQUEST, SQL_LATENCY, SQL_ROWS_RETURNED, TOOL_CALLS, SQL_PREFLIGHT,
+    CHART_RENDER_LATENCY, CHART_UPLOAD_LATENCY, CHART_BYTES, SANDBOX_LATENCY
+]
+
+
+def register(metric) -> None:
+    METRICS.append(metric)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+
+def _empty_usage() -> dict[str, int | float]:
+    return {
+        'total_tokens': 0,
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'cache_write_tokens': 0,
+        'cache_read_tokens': 0,
+        'successful_requests': 0,
+        'total_cost': 0
+    }
+
+
+class CallMetrics:
+    """Token usage per model, tool calls and SQL work of a single `call_id`, safe to update from any thread."""
+
+    def __init__(self, call_id: str):
+        self.call_id = call_id
+        self._lock = threading.Lock()
+        self._usage: dict[str, dict[str, int | float]] = {}
+        self._tool_calls: TallyCounter[str] = TallyCounter()
+        self._sql = {'queries': 0, 'rows': 0, 'time': 0.0}
+
+    def add_usage(self, model_id: str, usage: dict[str, int], cost: float):
+        with self._lock:
+            metrics = self._usage.get(model_id)
+            if metrics is None:
+                metrics = self._usage[model_id] = _empty_usage()
+            for key, tokens in usage.items():
+                metrics[key] += tokens
+            metrics['total_tokens'] += sum(usage.values())
+            metrics['successful_requests'] += 1
+            metrics['total_cost'] += cost
+
+    def add_tool_call(self, tool: str):
+        with self._lock:
+            self._tool_calls[tool] += 1
+
+    def add_sql(self, elapsed: float, rows: int):
+        with self._lock:
+            self._sql['queries'] += 1
+            self._sql['rows'] += rows
+            self._sql['time'] += elapsed
+
+    def usage(self) -> dict[str, dict[str, int | float]]:
+        with self._lock:
+            return {model_id: dict(metrics) for model_id, metrics in self._usage.items()}
+
+    def total_tokens(self) -> int:
+        return sum(metrics['total_tokens'] for metrics in self.usage().values())
+
+    def total_cost(self) -> float:
+        return sum(metrics['total_cost'] for metrics in self.usage().values())
+
+    def tool_calls(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._tool_calls)
+
+    def sql(self) -> dict[str, int | float]:
+        with self._lock:
+            return dict(self._sql)
+
+
+CURRENT_CALL: contextvars.ContextVar[Optional[CallMetrics]] = contextvars.ContextVar('call_metrics', default=None)
+_CALLS: dict[str, CallMetrics] = {}
+_CALLS_LOCK = threading.Lock()
+
+
+def start_call(call_id: str) -> CallMetrics:
+    """Creates the metrics of `call_id` and makes them current for the calling context and everything started from it."""
+    metrics = CallMetrics(call_id)
+    with _CALLS_LOCK:
+        _CALLS[call_id] = metrics
+    CURRENT_CALL.set(metrics)
+    return metrics
+
+
+def get_call(call_id: str) -> Optional[CallMetrics]:
+    with _CALLS_LOCK:
+        metrics = _CALLS.get(call_id)
+    if metrics is None:
+        current = CURRENT_CALL.get()
+        if current is not None and current.call_id == call_id:
+            return current
+    return metrics
+
+
+def call_metrics(call_id: str) -> CallMetrics:
+    """Metrics of `call_id` to record into.
+
+    Calls nobody started with `start_call` (LLM calls finishing after `end_call`, threads that did not copy
+    the request's context) get metrics that are not kept, so they cannot pile up in a long-running server.
+    Scripts and benchmarks reading the metrics of a call start it themselves.
+    """
+    metrics = get_call(call_id)
+    return metrics if metrics is not None else CallMetrics(call_id)
+
+
+def get_total_number_of_tokens(call_id: str) -> int:
+    metrics = get_call(call_id)
+    return metrics.total_tokens() if metrics is not None else 0
+
+
+def get_total_cost(call_id: str) -> float:
+    metrics = get_call(call_id)
+    return metrics.total_cost() if metrics is not None else 0
+
+
+def get_token_details(call_id: str) -> dict:
+    metrics = get_call(call_id)
+    return {
+        model_id: {
+            'prompt_tokens': values['prompt_tokens'],
+            'completion_tokens': values['completion_tokens'],
+            'cache_write_tokens': values['cache_write_tokens'],
+            'cache_read_tokens': values['cache_read_tokens']
+        }
+        for model_id, values in (metrics.usage() if metrics is not None else {}).items()
+    }
+
+
+def current_call() -> Optional[CallMetrics]:
+    return CURRENT_CALL.get()
+
+
+def end_call(call_id: str) -> Optional[CallMetrics]:
+    """Stops tracking `call_id` and records its token total; workers still running keep their reference."""
+    with _CALLS_LOCK:
+        metrics = _CALLS.pop(call_id, None)
+    if metrics is not None:
+        TOKENS_PER_REQUEST.observe(metrics.total_tokens())
+    return metrics
+
+
+def record_tool_call(tool: str):
+    TOOL_CALLS.inc(tool=tool)
+    metrics = current_call()
+    if metrics is not None:
+        metrics.add_tool_call(tool)
+
+
+def record_sql(elapsed: float, rows: Optional[int], backend: str, ok: bool = True):
+    SQL_LATENCY.observe(elapsed, backend=backend, outcome='ok' if ok else 'error')
+    if ok:
+        SQL_ROWS_RETURNED.observe(rows or 0, backend=backend)
+        metrics = current_call()
+        if metrics is not None:
+            metrics.add_sql(elapsed, rows or 0)
@@ -0,0 +1,206 @@
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+# `s3` for S3 or an S3-compatible store such as MinIO (with OBJECT_STORE_ENDPOINT_URL), `local` for a directory
+OBJECT_STORE_BACKEND = os.getenv('OBJECT_STORE_BACKEND', 's3')
+OBJECT_STORE_BUCKET = os.getenv('OBJECT_STORE_BUCKET', 'bucket_name')
+OBJECT_STORE_ENDPOINT_URL = os.getenv('OBJECT_STORE_ENDPOINT_URL')
+# Base of the returned URLs when objects are served from elsewhere, e.g. a CDN or a static file server
+OBJECT_STORE_PUBLIC_URL = os.getenv('OBJECT_STORE_PUBLIC_URL')
+OBJECT_STORE_LOCAL_DIR = os.getenv('OBJECT_STORE_LOCAL_DIR', 'object_store')
+OBJECT_STORE_MAX_POOL_CONNECTIONS = int(os.getenv('OBJECT_STORE_MAX_POOL_CONNECTIONS', 10))
+
+UPLOAD_ASYNC = os.getenv('UPLOAD_ASYNC', '1') == '1'
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 4))
+UPLOAD_RETRIES = int(os.getenv('UPLOAD_RETRIES', 3))
+UPLOAD_RETRY_BACKOFF = float(os.getenv('UPLOAD_RETRY_BACKOFF', 0.5))
+
+
+class ObjectStore(ABC):
+    """Where generated files such as charts are stored, and the URL they are served under."""
+
+    @abstractmethod
+    def put(self, name: str, data: bytes, content_type: str):
+        ...
+
+    @abstractmethod
+    def url(self, name: str) -> str:
+        ...
+
+    def connect(self):
+        """Sets up connections up front, e.g. during warm-up; stores connect on first use otherwise."""
+
+
+class S3ObjectStore(ObjectStore):
+    """S3, or any S3-compatible store (MinIO, LocalStack) at `endpoint_url`, through one client shared by all uploads."""
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, public_url: Optional[str] = None):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.public_url = public_url
+        self._client: Any = None
+        self._lock = threading.Lock()
+
+    def connect(self) -> Any:
+        # boto3 clients are thread-safe; creating one costs more than a small upload
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    from botocore.config import Config
+
+                    self._client = boto3.Session().client(
+                        's3',
+                        endpoint_url=self.endpoint_url,
+                        config=Config(max_pool_connections=OBJECT_STORE_MAX_POOL_CONNECTIONS)
+                    )
+        return self._client
+
+    def put(self, name: str, data: bytes, content_type: str):
+        self.connect().put_object(Bucket=self.bucket, Key=name, Body=data, ContentType=content_type)
+
+    def url(self, name: str) -> str:
+        if self.public_url:
+            return f'{self.public_url.rstrip("/")}/{name}'
+        if self.endpoint_url:
+            return f'{self.endpoint_url.rstrip("/")}/{self.bucket}/{name}'
+        return f'https://{self.bucket}.s3.amazonaws.com/{name}'
+
+
+class LocalObjectStore(ObjectStore):
+    """Files in a local directory, for development and load tests without AWS."""
+
+    def __init__(self, directory: str, public_url: Optional[str] = None):
+        self.directory = Path(directory).resolve()
+        self.public_url = public_url
+
+    def put(self, name: str, data: bytes, content_type: str):
+        path = self.directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Readers never see a partially written file
+        temporary = path.with_name(f'.{path.name}.{threading.get_ident()}.tmp')
+        temporary.write_bytes(data)
+        os.replace(temporary, path)
+
+    def url(self, name: str) -> str:
+        if self.public_url:
+            return f'{self.public_url.rstrip("/")}/{name}'
+        return (self.directory / name).as_uri()
+
+
+def create_object_store() -> ObjectStore:
+    if OBJECT_STORE_BACKEND == 'local':
+        return LocalObjectStore(OBJECT_STORE_LOCAL_DIR, OBJECT_STORE_PUBLIC_URL)
+    if OBJECT_STORE_BACKEND == 's3':
+        return S3ObjectStore(OBJECT_STORE_BUCKET, OBJECT_STORE_ENDPOINT_URL, OBJECT_STORE_PUBLIC_URL)
+    raise ValueError(f'Unknown OBJECT_STORE_BACKEND {OBJECT_STORE_BACKEND!r}, expected `s3` or `local`')
+
+
+class Uploader:
+    """Uploads to an `ObjectStore` off the critical path.
+
+    `submit` returns the object's final URL right away and uploads on a small thread pool, retrying
+    failed attempts with exponential backoff. `on_done(ok, elapsed)` is called from the upload thread
+    once the upload succeeded or every attempt failed. With `asynchronous=False` uploads happen in
+    the calling thread, with the same retries.
+    """
+
+    def __init__(
+            self,
+            store: ObjectStore,
+            workers: int = UPLOAD_WORKERS,
+            retries: int = UPLOAD_RETRIES,
+            backoff: float = UPLOAD_RETRY_BACKOFF,
+            asynchronous: bool = UPLOAD_ASYNC
+    ):
+        self.store = store
+        self.retries = retries
+        self.backoff = backoff
+        self.asynchronous = asynchronous
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload')
+        self._lock = threading.Lock()
+        self._pending: set[Future] = set()
+        self._stats = {'uploaded': 0, 'failed': 0, 'retried': 0, 'bytes': 0}
+
+    def submit(
+            self,
+            name: str,
+            data: bytes,
+            content_type: str,
+            on_done: Optional[Callable[[bool, float], None]] = None
+    ) -> str:
+        if not self.asynchronous:
+            ok, elapsed = self._upload(name, data, content_type)
+            if on_done is not None:
+                on_done(ok, elapsed)
+            if not ok:
+                raise RuntimeError(f'Could not upload {name}')
+            return self.store.url(name)
+
+        def upload():
+            ok, elapsed = self._upload(name, data, content_type)
+            if on_done is not None:
+                on_done(ok, elapsed)
+
+        future = self._executor.submit(upload)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return self.store.url(name)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits for the queued uploads; returns whether all of them finished within `timeout`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                pending = next(iter(self._pending), None)
+            if pending is None:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            try:
+                pending.result(timeout=remaining)
+            except Exception:
+                pass
+
+    def shutdown(self, timeout: Optional[float] = 30):
+        # Queued uploads are finished, their URLs were already handed out
+        self.flush(timeout)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'pending': len(self._pending), **self._stats}
+
+    def _upload(self, name: str, data: bytes, content_type: str) -> tuple[bool, float]:
+        start_time = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                self.store.put(name, data, content_type)
+                with self._lock:
+                    self._stats['uploaded'] += 1
+                    self._stats['bytes'] += len(data)
+                return True, time.perf_counter() - start_time
+            except Exception as e:
+                if attempt == self.retries:
+                    logging.warning(f'Upload of {name} failed after {attempt + 1} attempts: {e}')
+                    with self._lock:
+                        self._stats['failed'] += 1
+                    return False, time.perf_counter() - start_time
+                with self._lock:
+                    self._stats['retried'] += 1
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._pending.discard(future)
+
+
+UPLOADER = Uploader(create_object_store())
@@ -0,0 +1,59 @@
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class TemplatePool(Generic[T]):
+    """Fully built objects, such as crews with their agents, tasks and LLM, reused across requests.
+
+    `acquire` hands out an idle object, or builds a new one when all of them are in use so that a burst
+    never waits for a template; `release` keeps at most `max_idle` of them. Whoever acquires an object
+    is responsible for resetting the state a previous user left on it.
+    """
+
+    def __init__(self, factory: Callable[[], T], max_idle: int):
+        self.factory = factory
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle: list[T] = []
+        self._built = 0
+        self._reused = 0
+
+    def acquire(self) -> T:
+        with self._lock:
+            if self._idle:
+                self._reused += 1
+                return self._idle.pop()
+            self._built += 1
+        return self.factory()
+
+    def release(self, item: T):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(item)
+
+    def prebuild(self, count: Optional[int] = None) -> int:
+        """Builds idle objects up to `count` (`max_idle` by default), e.g. at startup; returns how many were built."""
+        count = self.max_idle if count is None else min(count, self.max_idle)
+        with self._lock:
+            missing = max(0, count - len(self._idle))
+        for _ in range(missing):
+            item = self.factory()
+            with self._lock:
+                self._built += 1
+            self.release(item)
+        return missing
+
+    def clear(self):
+        with self._lock:
+            self._idle.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'idle': len(self._idle),
+                'max_idle': self.max_idle,
+                'built': self._built,
+                'reused': self._reused
+            }
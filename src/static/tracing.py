@@ -0,0 +1,208 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Any, Iterator, Optional
+
+# File every finished trace is appended to as one JSON line; tracing only runs for requests asking for it when unset
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH')
+# `json` for the format returned by /run, `otlp` for OTLP/JSON (ExportTraceServiceRequest) as read by OTel collectors
+TRACE_EXPORT_FORMAT = os.getenv('TRACE_EXPORT_FORMAT', 'json')
+
+_EXPORT_LOCK = threading.Lock()
+
+
+class Span:
+    """Timed operation within a trace, with attributes such as token counts and payload sizes."""
+
+    def __init__(self, trace: Optional['Trace'], name: str, parent: Optional['Span'], attributes: dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self._start_time = time.perf_counter()
+        self._activated = None
+
+    def set(self, **attributes: Any):
+        if self.trace is not None:
+            self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.duration is not None or self.trace is None:
+            return
+        self.duration = time.perf_counter() - self._start_time
+        if error is not None:
+            self.error = f'{type(error).__name__}: {error}'[:200]
+        if self._activated is not None and CURRENT_SPAN.get() is self:
+            CURRENT_SPAN.set(self.parent)
+        self.trace._finished(self)
+
+
+_NO_SPAN = Span(None, '', None, {})
+
+
+class Trace:
+    """Spans recorded on behalf of a single `call_id`, from any thread."""
+
+    def __init__(self, call_id: str):
+        self.call_id = call_id
+        self.trace_id = secrets.token_hex(16)
+        self.start_ns = time.time_ns()
+        self._start_time = time.perf_counter()
+        self._lock = threading.Lock()
+        self._spans: list[Span] = []
+        self._open = 0
+        self._exported = False
+
+    def start_span(self, name: str, parent: Optional[Span], **attributes: Any) -> Span:
+        with self._lock:
+            self._open += 1
+        return Span(self, name, parent, attributes)
+
+    def _finished(self, span: Span):
+        with self._lock:
+            self._open -= 1
+            self._spans.append(span)
+
+    def spans(self) -> list[Span]:
+        with self._lock:
+            return sorted(self._spans, key=lambda span: span.start_ns)
+
+    def to_dict(self) -> dict:
+        spans = self.spans()
+        breakdown: dict[str, dict[str, float]] = {}
+        for span in spans:
+            totals = breakdown.setdefault(span.name, {'count': 0, 'total_ms': 0.0})
+            totals['count'] += 1
+            totals['total_ms'] = round(totals['total_ms'] + span.duration * 1000, 1)
+        with self._lock:
+            open_spans = self._open
+        return {
+            'trace_id': self.trace_id,
+            'call_id': self.call_id,
+            'duration_ms': round((time.perf_counter() - self._start_time) * 1000, 1),
+            'open_spans': open_spans,
+            'breakdown': breakdown,
+            'spans': [
+                {
+                    'name': span.name,
+                    'span_id': span.span_id,
+                    'parent_id': span.parent.span_id if span.parent is not None else None,
+                    'start_ms': round((span.start_ns - self.start_ns) / 1e6, 1),
+                    'duration_ms': round(span.duration * 1000, 1),
+                    'error': span.error,
+                    'attributes': span.attributes
+                }
+                for span in spans
+            ]
+        }
+
+    def to_otlp(self) -> dict:
+        return {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', 'gdsc-assistant')]},
+            'scopeSpans': [{
+                'scope': {'name': __name__},
+                'spans': [
+                    {
+                        'traceId': self.trace_id,
+                        'spanId': span.span_id,
+                        'parentSpanId': span.parent.span_id if span.parent is not None else '',
+                        'name': span.name,
+                        'kind': 1,
+                        'startTimeUnixNano': str(span.start_ns),
+                        'endTimeUnixNano': str(span.start_ns + int(span.duration * 1e9)),
+                        'attributes': [_otlp_attribute(key, value) for key, value in
+                                       {'call_id': self.call_id, **span.attributes}.items()],
+                        'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+                    }
+                    for span in self.spans()
+                ]
+            }]
+        }]}
+
+
+def _otlp_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+CURRENT_TRACE: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('trace', default=None)
+CURRENT_SPAN: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('span', default=None)
+
+
+def tracing_enabled(requested: bool = False) -> bool:
+    return requested or TRACE_EXPORT_PATH is not None
+
+
+def start_trace(call_id: str) -> Trace:
+    """Creates the trace of `call_id` and makes it current for the calling context and everything started from it."""
+    trace = Trace(call_id)
+    CURRENT_TRACE.set(trace)
+    CURRENT_SPAN.set(None)
+    return trace
+
+
+def finish_trace(trace: Trace) -> dict:
+    """The trace as returned by /run, exported to TRACE_EXPORT_PATH the first time it is finished."""
+    if TRACE_EXPORT_PATH is not None and not trace._exported:
+        trace._exported = True
+        record = trace.to_otlp() if TRACE_EXPORT_FORMAT == 'otlp' else trace.to_dict()
+        try:
+            with _EXPORT_LOCK, open(TRACE_EXPORT_PATH, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+        except OSError as e:
+            logging.warning(f'Could not export trace of call ID {trace.call_id}: {e}')
+    return trace.to_dict()
+
+
+def current_span() -> Span:
+    """The innermost active span, a no-op span outside of traced requests."""
+    span = CURRENT_SPAN.get()
+    return span if span is not None else _NO_SPAN
+
+
+def start_span(name: str, activate: bool = False, **attributes: Any) -> Span:
+    """Starts a span ended explicitly with `end()`, for operations that do not fit a `with` block.
+
+    An activated span becomes the parent of spans started in this context until it ends.
+    """
+    trace = CURRENT_TRACE.get()
+    if trace is None:
+        return _NO_SPAN
+    span = trace.start_span(name, CURRENT_SPAN.get(), **attributes)
+    if activate:
+        span._activated = True
+        CURRENT_SPAN.set(span)
+    return span
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    trace = CURRENT_TRACE.get()
+    if trace is None:
+        yield _NO_SPAN
+        return
+    current = trace.start_span(name, CURRENT_SPAN.get(), **attributes)
+    reset_token = CURRENT_SPAN.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        CURRENT_SPAN.reset(reset_token)
+        current.end(error)
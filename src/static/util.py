@@ -1,8 +1,13 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator, Optional
 
 import dotenv
 import sqlalchemy
-from crewai.telemetry import Telemetry
+from sqlalchemy import text
 
 dotenv.load_dotenv()
 
@@ -11,17 +16,91 @@ DB_USER="db_user"
 DB_ENDPOINT="db_endpoint"
 DB_PORT="db_port"
 
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 5))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 30 * 60))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 60_000))
+
 __db_url = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_ENDPOINT}:{DB_PORT}/postgres'
-ENGINE = sqlalchemy.create_engine(__db_url)
+ENGINE = sqlalchemy.create_engine(
+    __db_url,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING
+)
+# Same pool, but every transaction is started READ ONLY; used for all SQL coming from agents
+READ_ONLY_ENGINE = ENGINE.execution_options(postgresql_readonly=True)
+
+__checkout_lock = threading.Lock()
+__checkout_stats = {'checkouts': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+
+
+@contextmanager
+def tool_connection(timeout: Optional[float] = None) -> Iterator[sqlalchemy.Connection]:
+    """Read-only connection for agent tools with a statement timeout.
+
+    Statements are bounded by `DB_STATEMENT_TIMEOUT_MS`, or by `timeout` seconds when that is shorter.
+    """
+    start_time = time.perf_counter()
+    with READ_ONLY_ENGINE.connect() as connection:
+        wait = time.perf_counter() - start_time
+        with __checkout_lock:
+            __checkout_stats['checkouts'] += 1
+            __checkout_stats['total_wait'] += wait
+            __checkout_stats['max_wait'] = max(__checkout_stats['max_wait'], wait)
+
+        statement_timeout = DB_STATEMENT_TIMEOUT_MS
+        if timeout is not None:
+            statement_timeout = min(statement_timeout, max(1, int(timeout * 1000)))
+        connection.execute(text(f'SET LOCAL statement_timeout = {statement_timeout}'))
+        yield connection
+
+
+def warm_pool():
+    """Opens `DB_POOL_SIZE` connections up front, so the first requests do not pay for connecting."""
+    connections = []
+    try:
+        for _ in range(DB_POOL_SIZE):
+            connections.append(ENGINE.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def pool_stats() -> dict:
+    pool = ENGINE.pool
+    with __checkout_lock:
+        checkouts = __checkout_stats['checkouts']
+        return {
+            'size': pool.size(),
+            'in_use': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': pool.overflow(),
+            'checkouts': checkouts,
+            'avg_checkout_wait': __checkout_stats['total_wait'] / checkouts if checkouts else None,
+            'max_checkout_wait': __checkout_stats['max_wait']
+        }
+
 
 PROJECT_ROOT = Path(__file__).parent.parent
 
+# Bump whenever the PIRLS data changes, so everything cached for the old data stops matching
+DATASET_VERSION = os.getenv('DATASET_VERSION', 'pirls2021')
+
 
 # Disable CrewAI Telemetry
 def noop(*args, **kwargs):
     pass
 
 
-for attr in dir(Telemetry):
-    if callable(getattr(Telemetry, attr)) and not attr.startswith("__"):
-        setattr(Telemetry, attr, noop)
+def disable_crewai_telemetry():
+    """Called by the modules that import CrewAI; importing it here would load CrewAI with every tool and script."""
+    from crewai.telemetry import Telemetry
+
+    for attr in dir(Telemetry):
+        if callable(getattr(Telemetry, attr)) and not attr.startswith("__"):
+            setattr(Telemetry, attr, noop)
@@ -0,0 +1,73 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from src.static.object_store import UPLOADER
+from src.static.util import warm_pool
+from src.submission.create_submission import CREW_TEMPLATES
+from src.submission.tools.charts import CHART_RENDERER
+from src.submission.tools.sandbox import SANDBOX_POOL
+
+# `background` warms up while the server already answers, `blocking` before it does, `off` leaves it to the first requests
+WARM_UP = os.getenv('WARM_UP', 'background')
+DB_WARM_POOL = os.getenv('DB_WARM_POOL', '1') == '1'
+CREW_PREBUILD = os.getenv('CREW_PREBUILD', '1') == '1'
+
+_LOCK = threading.Lock()
+_STATUS = {'started_at': None, 'finished_at': None, 'steps': {}, 'errors': {}}
+
+
+def _start_chart_workers():
+    # Workers import the plotting libraries; the object store client is shared by all uploads
+    CHART_RENDERER.warm_up()
+    UPLOADER.store.connect()
+
+
+def _steps() -> dict[str, Callable[[], object]]:
+    steps = {}
+    if DB_WARM_POOL:
+        steps['db_pool'] = warm_pool
+    if CREW_PREBUILD:
+        # Imports CrewAI and langchain and creates the shared Bedrock client on the way
+        steps['crews'] = CREW_TEMPLATES.prebuild
+    steps['charts'] = _start_chart_workers
+    steps['sandbox'] = SANDBOX_POOL.warm_up
+    return steps
+
+
+def warm_up() -> dict:
+    """Loads everything the server imports lazily and opens its pools, so the first requests do not pay for it.
+
+    Failed steps are logged and skipped; whatever they did not load is loaded by the first request needing it.
+    Returns the duration of every step.
+    """
+    with _LOCK:
+        _STATUS['started_at'] = time.time()
+    for name, step in _steps().items():
+        start_time = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logging.warning(f'Warm-up step {name} failed: {e}')
+            with _LOCK:
+                _STATUS['errors'][name] = str(e)
+        with _LOCK:
+            _STATUS['steps'][name] = round(time.perf_counter() - start_time, 3)
+    with _LOCK:
+        _STATUS['finished_at'] = time.time()
+    return warm_up_status()
+
+
+def warm_up_status() -> dict:
+    with _LOCK:
+        started_at: Optional[float] = _STATUS['started_at']
+        finished_at: Optional[float] = _STATUS['finished_at']
+        return {
+            'mode': WARM_UP,
+            'done': finished_at is not None,
+            'duration': round(finished_at - started_at, 3) if finished_at is not None else None,
+            'steps': dict(_STATUS['steps']),
+            'errors': dict(_STATUS['errors'])
+        }
@@ -0,0 +1,91 @@
+"""Precomputed country-level aggregates of the PIRLS data.
+
+Typical questions ("average reading score by country", "what % of students in Poland reached Advanced")
+otherwise make the agent join Students, Countries, StudentScoreResults and Benchmarks over the whole
+student population. These materialized views turn them into single-table lookups; they are described
+to the agent in `db_info`.
+
+Usage:
+    python -m src.submission.aggregates build      # create missing views and their indexes
+    python -m src.submission.aggregates refresh    # recompute the views after the data changed
+    python -m src.submission.aggregates rebuild    # drop and recreate the views
+"""
+import argparse
+import time
+
+from sqlalchemy import text
+
+from src.static.util import ENGINE
+
+AGGREGATES = {
+    'country_score_stats': (
+        '''
+        SELECT C.Country_ID, C.Name AS Country_Name, SSR.Code AS Score_Code,
+               COUNT(*) AS Students, AVG(SSR.Score) AS Mean_Score, STDDEV_SAMP(SSR.Score) AS Std_Score
+        FROM StudentScoreResults AS SSR
+        JOIN Students AS S ON S.Student_ID = SSR.Student_ID
+        JOIN Countries AS C ON C.Country_ID = S.Country_ID
+        WHERE SSR.Code LIKE 'ASR%'
+        GROUP BY C.Country_ID, C.Name, SSR.Code
+        ''',
+        ('Country_ID', 'Score_Code')
+    ),
+    'country_benchmarks': (
+        '''
+        SELECT C.Country_ID, C.Name AS Country_Name, B.Name AS Benchmark_Level, B.Score AS Benchmark_Score,
+               100.0 * AVG(CASE WHEN SSR.Score >= B.Score THEN 1 ELSE 0 END) AS Percentage_Students
+        FROM StudentScoreResults AS SSR
+        JOIN Students AS S ON S.Student_ID = SSR.Student_ID
+        JOIN Countries AS C ON C.Country_ID = S.Country_ID
+        CROSS JOIN Benchmarks AS B
+        WHERE SSR.Code = 'ASRREA_avg'
+        GROUP BY C.Country_ID, C.Name, B.Name, B.Score
+        ''',
+        ('Country_ID', 'Benchmark_Level')
+    ),
+    'country_counts': (
+        '''
+        SELECT C.Country_ID, C.Name AS Country_Name,
+               (SELECT COUNT(*) FROM Students AS S WHERE S.Country_ID = C.Country_ID) AS Students,
+               (SELECT COUNT(*) FROM Schools AS SC WHERE SC.Country_ID = C.Country_ID) AS Schools,
+               (SELECT COUNT(*) FROM Teachers AS T
+                JOIN Schools AS SC ON SC.School_ID = T.School_ID
+                WHERE SC.Country_ID = C.Country_ID) AS Teachers
+        FROM Countries AS C
+        ''',
+        ('Country_ID',)
+    )
+}
+
+
+def build_aggregates(drop: bool = False):
+    with ENGINE.begin() as connection:
+        for name, (query, key) in AGGREGATES.items():
+            start_time = time.perf_counter()
+            if drop:
+                connection.execute(text(f'DROP MATERIALIZED VIEW IF EXISTS {name}'))
+            connection.execute(text(f'CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {query}'))
+            # A unique index is what allows REFRESH ... CONCURRENTLY
+            connection.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS {name}_key ON {name} ({", ".join(key)})'))
+            print(f'{name}: built in {time.perf_counter() - start_time:.1f}s')
+
+
+def refresh_aggregates():
+    with ENGINE.begin() as connection:
+        for name in AGGREGATES:
+            start_time = time.perf_counter()
+            # Readers keep seeing the old rows while the view is recomputed
+            connection.execute(text(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {name}'))
+            print(f'{name}: refreshed in {time.perf_counter() - start_time:.1f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or refresh the precomputed PIRLS aggregates.')
+    parser.add_argument('command', choices=['build', 'refresh', 'rebuild'])
+    args = parser.parse_args()
+
+    if args.command == 'refresh':
+        refresh_aggregates()
+    else:
+        build_aggregates(drop=args.command == 'rebuild')
+    print('Done. Bump DATASET_VERSION of running servers, so they do not serve cached results of the old data.')
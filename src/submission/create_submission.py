@@ -1,22 +1,57 @@
+from typing import TYPE_CHECKING
+
 import dotenv
 
-from src.static.ChatBedrockWrapper import ChatBedrockWrapper
+from src.static.bedrock_client import shared_client
+from src.static.executor import CREW_POOL_WORKERS
+from src.static.pool import TemplatePool
 from src.static.submission import Submission
-from src.submission.crews.learningVoyager import learningVoyager
+
+if TYPE_CHECKING:
+    from src.submission.crews.learningVoyager import learningVoyager
 
 dotenv.load_dotenv()
 
+MODEL_ID = 'anthropic.claude-3-5-sonnet-20240620-v1:0'
+
+
+def build_crew() -> 'learningVoyager':
+    """A crew template on the shared Bedrock client; `call_id` is bound by the request that acquires it."""
+    # CrewAI and langchain take seconds to import, so they are loaded with the first crew, not with the server
+    from src.static.ChatBedrockWrapper import ChatBedrockWrapper
+    from src.submission.crews.learningVoyager import learningVoyager
+
+    llm = ChatBedrockWrapper(
+        model_id=MODEL_ID,
+        model_kwargs={'temperature': 0},
+        call_id='',
+        client=shared_client()
+    )
+    return learningVoyager(llm=llm)
+
+
+# One idle crew per worker of the crew executor is enough to serve every concurrent run without building
+CREW_TEMPLATES: TemplatePool['learningVoyager'] = TemplatePool(build_crew, max_idle=CREW_POOL_WORKERS)
+
+
+class PooledSubmission(Submission):
+    """Runs a prompt on a crew template from `CREW_TEMPLATES`, with tokens accounted to `call_id`."""
+
+    def __init__(self, call_id: str):
+        self.call_id = call_id
+
+    def run(self, prompt: str) -> str:
+        crew = CREW_TEMPLATES.acquire()
+        try:
+            crew.llm.call_id = self.call_id
+            return crew.run(prompt)
+        finally:
+            CREW_TEMPLATES.release(crew)
+
 
 # This function is used to run evaluation of your model.
 # You MUST NOT change the signature of this function! The name of the function, name of the arguments,
 # number of the arguments and the returned type mustn't be changed.
 # You can modify only the body of this function so that it returned your implementation of the Submission class.
 def create_submission(call_id: str) -> Submission:
-    llm = ChatBedrockWrapper(
-        model_id='anthropic.claude-3-5-sonnet-20240620-v1:0',
-        model_kwargs={'temperature': 0},
-        call_id=call_id
-    )
-
-    crew = learningVoyager(llm=llm)
-    return crew
+    return PooledSubmission(call_id=call_id)
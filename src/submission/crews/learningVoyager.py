@@ -1,22 +1,90 @@
 from crewai import Agent, Crew, Process, Task
 from crewai.project import agent, crew, task
 
+from src.static.events import emit, start_answer_streaming
+from src.static.metrics import record_tool_call
+from src.static.tracing import span, start_span
+from src.static.util import disable_crewai_telemetry
+from src.submission.crews import schema_context
+from src.submission.crews.schema_context import SchemaIndex
 from src.static.submission import Submission
 from src.static.ChatBedrockWrapper import ChatBedrockWrapper
-from src.submission.tools.database import query_database
+from src.submission.tools.database import query_database, query_database_batch
 from src.submission.tools.eval_sql_code import eval_sql_code
 from src.submission.tools.visualization import visualization
 from src.submission.tools.gather_gdp_data import gather_gdp_data
 
+disable_crewai_telemetry()
 
 
 class learningVoyager(Submission):
+    """The crew, built once and reused for any number of prompts.
+
+    Agents and tasks are templates with `{prompt}`, `{schema}` and `{schema_context}` placeholders that CrewAI
+    fills in on every `kickoff`, so a run only binds its inputs. Runs of one instance must not overlap.
+    """
+
     def __init__(self, llm: ChatBedrockWrapper):
         self.llm = llm
+        self._crew = self.crew()
 
     def run(self, prompt: str) -> str:
-        self.prompt = prompt
-        return self.crew().kickoff().raw
+        with span('crew.run', prompt_chars=len(prompt)) as run_span:
+            self._reset_run_state()
+            self._started_tasks = 0
+            self._start_next_task()
+            retrieval = schema_context.SCHEMA_RETRIEVAL
+            result = self._crew.kickoff(inputs={
+                'prompt': prompt,
+                # The backstory is part of the cached prompt prefix, so it gets the same schema text on every run:
+                # the whole description, or with retrieval only the overview and the parts relevant to the prompt
+                # go into the task description after it
+                'schema': SCHEMA_INDEX.overview if retrieval else db_info,
+                # Greetings and off-topic prompts match no chunk, they get no heading either
+                'schema_context': f'\n\nParts of the schema relevant to this question:\n\n{context}'
+                if retrieval and (context := SCHEMA_INDEX.context(prompt)) else ''
+            }).raw
+            run_span.set(answer_chars=len(result))
+            return result
+
+    def _reset_run_state(self):
+        # State CrewAI keeps on agents, tasks and the crew across kickoffs
+        for crew_agent in self._crew.agents:
+            crew_agent._times_executed = 0
+            crew_agent.tools_results = []
+        for crew_task in self._crew.tasks:
+            crew_task.tools_errors = 0
+            crew_task.delegations = 0
+        # Tool results are cached per run, SQL results are cached across runs by query_database itself
+        self._crew._cache_handler._cache.clear()
+
+    def _start_next_task(self):
+        task = self.tasks[self._started_tasks]
+        self._started_tasks += 1
+        if self._started_tasks == len(self.tasks):
+            # The last agent writes the answer the user reads, so its generation is streamed
+            start_answer_streaming()
+        emit('agent_started', agent=task.agent.role)
+        # Parent of the LLM and tool spans of this agent until its task completes
+        self._task_span = start_span('agent.task', activate=True, agent=task.agent.role, steps=0)
+
+    def _on_task_completed(self, output):
+        self._task_span.set(output_chars=len(getattr(output, 'raw', None) or ''))
+        self._task_span.end()
+        emit('task_completed', agent=getattr(output, 'agent', None))
+        if self._started_tasks < len(self.tasks):
+            self._start_next_task()
+
+    def _on_step(self, step):
+        self._task_span.set(steps=self._task_span.attributes.get('steps', 0) + 1)
+        # A step is either the final answer or a list of (AgentAction, observation) pairs
+        for action in step if isinstance(step, list) else [step]:
+            if isinstance(action, tuple):
+                action = action[0]
+            tool = getattr(action, 'tool', None)
+            if tool:
+                record_tool_call(tool)
+                emit('tool_called', tool=tool, tool_input=getattr(action, 'tool_input', None))
 
     @agent
     def postgreSQL_engineer(self) -> Agent:
@@ -40,16 +108,17 @@ class learningVoyager(Submission):
         Tools:
             - `eval_sql_code`: Evaluates SQL expressions for efficient query formation.
             - `query_database`: Executes database queries to retrieve and prepare data insights.
-            - `gather_gdp_data`: Gathers additional data about GDP of countres from gdp_data variable.
+            - `query_database_batch`: Executes several independent queries at once, e.g. one per country or group.
+            - `gather_gdp_data`: Gathers the GDP of the countries named in a query, from table country_gdp.
         """
         return Agent(
             role="PostgreSQL engineer", 
-            backstory=f"{postgreSQL_engineer_backstory}, perfect knowledge of {db_info}. When needed can use data from other sources.",
+            backstory=postgreSQL_engineer_backstory + ", perfect knowledge of {schema}. When needed can use data from other sources.",
             goal="Efficiently retrieve and analyze data to provide insightful, concise answers based on user questions. Relay the findings to education expert without discussing the query process. When appropriate, prepare data visualizations and pass unrelated questions to education expert with humor. When visualization is needed pass this request to next agent",
             llm=self.llm,
             allow_delegation=False,
             verbose=True,
-            tools=[eval_sql_code, query_database, gather_gdp_data]
+            tools=[eval_sql_code, query_database, query_database_batch, gather_gdp_data]
         )
     
     
@@ -105,7 +174,7 @@ class learningVoyager(Submission):
             - Visualization requests are prepared with sufficient data.
         """
         return Task(
-            description=f"based on user input: {self.prompt}. Translate user queries into PostgreSQL commands, retrieve relevant data, and conduct any required analysis. Apply statistical techniques as needed, generating clear, actionable insights. Pass findings to education expert in straightforward language, omitting technical query details and focusing on meaningful data insights. Humorously inform education expert when questions are unrelated. When visualization is needed pass this request to education expert",
+            description="based on user input: {prompt}. Translate user queries into PostgreSQL commands, retrieve relevant data, and conduct any required analysis. Apply statistical techniques as needed, generating clear, actionable insights. Pass findings to education expert in straightforward language, omitting technical query details and focusing on meaningful data insights. Humorously inform education expert when questions are unrelated. When visualization is needed pass this request to education expert{schema_context}",
             expected_output="Deliver insights and necessary data points to education expert without mentioning query operations. Humorously pass along unrelated questions, ensure visualizations contain sufficient data points.",
             agent=self.postgreSQL_engineer())
     
@@ -133,9 +202,9 @@ class learningVoyager(Submission):
             - A disclaimer for unrelated questions indicating that the Education Expert doesn't have the information.
             - If a visualization is created, it is included in the output.
         """
-         return Task(
+        return Task(
             description=f"{tell_story_description}.You create visualization when possible",
-            expected_output=f"Very Short and condensed answer for: {self.prompt}.Pay atention for answer being closely related to the question asked. give final answer to user then - choose 3 key insights with use hyphens - You can make interpretation what this result could mean. if question specifies - At the end you can give up to 3 useful tips with hyphens (for example: how to improve students results in the future or improve schooling systems, improve teaching) based on question's topic. You can't tell what queries were made or what other agents said. Avoid technical language. For question is unrelated with PIRLS dataset you can tell as a education expert you don't know how to. If visualization is created with visualization tool - put an output to your answer",
+            expected_output="Very Short and condensed answer for: {prompt}.Pay atention for answer being closely related to the question asked. give final answer to user then - choose 3 key insights with use hyphens - You can make interpretation what this result could mean. if question specifies - At the end you can give up to 3 useful tips with hyphens (for example: how to improve students results in the future or improve schooling systems, improve teaching) based on question's topic. You can't tell what queries were made or what other agents said. Avoid technical language. For question is unrelated with PIRLS dataset you can tell as a education expert you don't know how to. If visualization is created with visualization tool - put an output to your answer",
             agent=self.education_expert(),
         )
         
@@ -162,6 +231,7 @@ class learningVoyager(Submission):
             - `verbose`: Enables detailed logging for the process.
             - `max_iter`: Sets the maximum number of iterations to 4.
             - `cache`: Enables caching for efficient execution.
+            - `step_callback`/`task_callback`: Report progress events to streaming clients.
         """
         return Crew(
             agents=self.agents,
@@ -169,7 +239,9 @@ class learningVoyager(Submission):
             process=Process.sequential,
             verbose=True,
             max_iter=3,
-            cache=True
+            cache=True,
+            step_callback=self._on_step,
+            task_callback=self._on_task_completed
         )
 
 
@@ -279,7 +351,39 @@ db_info = '''
     Benchmark: Boolean - boolean value saying if the country was a benchmark country. 
     TestType: String - describes the type of test taken in this country. It's either digital or paper.
     '
-    
+
+    # Precomputed aggregate tables
+    These tables already contain the country-level results computed from the tables above.
+    Always use them first, they answer typical questions with a single-table lookup and no joins.
+
+    country_score_stats - score statistics of each country for every ASR* score code
+    Country_ID: Int - references country from Countries table
+    Country_Name: String - full name of the country
+    Score_Code: String - score code from StudentScoreEntries table, e.g. ASRREA_avg
+    Students: Int - number of students with this score
+    Mean_Score: Float - average score of the country's students
+    Std_Score: Float - standard deviation of the score among the country's students
+
+    country_benchmarks - share of the country's students reaching each benchmark in overall reading (ASRREA_avg)
+    Country_ID: Int - references country from Countries table
+    Country_Name: String - full name of the country
+    Benchmark_Level: String - name of the benchmark from Benchmarks table, e.g. 'Low International Benchmark'
+    Benchmark_Score: Int - lower bound of the benchmark
+    Percentage_Students: Float - percentage (0-100) of the country's students with a score equal to or above Benchmark_Score
+
+    country_counts - size of each country's sample
+    Country_ID: Int - references country from Countries table
+    Country_Name: String - full name of the country
+    Students: Int - number of students
+    Schools: Int - number of schools
+    Teachers: Int - number of teachers
+
+    country_gdp - GDP of each country in current US$ (World Bank); benchmarking participants such as Canadian provinces, Moscow City or Dubai have the GDP of their country
+    Country_ID: Int - references country from Countries table
+    Country_Name: String - full name of the country
+    GDP_Name: String - name of the country in the World Bank data
+    GDP_USD: BigInt - gross domestic product in US dollars
+
     # Content & Connections
     Generally Entries tables contain questions themselves and Answers tables contain answers to those question. 
     For example StudentQuestionnaireEntries table contains questions asked in the students' questionnaire and 
@@ -397,16 +501,33 @@ Which country had all schools closed for more than eight weeks?
 
 What percentage of students in Poland reached the Advanced International Benchmark?
 ‘
-    WITH benchmark_score AS (
-        SELECT Score FROM Benchmarks
-        WHERE Name = Advanced International Benchmark'
-    )
-    SELECT SUM(CASE WHEN SSR.score >= bs.Score THEN 1 ELSE 0 END) / COUNT(*)::float as percentage
-    FROM Students AS S
-    JOIN Countries AS C ON C.Country_ID = S.Country_ID
-    JOIN StudentScoreResults AS SSR ON SSR.Student_ID = S.Student_ID
-    CROSS JOIN benchmark_score AS bs
-    WHERE C.Name = 'Poland' AND SSR.Code = 'ASRREA_avg'
+    SELECT Percentage_Students
+    FROM country_benchmarks
+    WHERE Country_Name = 'Poland' AND Benchmark_Level = 'Advanced International Benchmark';
+‘
+
+What is the average reading score by country?
+‘
+    SELECT Country_Name, Mean_Score
+    FROM country_score_stats
+    WHERE Score_Code = 'ASRREA_avg'
+    ORDER BY Mean_Score DESC;
+‘
+
+How many students and schools took part in France?
+‘
+    SELECT Students, Schools
+    FROM country_counts
+    WHERE Country_Name = 'France';
+‘
+
+Is GDP related to the average reading score?
+‘
+    SELECT CSS.Country_Name, G.GDP_USD, CSS.Mean_Score
+    FROM country_score_stats AS CSS
+    JOIN country_gdp AS G ON G.Country_ID = CSS.Country_ID
+    WHERE CSS.Score_Code = 'ASRREA_avg'
+    ORDER BY G.GDP_USD DESC;
 '
 '
 
@@ -421,7 +542,7 @@ Recognize the specific benchmark level, such as "Low International Benchmark," "
 Translate Query into SQL:
 
 Step 1: Use SELECT to specify the desired output (e.g., counting distinct countries).
-Step 2: From the relevant table(s) in the schema, such as country_benchmarks, student_performance, or another table where the percentage and benchmark data are stored.
+Step 2: Use the country_benchmarks table, it stores the percentage of students (Percentage_Students) reaching each benchmark (Benchmark_Level) for every country.
 Step 3: Apply the WHERE clause to filter records based on the benchmark and percentage condition.
 Step 4: Return the number of entities that meet the criteria.
 SQL Query Template: Here’s the SQL query template to follow:
@@ -459,7 +580,7 @@ Copy code
 SELECT COUNT(DISTINCT country_id)
 FROM country_benchmarks
 WHERE percentage_students > 90
-  AND benchmark_level = 'Intermediate Benchmark';
+  AND benchmark_level = 'Intermediate International Benchmark';
 By following this process, you will effectively translate user queries into SQL statements that retrieve the correct information. Make sure to handle potential variations in benchmark levels, percentage thresholds, and other conditions.
 
 End of instructions
@@ -478,6 +599,8 @@ Tips: Try optimize queries, especially the more complex ones. For example use:
 
 '''
 
+SCHEMA_INDEX = SchemaIndex(db_info)
+
 
 postgreSQL_engineer_backstory =  f'''
 You are a proficient data analyst and PostgreSQL expert with deep knowledge of the PIRLS dataset and schema. Your main role is to respond to natural language questions by translating them into efficient SQL queries, gathering and analyzing data, and delivering concise, insightful responses. You apply various statistical techniques when needed, such as descriptive, inferential, and predictive analysis, to ensure thorough answers.
@@ -519,6 +642,3 @@ tell_story_description= '''
     You can't mention your thoughts
     you give short and condensed answers.
 '''
-
-
-gdp_data = [('Australia', 1723827000000), ('Austria', 516034000000), ('Azerbaijan', 72356000000), ('Bahrain', 43205000000), ('Belgium', 632217000000), ('Brazil', 2173666000000), ('Croatia', 82689000000), ('Cyprus', 32230000000), ('Czech Republic', 330858000000), ('Denmark', 404199000000), ('Egypt', 395926000000), ('Finland', 300187000000), ('France', 3030904000000), ('Georgia', 30536000000), ('Germany', 4456081000000), ('Hong Kong SAR, China', 382055000000), ('Hungary', 212389000000), ('Iran, Islamic Rep.', 401505000000), ('Ireland', 545629000000), ('Israel', 509901000000), ('Italy', 2254851000000), ('Jordan', 50814000000), ('Kazakhstan', 261421000000), ('Kosovo', 10438000000), ('Latvia', 43627000000), ('Lithuania', 77836000000), ('Macao SAR, China', 382055000000), ('Malta', 20957000000), ('Montenegro', 7405000000), ('Morocco', 141109000000), ('Netherlands', 1118125000000), ('New Zealand', 253466000000), ('North Macedonia', 14761000000), ('Norway', 485513000000), ('Oman', 108192000000), ('Portugal', 287080000000), ('Qatar', 235770000000), ('Russian Federation', 2021421000000), ('Saudi Arabia', 1067583000000), ('Serbia', 75187000000), ('Singapore', 501428000000), ('Slovak Republic', 132794000000), ('Slovenia', 68217000000), ('South Africa', 377782000000), ('Spain', 1580695000000), ('Sweden', 593268000000), ('Türkiye', 1118125000000), ('United Arab Emirates', 504173000000), ('United States', 27360935000000), ('Uzbekistan', 90889000000), ('Alberta, Canada', 2140086000000), ('British Columbia, Canada', 2140086000000), ('Newfoundland & Labrador, Canada', 2140086000000), ('Quebec, Canada', 2140086000000), ('Moscow City, Russian Federation', 2021421000000), ('South Africa', 377782000000), ('Bulgaria', 101584000000), ('Taiwan, China', 1180000000000), ('United Kingdom', 3340032000000), ('Dubai, United Arab Emirates', 504173000000), ('Abu Dhabi, United Arab Emirates', 504173000000), ('Albania', 22978000000), ('Poland', 811229000000)]
@@ -0,0 +1,104 @@
+import math
+import os
+import re
+from collections import Counter
+
+SCHEMA_RETRIEVAL = os.getenv('SCHEMA_RETRIEVAL', '1') == '1'
+SCHEMA_TOP_K = int(os.getenv('SCHEMA_TOP_K', 8))
+
+_WORDS = re.compile(r'[A-Za-z0-9]+')
+_CAMEL_CASE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+_TABLE_HEADER = re.compile(r'^\s*([A-Za-z_]+)\s*(?:-.*)?$')
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased words, with identifiers like StudentScoreResults or Country_ID also split into their parts."""
+    tokens = []
+    for word in _WORDS.findall(text.replace('_', ' ')):
+        parts = _CAMEL_CASE.findall(word)
+        for token in [word, *parts] if len(parts) > 1 else [word]:
+            token = token.lower()
+            # Poor man's stemming, enough to match "scores" with "Score" and "students" with "Students"
+            tokens.append(token[:-1] if len(token) > 3 and token.endswith('s') else token)
+    return tokens
+
+
+def split_chunks(text: str) -> list[str]:
+    """Splits the schema description into paragraphs; a paragraph ending with a colon is kept with the next one."""
+    chunks = []
+    pending = ''
+    for paragraph in re.split(r'\n\s*\n', text):
+        if not paragraph.strip():
+            continue
+        paragraph = pending + paragraph
+        if paragraph.rstrip().endswith(':'):
+            pending = paragraph + '\n\n'
+        else:
+            chunks.append(paragraph)
+            pending = ''
+    if pending:
+        chunks.append(pending)
+    return chunks
+
+
+class SchemaIndex:
+    """BM25 index over the table descriptions and worked examples of the schema prompt.
+
+    `overview` is the part every prompt needs: the names of all tables and the introduction. It does not
+    depend on the prompt, so it can sit in the cached prompt prefix. `context(prompt)` returns the `top_k`
+    chunks most relevant to the prompt and the descriptions of tables used by the selected chunks, in
+    their original order.
+    """
+
+    def __init__(self, text: str, k1: float = 1.5, b: float = 0.75):
+        self.chunks = split_chunks(text)
+        self.k1 = k1
+        self.b = b
+        self._terms = [Counter(tokenize(chunk)) for chunk in self.chunks]
+        self._lengths = [sum(terms.values()) for terms in self._terms]
+        self._avg_length = sum(self._lengths) / len(self._lengths)
+        document_frequency = Counter(term for terms in self._terms for term in terms)
+        self._idf = {
+            term: math.log(1 + (len(self.chunks) - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+        # A bare table name followed by a `Column: Type` line starts a table description
+        self.tables: dict[str, tuple[str, int]] = {}
+        for position, chunk in enumerate(self.chunks):
+            lines = chunk.strip().splitlines()
+            for line, next_line in zip(lines, lines[1:]):
+                match = _TABLE_HEADER.match(line)
+                if match and ':' in next_line:
+                    self.tables[match.group(1).lower()] = (match.group(1), position)
+
+    def score(self, prompt: str) -> list[float]:
+        query = set(tokenize(prompt))
+        scores = []
+        for terms, length in zip(self._terms, self._lengths):
+            score = 0.0
+            for term in query & terms.keys():
+                frequency = terms[term]
+                score += self._idf[term] * frequency * (self.k1 + 1) / (
+                        frequency + self.k1 * (1 - self.b + self.b * length / self._avg_length))
+            scores.append(score)
+        return scores
+
+    @property
+    def overview(self) -> str:
+        catalog = 'Available tables: ' + ', '.join(name for name, _ in self.tables.values())
+        # The first chunk introduces the dataset
+        return f'{catalog}\n\n{self.chunks[0]}'
+
+    def context(self, prompt: str, top_k: int = SCHEMA_TOP_K) -> str:
+        scores = self.score(prompt)
+        ranked = sorted(range(1, len(self.chunks)), key=lambda position: scores[position], reverse=True)
+        selected = {position for position in ranked[:top_k] if scores[position] > 0}
+
+        # Examples are only usable together with the tables they query
+        for position in list(selected):
+            words = {word.lower() for word in _WORDS.findall(self.chunks[position])}
+            selected.update(self.tables[table][1] for table in words & self.tables.keys())
+
+        selected.discard(0)
+        return '\n\n'.join(self.chunks[position] for position in sorted(selected))
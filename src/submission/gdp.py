@@ -0,0 +1,191 @@
+"""GDP of the PIRLS countries as a table joinable with the PIRLS data.
+
+`GDP_DATA` holds GDP in current US$ from the World Bank, under World Bank names ("Iran, Islamic Rep.",
+"Türkiye", "Moscow City, Russian Federation"). Loading matches those names once against `Countries.Name`
+and stores the result in `country_gdp`, keyed by `Country_ID`, so the agent joins GDP with scores in SQL
+instead of matching names itself. Benchmarking participants (Canadian provinces, Moscow City, Dubai,
+Abu Dhabi) and the parts of the United Kingdom carry the GDP of their country.
+
+Usage:
+    python -m src.submission.gdp load      # (re)create country_gdp and report countries without GDP
+"""
+import argparse
+import difflib
+import re
+import time
+import unicodedata
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+
+from src.static.util import ENGINE
+
+GDP_TABLE = 'country_gdp'
+
+GDP_DATA = [
+    ('Australia', 1723827000000), ('Austria', 516034000000), ('Azerbaijan', 72356000000), ('Bahrain', 43205000000),
+    ('Belgium', 632217000000), ('Brazil', 2173666000000), ('Croatia', 82689000000), ('Cyprus', 32230000000),
+    ('Czech Republic', 330858000000), ('Denmark', 404199000000), ('Egypt', 395926000000), ('Finland', 300187000000),
+    ('France', 3030904000000), ('Georgia', 30536000000), ('Germany', 4456081000000),
+    ('Hong Kong SAR, China', 382055000000), ('Hungary', 212389000000), ('Iran, Islamic Rep.', 401505000000),
+    ('Ireland', 545629000000), ('Israel', 509901000000), ('Italy', 2254851000000), ('Jordan', 50814000000),
+    ('Kazakhstan', 261421000000), ('Kosovo', 10438000000), ('Latvia', 43627000000), ('Lithuania', 77836000000),
+    ('Macao SAR, China', 382055000000), ('Malta', 20957000000), ('Montenegro', 7405000000),
+    ('Morocco', 141109000000), ('Netherlands', 1118125000000), ('New Zealand', 253466000000),
+    ('North Macedonia', 14761000000), ('Norway', 485513000000), ('Oman', 108192000000), ('Portugal', 287080000000),
+    ('Qatar', 235770000000), ('Russian Federation', 2021421000000), ('Saudi Arabia', 1067583000000),
+    ('Serbia', 75187000000), ('Singapore', 501428000000), ('Slovak Republic', 132794000000),
+    ('Slovenia', 68217000000), ('South Africa', 377782000000), ('Spain', 1580695000000), ('Sweden', 593268000000),
+    ('Türkiye', 1118125000000), ('United Arab Emirates', 504173000000), ('United States', 27360935000000),
+    ('Uzbekistan', 90889000000), ('Alberta, Canada', 2140086000000), ('British Columbia, Canada', 2140086000000),
+    ('Newfoundland & Labrador, Canada', 2140086000000), ('Quebec, Canada', 2140086000000),
+    ('Moscow City, Russian Federation', 2021421000000), ('Bulgaria', 101584000000),
+    ('Taiwan, China', 1180000000000), ('United Kingdom', 3340032000000),
+    ('Dubai, United Arab Emirates', 504173000000), ('Abu Dhabi, United Arab Emirates', 504173000000),
+    ('Albania', 22978000000), ('Poland', 811229000000),
+]
+
+# Words that only some of the sources use: "Iran, Islamic Rep. of", "Hong Kong SAR", "Moscow City"
+_DROPPED_WORDS = {'the', 'of', 'rep', 'islamic', 'sar', 'city'}
+# Whole name parts spelled differently by PIRLS, the World Bank and users, after normalization
+_ALIASES = {
+    'turkey': 'turkiye',
+    'russia': 'russian federation',
+    'russian fed': 'russian federation',
+    'uae': 'united arab emirates',
+    'rsa': 'south africa',
+    'chinese taipei': 'taiwan china',
+    'czechia': 'czech republic',
+    'slovakia': 'slovak republic',
+    'usa': 'united states',
+    'united states america': 'united states',
+    'macedonia': 'north macedonia',
+    'uk': 'united kingdom',
+    'u k': 'united kingdom',
+    'britain': 'united kingdom',
+    'great britain': 'united kingdom',
+    'taiwan': 'taiwan china'
+}
+# Participants the World Bank has no separate GDP for
+_PARENT_COUNTRIES = {'england': 'united kingdom', 'northern ireland': 'united kingdom'}
+_MIN_SIMILARITY = 0.85
+
+
+def _parts(name: str, aliases: bool = True) -> list[str]:
+    """Comma-separated parts of a country name, ASCII-folded, lowercased and without punctuation."""
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().casefold()
+    # "South Africa (6)": footnote marks of the PIRLS reports
+    name = re.sub(r'\(.*?\)', ' ', name.replace('&', ' and '))
+    parts = []
+    for part in name.split(','):
+        part = ' '.join(word for word in re.findall(r'[a-z0-9]+', part) if word not in _DROPPED_WORDS)
+        if part:
+            parts.append(_ALIASES.get(part, part) if aliases else part)
+    return parts
+
+
+def name_keys(name: str) -> list[str]:
+    """Keys a PIRLS country is looked up by, most specific first.
+
+    The whole normalized name, its first part ("Hong Kong SAR" for "Hong Kong SAR, China"), then the
+    country a benchmarking participant belongs to ("Western Cape, RSA").
+    """
+    parts = _parts(name)
+    if not parts:
+        return []
+    keys = [' '.join(parts), parts[0], parts[-1], _PARENT_COUNTRIES.get(parts[0])]
+    return [key for i, key in enumerate(keys) if key and key not in keys[:i]]
+
+
+def match_countries(
+        countries: Iterable[tuple[int, str]],
+        gdp_data: Iterable[tuple[str, int]] = GDP_DATA
+) -> tuple[dict[int, tuple[str, str, int]], list[str]]:
+    """Matches `(Country_ID, Name)` pairs to GDP entries by normalized name, then by close spelling.
+
+    Returns {Country_ID: (Name, GDP name, GDP)} and the names without a match.
+    """
+    gdp_data = list(gdp_data)
+    index: dict[str, tuple[str, int]] = {}
+    for gdp_name, gdp in gdp_data:
+        index.setdefault(' '.join(_parts(gdp_name)), (gdp_name, gdp))
+    for gdp_name, gdp in gdp_data:
+        # "Hong Kong SAR, China" is also found as "Hong Kong SAR", unless an entry has that whole name
+        index.setdefault(_parts(gdp_name)[0], (gdp_name, gdp))
+
+    matched, unmatched = {}, []
+    for country_id, name in countries:
+        entry: Optional[tuple[str, int]] = None
+        for key in name_keys(name):
+            entry = index.get(key)
+            if entry is None:
+                close = difflib.get_close_matches(key, index, n=1, cutoff=_MIN_SIMILARITY)
+                entry = index[close[0]] if close else None
+            if entry is not None:
+                break
+        if entry is None:
+            unmatched.append(name)
+        else:
+            matched[country_id] = (name, *entry)
+    return matched, unmatched
+
+
+def mentioned(query: str, rows: Iterable[tuple]) -> list[tuple]:
+    """The rows whose country (`row[1]`) or GDP name (`row[2]`) is mentioned in `query`."""
+    phrases: dict[str, list[tuple]] = {}
+    for row in rows:
+        for name in (row[1], row[2]):
+            spellings = set()
+            for parts in (_parts(name), _parts(name, aliases=False)):
+                if parts:
+                    spellings.update((' '.join(parts), parts[0]))
+            spellings.update(alias for alias, part in _ALIASES.items() if part in spellings)
+            for spelling in spellings:
+                if row not in phrases.setdefault(spelling, []):
+                    phrases[spelling].append(row)
+
+    remaining = f" {' '.join(_parts(query.replace(',', ' '), aliases=False))} "
+    found = []
+    # Longest first, so that "Moscow City, Russian Fed." does not also count as the Russian Federation
+    for phrase in sorted(phrases, key=len, reverse=True):
+        if f' {phrase} ' in remaining:
+            remaining = remaining.replace(f' {phrase} ', ' | ')
+            found += [row for row in phrases[phrase] if row not in found]
+    return found
+
+
+def load_gdp():
+    start_time = time.perf_counter()
+    with ENGINE.begin() as connection:
+        countries = connection.execute(text('SELECT Country_ID, Name FROM Countries')).all()
+        matched, unmatched = match_countries(countries)
+        connection.execute(text(f'''
+            CREATE TABLE IF NOT EXISTS {GDP_TABLE} (
+                Country_ID INT PRIMARY KEY,
+                Country_Name TEXT NOT NULL,
+                GDP_Name TEXT NOT NULL,
+                GDP_USD BIGINT NOT NULL
+            )
+        '''))
+        connection.execute(text(f'DELETE FROM {GDP_TABLE}'))
+        if matched:
+            connection.execute(
+                text(f'INSERT INTO {GDP_TABLE} VALUES (:country_id, :country_name, :gdp_name, :gdp_usd)'),
+                [{'country_id': country_id, 'country_name': name, 'gdp_name': gdp_name, 'gdp_usd': gdp}
+                 for country_id, (name, gdp_name, gdp) in matched.items()]
+            )
+    print(f'{GDP_TABLE}: {len(matched)} of {len(countries)} countries loaded in {time.perf_counter() - start_time:.1f}s')
+    if unmatched:
+        print(f'No GDP for: {"; ".join(sorted(unmatched))}')
+    unused = {gdp_name for gdp_name, _ in GDP_DATA} - {gdp_name for _, gdp_name, _ in matched.values()}
+    if unused:
+        print(f'GDP entries matching no country: {"; ".join(sorted(unused))}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load the GDP of the PIRLS countries into the database.')
+    parser.add_argument('command', choices=['load'])
+    args = parser.parse_args()
+
+    load_gdp()
+    print('Done. Bump DATASET_VERSION of running servers, so they do not serve cached results of the old data.')
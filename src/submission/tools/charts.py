@@ -0,0 +1,169 @@
+"""Chart rendering in a pool of worker processes.
+
+pyplot keeps the current figure in global state, so threads drawing at the same time draw onto each
+other's charts, and a 300 dpi render holds the GIL for the whole crew. Charts are therefore drawn on
+their own `matplotlib.figure.Figure` with the Agg backend, in separate processes that stay alive
+(with matplotlib, pandas and seaborn imported once) for all later charts.
+
+Charts are content-addressed: the hash of everything that determines the image (chart type, data, axes,
+palette, format and resolution) names the uploaded object and keys `CHART_CACHE`, so a chart that was
+already uploaded is neither rendered nor uploaded again.
+"""
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Optional
+
+from src.static.cache import LRUCache
+
+# Worker processes; 0 renders in the calling thread
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', min(4, os.cpu_count() or 1)))
+CHART_RENDER_TIMEOUT = float(os.getenv('CHART_RENDER_TIMEOUT', 30))
+# `spawn` does not inherit the server's threads and locks, which forking a threaded process would
+CHART_WORKER_START_METHOD = os.getenv('CHART_WORKER_START_METHOD', 'spawn')
+# `png`, `svg` or `webp`; SVG and WebP charts and PNGs below 300 dpi render and download faster
+CHART_FORMAT = os.getenv('CHART_FORMAT', 'png')
+CHART_DPI = int(os.getenv('CHART_DPI', 300))
+CHART_CACHE_ENABLED = os.getenv('CHART_CACHE_ENABLED', '1') == '1'
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', 1024))
+# Should not outlive the uploaded objects, e.g. when the bucket expires them
+CHART_CACHE_TTL = float(os.getenv('CHART_CACHE_TTL', 24 * 60 * 60))
+
+CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml', 'webp': 'image/webp'}
+
+# URLs of uploaded charts by `chart_key`, bounded to CHART_CACHE_SIZE entries
+CHART_CACHE = LRUCache(max_bytes=CHART_CACHE_SIZE, ttl=CHART_CACHE_TTL, sizeof=lambda url: 1)
+
+
+def chart_key(spec: dict[str, Any]) -> str:
+    """Content address of a chart, equal for specs that render to the same image."""
+    canonical = json.dumps(spec, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+    import pandas
+    import seaborn
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def render_chart(spec: dict[str, Any]) -> bytes:
+    """Draws the chart described by `spec` (as built by the visualization tool) and returns the image."""
+    import pandas as pd
+    import seaborn as sns
+    from matplotlib.figure import Figure
+
+    df = pd.DataFrame(spec['data'])
+    figure = Figure(figsize=(10, 6))
+    ax = figure.subplots()
+
+    x_axis, y_axis, palette = spec['x_axis'], spec['y_axis'], spec['palette']
+    if spec['chart_type'] == "scatter":
+        sns.scatterplot(data=df, x=x_axis, y=y_axis, palette=palette, ax=ax)
+    elif spec['chart_type'] == "line":
+        sns.lineplot(data=df, x=x_axis, y=y_axis, palette=palette, ax=ax)
+    elif spec['chart_type'] == "bar":
+        sns.barplot(data=df, x=x_axis, y=y_axis, palette=palette, ax=ax)
+
+    ax.set_title("Visual representation of data")
+    if spec['rotate_xticks']:
+        for label in ax.get_xticklabels():
+            label.set_rotation(spec['xticks_rotation'])
+            label.set_horizontalalignment('right')
+
+    img_data = io.BytesIO()
+    figure.savefig(img_data, format=spec.get('format', 'png'), dpi=spec.get('dpi', 300), bbox_inches='tight')
+    return img_data.getvalue()
+
+
+class ChartRenderer:
+    """Renders charts on a `ProcessPoolExecutor` whose workers are reused for every chart.
+
+    A render running longer than the timeout cannot be interrupted inside its worker, so the pool is
+    killed and replaced by a fresh one; charts of other requests rendering at that moment fail too.
+    The timeout counts from submission, so it also bounds the wait for a free worker.
+    """
+
+    def __init__(self, workers: int = CHART_WORKERS, timeout: float = CHART_RENDER_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._restarts = 0
+
+    def render(self, spec: dict[str, Any]) -> bytes:
+        if self.workers <= 0:
+            return render_chart(spec)
+        executor = self._get_executor()
+        future = executor.submit(render_chart, spec)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # A chart still waiting for a busy worker is dropped without touching the renders in progress
+            if not future.cancel():
+                self._restart(executor)
+            raise TimeoutError(f'Rendering the chart took longer than {self.timeout:g}s')
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+
+    def warm_up(self) -> int:
+        """Starts every worker, each importing the plotting libraries as it starts; returns how many run.
+
+        Returns once a worker answered, the others keep starting and take charts when they are ready.
+        """
+        if self.workers <= 0:
+            _init_worker()
+            return 0
+        executor = self._get_executor()
+        # Workers are started on demand, one per submitted task that finds no idle worker
+        for future in [executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+        return len(executor._processes or {})
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'workers': self.workers, 'running': self._executor is not None, 'restarts': self._restarts}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(CHART_WORKER_START_METHOD),
+                    initializer=_init_worker
+                )
+            return self._executor
+
+    def _restart(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is not executor:
+                # Another render already replaced it
+                return
+            self._executor = None
+            self._restarts += 1
+        logging.warning('Restarting the chart rendering workers')
+        # shutdown() alone would wait for the stuck render to finish
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+CHART_RENDERER = ChartRenderer()
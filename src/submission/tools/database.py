@@ -1,6 +1,181 @@
+import contextvars
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional
+
 from langchain_core.tools import tool
 from sqlalchemy import text
-from src.static.util import ENGINE
+from src.static.cancellation import CancellationToken, CrewCancelledError, current_token
+from src.static.events import emit
+from src.static.metrics import record_sql
+from src.static.tracing import current_span, span
+from src.static.util import DATASET_VERSION, ENGINE, tool_connection
+from src.submission.tools.preflight import QUERY_PREFLIGHT, QueryRejected, check_statement, gate, short_error
+from src.submission.tools.query_log import record_query
+from src.submission.tools.result_format import QUERY_RESULT_TOKENS, ResultFormatter, estimate_tokens
+from src.submission.tools.snapshot import duckdb, snapshot_cursor, snapshot_enabled
+from src.submission.tools.sql_cache import SQL_CACHE, SQL_CACHE_ENABLED, invalidate_sql_cache
+from src.submission.tools.sql_utils import canonicalize_sql, returns_rows
+
+QUERY_FETCH_SIZE = int(os.getenv('QUERY_FETCH_SIZE', 500))
+# The agent has the query in its own tool call already
+QUERY_ECHO = os.getenv('QUERY_ECHO', '0') == '1'
+# query_database_batch: queries per call, queries running at once per call, seconds for the whole call
+# and the output budget shared by its results
+QUERY_BATCH_MAX_QUERIES = int(os.getenv('QUERY_BATCH_MAX_QUERIES', 10))
+QUERY_BATCH_CONCURRENCY = int(os.getenv('QUERY_BATCH_CONCURRENCY', 4))
+QUERY_BATCH_TIMEOUT = float(os.getenv('QUERY_BATCH_TIMEOUT', 60))
+QUERY_BATCH_RESULT_TOKENS = int(os.getenv('QUERY_BATCH_RESULT_TOKENS', 2400))
+# Smallest share of the budget a query's result gets, however many queries the batch has
+_MIN_BATCH_QUERY_TOKENS = 150
+
+
+def _cancel_backend(pid: int):
+    # Runs from the thread cancelling the call, so it needs its own connection
+    with ENGINE.connect() as connection:
+        connection.execute(text('SELECT pg_cancel_backend(:pid)'), {'pid': pid})
+
+
+def _estimate_rows(connection, query: str) -> Optional[int]:
+    # Planner estimate only, EXPLAIN without ANALYZE does not run the query
+    try:
+        plan = connection.execute(text(f'EXPLAIN (FORMAT JSON) {query}')).scalar()
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception:
+        return None
+
+
+def _read_rows(cursor, columns: list[str], budget: int) -> tuple[ResultFormatter, bool]:
+    """Reads rows in batches until neither the shown rows nor the column summaries need more,
+    so memory stays bounded however many rows the query returns.
+
+    Returns the formatter holding the rows and whether the result was read to the end.
+    """
+    formatter = ResultFormatter(columns, budget)
+    while batch := cursor.fetchmany(QUERY_FETCH_SIZE):
+        formatter.add(batch)
+        if not formatter.wants_more:
+            return formatter, cursor.fetchone() is None
+    return formatter, True
+
+
+def _execute_postgres(
+        query: str,
+        token: CancellationToken,
+        budget: int
+) -> tuple[Optional[ResultFormatter], bool, Optional[int], Optional[str]]:
+    # Server-side cursors only work for row returning statements, not e.g. EXPLAIN or SHOW
+    streamable = returns_rows(query)
+    # Never let a statement outlive the call it was issued for
+    with tool_connection(timeout=token.remaining()) as connection:
+        pid = connection.connection.dbapi_connection.get_backend_pid()
+        handle = token.on_cancel(lambda: _cancel_backend(pid))
+        try:
+            token.raise_if_cancelled()
+            estimate, note = None, None
+            if QUERY_PREFLIGHT and streamable:
+                query, estimate, note = gate(connection, query)
+            options = {'stream_results': True, 'max_row_buffer': QUERY_FETCH_SIZE} if streamable else {}
+            result = connection.execution_options(**options).execute(text(query))
+            formatter, exhausted = _read_rows(result, list(result.keys()), budget) if result.returns_rows else (None, True)
+            result.close()
+            if not exhausted and estimate is None:
+                estimate = _estimate_rows(connection, query)
+        finally:
+            token.remove_callback(handle)
+    return formatter, exhausted, None if exhausted else estimate, note
+
+
+def _execute_snapshot(
+        query: str,
+        token: CancellationToken,
+        budget: int
+) -> tuple[Optional[ResultFormatter], bool, Optional[int], Optional[str]]:
+    cursor = snapshot_cursor()
+    handle = token.on_cancel(cursor.interrupt)
+    try:
+        token.raise_if_cancelled()
+        cursor.execute(query)
+        columns = [column[0] for column in cursor.description or []]
+        formatter, exhausted = _read_rows(cursor, columns, budget) if cursor.description else (None, True)
+    finally:
+        token.remove_callback(handle)
+    return formatter, exhausted, None, None
+
+
+def _execute(query: str, token: CancellationToken, budget: int) -> str:
+    start_time = time.perf_counter()
+    backend = 'postgres'
+    if snapshot_enabled() and returns_rows(query):
+        try:
+            formatter, exhausted, total_rows, note = _execute_snapshot(query, token, budget)
+            backend = 'duckdb'
+        except duckdb.Error:
+            # PostgreSQL-only syntax or functions, PostgreSQL itself can still answer
+            token.raise_if_cancelled()
+    if backend == 'postgres':
+        formatter, exhausted, total_rows, note = _execute_postgres(query, token, budget)
+    elapsed = time.perf_counter() - start_time
+    rows = formatter.rows if formatter is not None else 0
+    emit('sql_done', ok=True, rows=rows, truncated=not exhausted, time=elapsed, backend=backend)
+    record_query(query, elapsed, rows, backend)
+    record_sql(elapsed, rows, backend)
+    current_span().set(backend=backend, rows=rows, truncated=not exhausted)
+
+    if formatter is None:
+        return 'Statement executed, it returned no rows.'
+    result = formatter.render(exhausted, total_rows)
+    return f'{result}\nNote: {note}' if note else result
+
+
+def _rejected(e: QueryRejected, tool_span) -> str:
+    emit('sql_done', ok=False, rejected=e.reason)
+    tool_span.set(rejected=e.reason)
+    return f'Query rejected: {e}'
+
+
+def _run_query(query: str, token: CancellationToken, budget: int = QUERY_RESULT_TOKENS) -> str:
+    """Checks, runs and formats one agent query within `budget` tokens, answering from the SQL cache when possible.
+
+    Rejected and failing queries return their error message for the agent rather than raising.
+    """
+    with span('tool.query_database', query_chars=len(query)) as tool_span:
+        try:
+            statement = check_statement(query) if QUERY_PREFLIGHT else query
+        except QueryRejected as e:
+            return _rejected(e, tool_span)
+
+        # The same rows render differently within another budget
+        key = (DATASET_VERSION, canonicalize_sql(query), budget)
+        ret = SQL_CACHE.get(key) if SQL_CACHE_ENABLED else None
+        if ret is not None:
+            emit('sql_done', ok=True, cached=True)
+            tool_span.set(cached=True, result_chars=len(ret), result_tokens=estimate_tokens(ret))
+            return f'Query: {query}\n{ret}' if QUERY_ECHO else ret
+
+        start_time = time.perf_counter()
+        try:
+            ret = _execute(statement, token, budget)
+        except QueryRejected as e:
+            token.raise_if_cancelled()
+            return _rejected(e, tool_span)
+        except Exception as e:
+            token.raise_if_cancelled()
+            elapsed = time.perf_counter() - start_time
+            emit('sql_done', ok=False)
+            backend = 'duckdb' if snapshot_enabled() and returns_rows(query) else 'postgres'
+            record_query(query, elapsed, None, backend, ok=False)
+            record_sql(elapsed, None, backend, ok=False)
+            tool_span.set(failed=True)
+            return f'Wrong query, encountered exception {short_error(e)}.'
+
+        if SQL_CACHE_ENABLED:
+            SQL_CACHE.put(key, ret)
+        tool_span.set(cached=False, result_chars=len(ret), result_tokens=estimate_tokens(ret))
+        return f'Query: {query}\n{ret}' if QUERY_ECHO else ret
+
 
 @tool
 def query_database(query: str) -> str:
@@ -10,7 +185,9 @@ def query_database(query: str) -> str:
         query (str): The SQL query to execute.
 
     Returns:
-        str: The results of the query as a string, where each row is separated by a newline.
+        str: The number of rows, the column names and the rows, one per line with values separated by " | ".
+             Results too large to show in full list their first rows and a summary of every column
+             (min, max and mean of numbers, most frequent values of text).
 
     Raises:
         Exception: If the query is invalid or encounters an exception during execution.
@@ -21,16 +198,83 @@ def query_database(query: str) -> str:
     #     return 'WARNING! The query you are about to perform has no record limitations! In case of large tables and ' \
     #            'joins this will return an incomprehensible output.'
 
-    with ENGINE.connect() as connection:
-        try:
-            res = connection.execute(text(query))
-        except Exception as e:
-            return f'Wrong query, encountered exception {e}.'
+    token = current_token()
+    token.raise_if_cancelled()
+    return _run_query(query, token)
+
 
-    max_result_len = 3_000
-    ret = '\n'.join(", ".join(map(str, result)) for result in res)
-    if len(ret) > max_result_len:
-        ret = ret[:max_result_len] + '...\n(results too long. Output truncated.)'
+def _label(query: str, index: int) -> str:
+    # An optional leading "-- label" comment names the result, otherwise its position does
+    match = re.match(r'\s*--\s*(.+)', query)
+    return f'{index}. {match.group(1).strip()}' if match else f'{index}.'
 
-    return f'Query: {query}\nResult: {ret}'
 
+@tool
+def query_database_batch(queries: list[str]) -> str:
+    """Run several independent queries on the PIRLS postgres database at once and return all results.
+
+    Use it instead of several query_database calls when the queries do not depend on each other's results,
+    e.g. the same statistic for several countries or groups. Start a query with a comment such as
+    "-- girls, Poland" to label its result.
+
+    Args:
+        queries (list[str]): The SQL queries to execute, one SELECT statement each.
+
+    Returns:
+        str: The result of every query in the given order, each under its number and label, in the format
+             of query_database. Longer batches get shorter results.
+    """
+    token = current_token()
+    token.raise_if_cancelled()
+    if not queries:
+        return 'No queries given.'
+    if len(queries) > QUERY_BATCH_MAX_QUERIES:
+        return f'Too many queries, send at most {QUERY_BATCH_MAX_QUERIES} per call.'
+
+    with span('tool.query_database_batch', queries=len(queries)) as batch_span:
+        # Identical queries run once
+        unique: dict[str, str] = {}
+        for query in queries:
+            unique.setdefault(canonicalize_sql(query), query)
+        budget = max(_MIN_BATCH_QUERY_TOKENS, min(QUERY_RESULT_TOKENS, QUERY_BATCH_RESULT_TOKENS // len(unique)))
+
+        # Stops the statements still running when the batch times out, and with the call when it is cancelled
+        start_time = time.monotonic()
+        deadline = start_time + QUERY_BATCH_TIMEOUT
+        if token.deadline is not None:
+            deadline = min(deadline, token.deadline)
+        batch_token = CancellationToken(token.call_id, deadline)
+        handle = token.on_cancel(batch_token.cancel)
+
+        executor = ThreadPoolExecutor(
+            max_workers=min(QUERY_BATCH_CONCURRENCY, len(unique)),
+            thread_name_prefix='query-batch'
+        )
+        try:
+            # One context per query, so each gets its own span under the batch span
+            futures = {
+                key: executor.submit(contextvars.copy_context().run, _run_query, query, batch_token, budget)
+                for key, query in unique.items()
+            }
+            wait(futures.values(), timeout=batch_token.remaining())
+        finally:
+            token.remove_callback(handle)
+            batch_token.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+        token.raise_if_cancelled()
+
+        results, timed_out = [], 0
+        for index, query in enumerate(queries, 1):
+            future = futures[canonicalize_sql(query)]
+            if future.done() and not future.cancelled() and not isinstance(future.exception(), CrewCancelledError):
+                # _run_query turns query errors into messages, anything else is a bug worth raising
+                result = future.result()
+            else:
+                timed_out += 1
+                result = f'Not finished after {time.monotonic() - start_time:.1f} seconds, the time limit of the batch. ' \
+                         f'Make the query cheaper or run it on its own with query_database.'
+            results.append(f'### {_label(query, index)}\n{result}')
+        ret = '\n\n'.join(results)
+        batch_span.set(unique=len(unique), timed_out=timed_out, result_chars=len(ret),
+                       result_tokens=estimate_tokens(ret))
+        return ret
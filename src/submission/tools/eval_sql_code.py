@@ -1,5 +1,8 @@
 from langchain_core.tools import tool
 
+from src.static.tracing import span
+from src.submission.tools.sandbox import SANDBOX_POOL
+
 
 @tool
 def eval_sql_code(code: str) -> str:
@@ -13,16 +16,20 @@ def eval_sql_code(code: str) -> str:
     str: The result of executing the code. If the code executes successfully, it returns "Code executed successfully."
                  If an exception occurs during execution, it returns the error message as a string.
     """
-    import sys
-    import io
+    # Runs in a sandbox worker process with its own stdout/stderr and CPU, memory and wall-clock limits
+    with span('tool.eval_sql_code', code_chars=len(code)) as tool_span:
+        try:
+            result = SANDBOX_POOL.run(code)
+        except TimeoutError as e:
+            tool_span.set(failed=True)
+            return f"Error during execution: {str(e)}"
 
-    old_stdout = sys.stdout
-    redirected_output = sys.stdout = io.StringIO()
-    try:
-        exec(code, {})
-        result = redirected_output.getvalue()
-        return result if result else "Code executed successfully."
-    except Exception as e:
-        return f"Error during execution: {str(e)}"
-    finally:
-        sys.stdout = old_stdout
\ No newline at end of file
+        output = result['stdout']
+        if result['stderr']:
+            output += f"\n[stderr]\n{result['stderr']}"
+        tool_span.set(output_chars=len(output))
+        if result['error'] is not None:
+            tool_span.set(failed=True, limit=result['limit'])
+            error = f"Error during execution: {result['error']}"
+            return f"{output.rstrip()}\n{error}" if output else error
+        return output if output else "Code executed successfully."
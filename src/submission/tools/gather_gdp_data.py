@@ -1,22 +1,73 @@
+import os
+import threading
+import time
+
+from langchain_core.tools import tool
+from sqlalchemy import text
+
+from src.static.tracing import span
+from src.static.util import DATASET_VERSION, ENGINE
+from src.submission.gdp import GDP_DATA, GDP_TABLE, mentioned
+
+# Seconds the rows of the table are reused, so a later `python -m src.submission.gdp load` is picked up
+GDP_CACHE_SECONDS = float(os.getenv('GDP_CACHE_SECONDS', 3600))
+# Seconds the built-in data is used before the table is tried again, when it could not be read
+GDP_RETRY_SECONDS = float(os.getenv('GDP_RETRY_SECONDS', 60))
+
+__lock = threading.Lock()
+# DATASET_VERSION -> (monotonic expiry, rows), like the keys of the SQL and answer caches
+__cache: dict[str, tuple[float, list[tuple]]] = {}
+
+
+def _gdp_rows() -> list[tuple]:
+    """(Country_ID, Country_Name, GDP_Name, GDP_USD) of every country."""
+    with __lock:
+        cached = __cache.get(DATASET_VERSION)
+        if cached is not None and time.monotonic() < cached[0]:
+            return cached[1]
+        try:
+            with ENGINE.connect() as connection:
+                rows = [tuple(row) for row in connection.execute(
+                    text(f'SELECT Country_ID, Country_Name, GDP_Name, GDP_USD FROM {GDP_TABLE}')
+                )]
+            expires_in = GDP_CACHE_SECONDS
+        except Exception:
+            # `python -m src.submission.gdp load` has not run: World Bank names, no ids to join on
+            rows = [(None, name, name, gdp) for name, gdp in GDP_DATA]
+            expires_in = GDP_RETRY_SECONDS
+        __cache[DATASET_VERSION] = (time.monotonic() + expires_in, rows)
+        return rows
+
+
 @tool
 def gather_gdp_data(query: str) -> str:
     """
-    Gathers GDP data from a predefined list of tuples if the query contains 'GDP'.
-    
+    Gathers the GDP (current US$, World Bank) of the countries named in the query, e.g. "GDP of Poland and Spain".
+
     Parameters:
-    query (str): The query string to check.
+    query (str): The query string naming the countries.
 
     Returns:
-    str: The result containing GDP data in a list of tuples, or an appropriate message.
+    str: Country_ID, country name and GDP of every named country, or how to get the GDP of all countries with SQL.
     """
-    try:
-        # Check if the query contains 'GDP'
-        if "GDP" in query.upper():
-            # Return the predefined global variable (gdp_data_source)
-            return gdp_data if gdp_data else "No GDP data found."
-        else:
-            return "No GDP-related information requested in the query."
-
-    except Exception as e:
-        # Return an error message if something goes wrong
-        return f"Error during data gathering: {str(e)}"
\ No newline at end of file
+    with span('tool.gather_gdp_data', query_chars=len(query)) as tool_span:
+        try:
+            rows = _gdp_rows()
+            found = mentioned(query, rows)
+            tool_span.set(countries=len(found))
+            joinable = rows and rows[0][0] is not None
+            hint = (f"For many countries, join table {GDP_TABLE} (Country_ID, Country_Name, GDP_USD) "
+                    f"on Country_ID in your SQL query instead." if joinable else "")
+            if not found:
+                return f"No country with GDP data found in the query. {hint}".strip()
+
+            lines = [f"{country_id}, {name}, {gdp}" if joinable else f"{name}, {gdp}"
+                     for country_id, name, _, gdp in found]
+            header = "Country_ID, Country_Name, GDP_USD" if joinable else "Country, GDP_USD"
+            result = '\n'.join([header, *lines, hint]).strip()
+            tool_span.set(result_chars=len(result))
+            return result
+
+        except Exception as e:
+            # Return an error message if something goes wrong
+            return f"Error during data gathering: {str(e)}"
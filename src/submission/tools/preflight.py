@@ -0,0 +1,144 @@
+"""Pre-flight checks of agent SQL, before it is run.
+
+`check_statement` only looks at the query text: one statement, read-only, no side-effecting functions.
+`gate` asks the PostgreSQL planner with a plain `EXPLAIN`, which also catches syntax errors and unknown
+tables or columns without running anything. Queries expected to return more than `QUERY_MAX_ROWS` rows
+or to cost more than `QUERY_MAX_COST` get a `LIMIT`, or are refused when even that would be too
+expensive. The agent gets a one-line reason and what to change instead of waiting for a statement timeout.
+"""
+import os
+from typing import Any, Iterator, Optional
+
+from sqlalchemy import text
+
+from src.static.metrics import SQL_PREFLIGHT
+from src.submission.tools.sql_utils import keywords, split_statements
+
+QUERY_PREFLIGHT = os.getenv('QUERY_PREFLIGHT', '1') == '1'
+# In planner cost units, roughly sequential page reads
+QUERY_MAX_COST = float(os.getenv('QUERY_MAX_COST', 5_000_000))
+QUERY_MAX_ROWS = int(os.getenv('QUERY_MAX_ROWS', 1_000_000))
+# `limit` runs queries over the thresholds with QUERY_AUTO_LIMIT when that makes them cheap enough, `refuse` never runs them
+QUERY_OVERSIZE_ACTION = os.getenv('QUERY_OVERSIZE_ACTION', 'limit')
+QUERY_AUTO_LIMIT = int(os.getenv('QUERY_AUTO_LIMIT', 10_000))
+
+_READ_STATEMENTS = {'select', 'with', 'values', 'table'}
+_BLOCKED_FUNCTIONS = {
+    'pg_sleep', 'pg_terminate_backend', 'pg_cancel_backend', 'set_config', 'pg_read_file', 'pg_read_binary_file',
+    'pg_ls_dir', 'lo_import', 'lo_export', 'dblink', 'dblink_exec'
+}
+_ALTERNATIVES = ('Filter with WHERE, aggregate with GROUP BY, or use the precomputed tables '
+                 '(country_score_stats, country_benchmarks, country_counts, country_gdp).')
+
+
+class QueryRejected(Exception):
+    """A query that was not run, with the reason (`statement`, `invalid`, `cost` or `rows`) and a message for the agent."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def short_error(e: Exception) -> str:
+    """Database error message without the SQLAlchemy wrapping (statement, parameters, documentation link)."""
+    return str(getattr(e, 'orig', None) or e).strip()
+
+
+def _reject(reason: str, message: str):
+    SQL_PREFLIGHT.inc(outcome=f'refused_{reason}')
+    raise QueryRejected(reason, message)
+
+
+def check_statement(query: str) -> str:
+    """Returns the query's only statement, without a trailing semicolon; raises `QueryRejected` for anything
+    but a single read-only query."""
+    statements = split_statements(query)
+    if not statements:
+        _reject('statement', 'The query is empty.')
+    if len(statements) > 1:
+        _reject('statement', f'Send one statement per call, the query has {len(statements)}.')
+    words = keywords(statements[0])
+    if not words or words[0] not in _READ_STATEMENTS:
+        first = words[0].upper() if words else statements[0].split()[0]
+        _reject('statement', f'Only SELECT queries can be run, not {first}. The database is read-only.')
+    # Only statements are checked, identifiers can be any word (`SELECT score AS update`); the read-only
+    # transaction stops anything else
+    depth, selecting = 0, False
+    for i, word in enumerate(words):
+        if word in ('(', ')'):
+            depth += 1 if word == '(' else -1
+            continue
+        if i >= 2 and words[i - 1] == '(' and words[i - 2] in ('as', 'materialized') and word not in _READ_STATEMENTS:
+            # The body of a WITH query: `WITH deleted AS (DELETE ... RETURNING *)`
+            _reject('statement', f'{word.upper()} is not allowed, the database is read-only. Use a plain SELECT.')
+        if depth == 0 and word == 'select':
+            selecting = True
+        elif depth == 0 and selecting and word in ('into', 'from'):
+            # SELECT ... INTO creates a table, INTO comes right after the select list
+            if word == 'into':
+                _reject('statement', 'SELECT ... INTO is not allowed, the database is read-only. Use a plain SELECT.')
+            selecting = False
+        if word in _BLOCKED_FUNCTIONS and words[i + 1:i + 2] == ['(']:
+            _reject('statement', f'Function {word} is not allowed.')
+    return statements[0]
+
+
+_EXPLAIN = 'EXPLAIN (FORMAT JSON) '
+
+
+def explain(connection, query: str) -> dict[str, Any]:
+    """Root node of the planner's plan; plain EXPLAIN does not run the query."""
+    try:
+        return connection.execute(text(f'{_EXPLAIN}{query}')).scalar()[0]['Plan']
+    except Exception as e:
+        # Syntax errors, unknown tables and columns, type mismatches: the query itself would fail the same way
+        lines = short_error(e).splitlines()
+        for i, line in enumerate(lines):
+            # Point "LINE 1:" and its caret at the agent's query rather than at the EXPLAIN around it
+            if _EXPLAIN in line:
+                lines[i] = line.replace(_EXPLAIN, '', 1)
+                if i + 1 < len(lines) and lines[i + 1].strip() == '^':
+                    lines[i + 1] = lines[i + 1][len(_EXPLAIN):]
+        _reject('invalid', '\n'.join(lines))
+
+
+def _nodes(plan: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _nodes(child)
+
+
+def _diagnose(plan: dict[str, Any]) -> str:
+    """What makes a plan expensive, in terms of the query."""
+    for node in _nodes(plan):
+        children = node.get('Plans', [])
+        if node['Node Type'] == 'Nested Loop' and 'Join Filter' not in node and len(children) == 2 and not any(
+                'Index Cond' in inner or 'Recheck Cond' in inner for inner in _nodes(children[1])):
+            return f'A join has no join condition and produces about {int(node["Plan Rows"])} rows.'
+    scans = [node for node in _nodes(plan) if node['Node Type'] == 'Seq Scan' and 'Filter' not in node]
+    if scans:
+        largest = max(scans, key=lambda node: node['Plan Rows'])
+        return f'It reads all {int(largest["Plan Rows"])} rows of {largest["Relation Name"]}.'
+    return ''
+
+
+def gate(connection, query: str) -> tuple[str, Optional[int], Optional[str]]:
+    """Checks the planner's estimates of a read-only query against the thresholds.
+
+    Returns the query to run (with a `LIMIT` added when needed), the estimated number of rows of the
+    original query and a note for the agent when the query was changed. Raises `QueryRejected`.
+    """
+    plan = explain(connection, query)
+    cost, rows = plan['Total Cost'], int(plan['Plan Rows'])
+    if cost <= QUERY_MAX_COST and rows <= QUERY_MAX_ROWS:
+        return query, rows, None
+
+    reason = 'cost' if cost > QUERY_MAX_COST else 'rows'
+    estimate = f'The planner estimates about {rows} rows at cost {cost:.0f} (limits: {QUERY_MAX_ROWS} rows, cost {QUERY_MAX_COST:.0f}).'
+    if QUERY_OVERSIZE_ACTION == 'limit':
+        # Planners stop early under a LIMIT, unless sorting or aggregating needs every row first
+        limited = f'SELECT * FROM ({query}) AS limited LIMIT {QUERY_AUTO_LIMIT}'
+        if explain(connection, limited)['Total Cost'] <= QUERY_MAX_COST:
+            SQL_PREFLIGHT.inc(outcome=f'limited_{reason}')
+            return limited, rows, f'Only the first {QUERY_AUTO_LIMIT} rows were read. {estimate} {_ALTERNATIVES}'
+    _reject(reason, ' '.join(part for part in ('Query not run.', estimate, _diagnose(plan), _ALTERNATIVES) if part))
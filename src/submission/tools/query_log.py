@@ -0,0 +1,185 @@
+"""Slow-query log and index advisor for the SQL written by the agents.
+
+Every `query_database` call is recorded with its duration and row count into a local SQLite store;
+PostgreSQL queries slower than `SLOW_QUERY_THRESHOLD_MS` also get their plan. The plan is a plain `EXPLAIN`,
+which does not run the query again; `QUERY_LOG_ANALYZE=1` logs `EXPLAIN (ANALYZE, BUFFERS)` instead, at most
+once per `QUERY_LOG_ANALYZE_INTERVAL` seconds since it runs the slowest queries a second time. Actual plans
+of every slow query come cheaper from PostgreSQL's `auto_explain` module, in the server log.
+
+Usage:
+    python -m src.submission.tools.query_log report            # slowest query shapes
+    python -m src.submission.tools.query_log advise [--create] # recommend (and create) indexes
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from sqlalchemy import text
+
+from src.static.util import ENGINE, PROJECT_ROOT, tool_connection
+from src.submission.tools.sql_utils import query_shape, returns_rows
+
+QUERY_LOG_ENABLED = os.getenv('QUERY_LOG_ENABLED', '1') == '1'
+QUERY_LOG_PATH = os.getenv('QUERY_LOG_PATH', str(PROJECT_ROOT.parent / 'query_log.sqlite'))
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 1_000))
+QUERY_LOG_ANALYZE = os.getenv('QUERY_LOG_ANALYZE', '0') == '1'
+QUERY_LOG_ANALYZE_INTERVAL = float(os.getenv('QUERY_LOG_ANALYZE_INTERVAL', 300))
+# Records waiting for the writer; beyond that new ones are dropped rather than queued
+QUERY_LOG_MAX_PENDING = int(os.getenv('QUERY_LOG_MAX_PENDING', 100))
+
+# The EAV joins described in db_info filter the answer tables by Code and join them on the entity ID
+KNOWN_INDEX_CANDIDATES = [
+    ('studentquestionnaireanswers', ('code', 'student_id')),
+    ('schoolquestionnaireanswers', ('code', 'school_id')),
+    ('studentscoreresults', ('code', 'student_id')),
+]
+
+# Recording happens off the request thread: one writer keeps SQLite happy and fetches the plans
+__writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='query-log')
+__local = threading.local()
+__pending = threading.BoundedSemaphore(QUERY_LOG_MAX_PENDING)
+__last_analyze = float('-inf')
+
+
+def _store() -> sqlite3.Connection:
+    if not hasattr(__local, 'connection'):
+        connection = sqlite3.connect(QUERY_LOG_PATH)
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS queries (
+                ts REAL, shape TEXT, query TEXT, duration_ms REAL, rows INTEGER, ok INTEGER, plan TEXT
+            )
+        ''')
+        __local.connection = connection
+    return __local.connection
+
+
+def _explain(query: str) -> Optional[str]:
+    # Only the writer thread gets here, so the interval needs no lock
+    global __last_analyze
+    options = 'FORMAT JSON'
+    if QUERY_LOG_ANALYZE and time.monotonic() - __last_analyze >= QUERY_LOG_ANALYZE_INTERVAL:
+        __last_analyze = time.monotonic()
+        options = 'ANALYZE, BUFFERS, FORMAT JSON'
+    try:
+        with tool_connection() as connection:
+            plan = connection.execute(text(f'EXPLAIN ({options}) {query}')).scalar()
+        return json.dumps(plan)
+    except Exception:
+        return None
+
+
+def _write(ts: float, query: str, duration: float, rows: Optional[int], backend: str, ok: bool):
+    duration_ms = duration * 1000
+    plan = None
+    # DuckDB answers from the snapshot, its plans say nothing about PostgreSQL indexes
+    if ok and backend == 'postgres' and duration_ms >= SLOW_QUERY_THRESHOLD_MS and returns_rows(query):
+        plan = _explain(query)
+    store = _store()
+    with store:
+        store.execute(
+            'INSERT INTO queries VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (ts, query_shape(query), query, duration_ms, rows, int(ok), plan)
+        )
+
+
+def record_query(query: str, duration: float, rows: Optional[int], backend: str = 'postgres', ok: bool = True):
+    """Records an executed query, returns immediately. Dropped when the writer is too far behind."""
+    if not QUERY_LOG_ENABLED:
+        return
+    if not __pending.acquire(blocking=False):
+        logging.warning(f'Query log is {QUERY_LOG_MAX_PENDING} records behind, dropping a query')
+        return
+    future = __writer.submit(_write, time.time(), query, duration, rows, backend, ok)
+    future.add_done_callback(lambda _: __pending.release())
+
+
+def report(limit: int = 20):
+    rows = _store().execute('''
+        SELECT shape, COUNT(*), AVG(duration_ms), MAX(duration_ms), SUM(duration_ms), AVG(rows),
+               SUM(1 - ok), SUM(plan IS NOT NULL)
+        FROM queries
+        GROUP BY shape
+        ORDER BY SUM(duration_ms) DESC
+        LIMIT ?
+    ''', (limit,)).fetchall()
+    for shape, count, avg_ms, max_ms, total_ms, avg_rows, failed, plans in rows:
+        print(f'{total_ms / 1000:8.1f}s total | {count:5d} calls | avg {avg_ms:8.1f}ms | max {max_ms:8.1f}ms | '
+              f'avg rows {avg_rows or 0:9.0f} | failed {failed} | plans {plans}')
+        print(f'    {shape[:300]}')
+
+
+def _seq_scan_filters(node: dict, found: dict[str, dict[str, bool]]):
+    if node.get('Node Type') == 'Seq Scan' and 'Filter' in node:
+        # e.g. ((code)::text = 'ASBG01'::text) -> code, compared for equality
+        columns = found.setdefault(node['Relation Name'], {})
+        for column, operator in re.findall(
+                r'\(*(\w+)\)?(?:::[\w ]+)?\s*(=|<>|<=|>=|<|>|~~|IN\b|= ANY)', node['Filter']):
+            column = column.lower()
+            columns[column] = columns.get(column, False) or operator in ('=', '= ANY', 'IN')
+    for child in node.get('Plans', []):
+        _seq_scan_filters(child, found)
+
+
+def _index_columns(columns: dict[str, bool]) -> tuple[str, ...]:
+    # A composite index serves equality filters on its leading columns and at most one range filter after them,
+    # so equality columns go first; otherwise columns keep the order in which the plans filter them
+    return (*(column for column, equality in columns.items() if equality),
+            *(column for column, equality in columns.items() if not equality))
+
+
+def recommend_indexes() -> list[tuple[str, tuple[str, ...]]]:
+    """Index candidates: the known EAV join indexes plus columns filtered by sequential scans in slow plans."""
+    candidates = list(KNOWN_INDEX_CANDIDATES)
+    found: dict[str, dict[str, bool]] = {}
+    for (plan,) in _store().execute('SELECT plan FROM queries WHERE plan IS NOT NULL'):
+        for entry in json.loads(plan):
+            _seq_scan_filters(entry['Plan'], found)
+    for relation, columns in found.items():
+        candidate = (relation, _index_columns(columns))
+        if columns and candidate not in candidates:
+            candidates.append(candidate)
+
+    with ENGINE.connect() as connection:
+        existing = connection.execute(text('SELECT tablename, indexdef FROM pg_indexes')).fetchall()
+
+    def is_indexed(relation, columns):
+        # Covered when an index on the table starts with exactly these columns
+        prefix = f'({", ".join(columns)}'
+        return any(table == relation and prefix in definition.lower() for table, definition in existing)
+
+    return [(relation, columns) for relation, columns in candidates if not is_indexed(relation, columns)]
+
+
+def advise(create: bool = False):
+    for relation, columns in recommend_indexes():
+        name = f'{relation}_{"_".join(columns)}_idx'
+        statement = f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {relation} ({", ".join(columns)})'
+        print(statement)
+        if create:
+            # CONCURRENTLY cannot run inside a transaction block
+            with ENGINE.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                start_time = time.perf_counter()
+                connection.execute(text(statement))
+                print(f'    created in {time.perf_counter() - start_time:.1f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report slow agent queries and recommend indexes.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    report_parser = subparsers.add_parser('report')
+    report_parser.add_argument('--limit', type=int, default=20)
+    advise_parser = subparsers.add_parser('advise')
+    advise_parser.add_argument('--create', action='store_true', help='create the recommended indexes')
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        report(args.limit)
+    else:
+        advise(args.create)
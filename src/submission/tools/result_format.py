@@ -0,0 +1,144 @@
+"""Compact, token-budgeted rendering of `query_database` results for the agents.
+
+Results start with their row count and column names. Rows are pipe-separated, since country names
+contain commas, with numbers shortened to six significant digits. When not every row fits into
+`QUERY_RESULT_TOKENS`, the first rows are shown followed by a summary of each column over all rows read:
+min/max/mean of numbers and the most frequent values of everything else. The agent sees the shape of a
+large result instead of a dump cut off mid-row, and rarely needs to query again to make sense of it.
+"""
+import math
+import os
+from collections import Counter
+from decimal import Decimal
+from typing import Any, Iterable, Optional
+
+QUERY_RESULT_TOKENS = int(os.getenv('QUERY_RESULT_TOKENS', 800))
+# Rows read to summarize a result that does not fit; the row count of larger results is the planner's estimate
+QUERY_SUMMARY_MAX_ROWS = int(os.getenv('QUERY_SUMMARY_MAX_ROWS', 100_000))
+QUERY_SUMMARY_TOP_K = int(os.getenv('QUERY_SUMMARY_TOP_K', 5))
+
+# Tokens are estimated rather than counted, for every row; tables of short values and numbers average
+# about 3.5 characters per token with Claude's tokenizer
+CHARS_PER_TOKEN = 3.5
+# Distinct values tracked per column, the rarest are dropped beyond that
+_MAX_DISTINCT = 10_000
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def format_value(value: Any) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (float, Decimal)) and math.isfinite(value):
+        # AVG() returns Decimals with 16 and more digits, a dozen tokens per value
+        if value == int(value) or abs(value) >= 1e6:
+            return str(round(value))
+        return f'{float(value):.6g}'
+    return str(value)
+
+
+class ColumnSummary:
+    """Running statistics of one column: min/max/mean of numeric values, frequencies of the others."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.nulls = 0
+        self.minimum = self.maximum = None
+        self.total = 0.0
+        self.numbers = 0
+        self.values: Counter = Counter()
+        self.approximate = False
+
+    def add(self, value: Any):
+        if value is None:
+            self.nulls += 1
+        elif isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            self.numbers += 1
+            self.total += float(value)
+            self.minimum = value if self.minimum is None else min(self.minimum, value)
+            self.maximum = value if self.maximum is None else max(self.maximum, value)
+        else:
+            self.values[value] += 1
+            if len(self.values) > _MAX_DISTINCT:
+                self.values = Counter(dict(self.values.most_common(_MAX_DISTINCT // 2)))
+                self.approximate = True
+
+    def render(self, top_k: int = QUERY_SUMMARY_TOP_K) -> str:
+        parts = []
+        if self.numbers:
+            parts.append(f'min {format_value(self.minimum)}, max {format_value(self.maximum)}, '
+                         f'mean {format_value(self.total / self.numbers)}')
+        if self.values:
+            distinct = f'over {_MAX_DISTINCT}' if self.approximate else f'{len(self.values)}'
+            top = ', '.join(f'{format_value(value)} ({count})' for value, count in self.values.most_common(top_k))
+            parts.append(f'{distinct} distinct, most frequent: {top}')
+        if self.nulls:
+            parts.append(f'{self.nulls} NULL')
+        return f'{self.name}: {"; ".join(parts) if parts else "no values"}'
+
+
+class ResultFormatter:
+    """Collects the rows of a result as they are fetched and renders them within `budget` tokens.
+
+    Only the rows that can be shown are kept; the others just update the column summaries.
+    """
+
+    def __init__(
+            self,
+            columns: list[str],
+            budget: int = QUERY_RESULT_TOKENS,
+            max_summary_rows: int = QUERY_SUMMARY_MAX_ROWS
+    ):
+        self.columns = columns
+        self.budget = budget
+        self.max_summary_rows = max_summary_rows
+        self.rows = 0
+        self.lines: list[str] = []
+        self.summaries = [ColumnSummary(column) for column in columns]
+        self._chars = 0
+        self._preview_full = False
+
+    @property
+    def wants_more(self) -> bool:
+        """Whether further rows still change the output."""
+        return not self._preview_full or self.rows < self.max_summary_rows
+
+    def add(self, rows: Iterable[tuple]):
+        for row in rows:
+            self.rows += 1
+            for summary, value in zip(self.summaries, row):
+                summary.add(value)
+            if not self._preview_full:
+                line = ' | '.join(map(format_value, row))
+                if self._chars + len(line) + 1 > self.budget * CHARS_PER_TOKEN:
+                    self._preview_full = True
+                else:
+                    self.lines.append(line)
+                    self._chars += len(line) + 1
+
+    def render(self, exhausted: bool, total_rows: Optional[int] = None) -> str:
+        header = ' | '.join(self.columns)
+        if exhausted and len(self.lines) == self.rows:
+            return '\n'.join([f'Rows: {self.rows}', header, *self.lines])
+
+        if exhausted:
+            total = f'{self.rows}'
+        elif total_rows is not None and total_rows > self.rows:
+            total = f'about {total_rows} (planner estimate)'
+        else:
+            total = f'more than {self.rows}'
+        covered = 'all rows' if exhausted else f'the first {self.rows} rows'
+        summary = [f'Summary of {covered}:', *(summary.render() for summary in self.summaries)]
+
+        # The summary goes first into the budget, the rows that still fit are shown above it
+        budget = self.budget * CHARS_PER_TOKEN - sum(len(line) + 1 for line in summary) - len(header) - 40
+        shown = []
+        for line in self.lines:
+            budget -= len(line) + 1
+            if budget < 0:
+                break
+            shown.append(line)
+        return '\n'.join([f'Rows: {total}, first {len(shown)} shown', header, *shown, *summary])
+
@@ -0,0 +1,340 @@
+"""Execution of agent-written Python in a pool of sandbox worker processes.
+
+`exec` in the server process shares it with every other request: redirecting `sys.stdout` to capture
+a snippet's output also captures whatever other threads print, and an endless loop or a huge
+allocation stalls or kills the whole server. Snippets therefore run in separate processes that are
+started ahead of time and reused, one snippet at a time, each capturing its own stdout and stderr.
+
+Every snippet gets a budget of CPU time (`RLIMIT_CPU`, raised by `SANDBOX_CPU_SECONDS` before each
+snippet), of address space on top of what the worker already uses (`RLIMIT_AS`) and of wall-clock
+time (enforced by the server, which kills the worker). A worker that crashed, was killed or hit a
+limit is replaced by a fresh one for the next snippet; snippets running in other workers are not
+affected.
+
+Workers drop the server's environment (AWS credentials, database URL, `ADMIN_TOKEN`) except for
+`SANDBOX_ENV_ALLOWLIST`, and the server modules `spawn` imported again with the main module, before
+running any snippet.
+"""
+import gc
+import io
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import types
+import time
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # Windows: only the wall-clock limit applies
+    resource = None
+
+from src.static.metrics import SANDBOX_LATENCY
+
+SANDBOX_WORKERS = int(os.getenv('SANDBOX_WORKERS', 2))
+SANDBOX_CPU_SECONDS = float(os.getenv('SANDBOX_CPU_SECONDS', 5))
+SANDBOX_WALL_SECONDS = float(os.getenv('SANDBOX_WALL_SECONDS', 10))
+# Time a new worker may take to start, not counted against the snippet's wall-clock limit
+SANDBOX_START_TIMEOUT = float(os.getenv('SANDBOX_START_TIMEOUT', 30))
+# Memory a snippet may allocate, on top of what the idle worker uses
+SANDBOX_MEMORY_MB = int(os.getenv('SANDBOX_MEMORY_MB', 512))
+SANDBOX_MAX_OUTPUT_CHARS = int(os.getenv('SANDBOX_MAX_OUTPUT_CHARS', 20_000))
+# Snippets can leave modules and builtins patched; workers are replaced after this many snippets
+SANDBOX_MAX_CALLS_PER_WORKER = int(os.getenv('SANDBOX_MAX_CALLS_PER_WORKER', 100))
+# `spawn` does not inherit the server's threads and locks, which forking a threaded process would
+SANDBOX_START_METHOD = os.getenv('SANDBOX_START_METHOD', 'spawn')
+# Environment variables the workers keep; everything else the server had is removed
+SANDBOX_ENV_ALLOWLIST = os.getenv('SANDBOX_ENV_ALLOWLIST', 'PATH,LANG,LC_ALL,LC_CTYPE,TZ,TMPDIR').split(',')
+
+
+class CPULimitExceeded(BaseException):
+    """Raised in a worker on SIGXCPU; a BaseException so that snippets catching `Exception` cannot swallow it."""
+
+
+def _raise_cpu_limit_exceeded(signum, frame):
+    raise CPULimitExceeded()
+
+
+def _address_space() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def _limit_memory(memory_mb: int):
+    if resource is None or memory_mb <= 0:
+        return
+    # Relative to the worker's own footprint, which depends on what importing this module pulled in
+    limit = (_address_space() or 0) + memory_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+    except (ValueError, OSError) as e:
+        logging.warning(f'Sandbox memory limit not applied: {e}')
+
+
+def _limit_cpu(cpu_seconds: float):
+    if resource is None or cpu_seconds <= 0:
+        return
+    # RLIMIT_CPU counts the worker's whole lifetime, so the budget starts from the time used so far
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    soft = math.ceil(usage.ru_utime + usage.ru_stime + cpu_seconds)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _unlimit_cpu():
+    if resource is not None:
+        hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    return f'{text[:max_chars]}\n... [{len(text) - max_chars} more characters truncated]'
+
+
+def _forget_server(keep_env: list[str]):
+    """Removes what the worker inherited from the server and snippets must not see."""
+    for name in list(os.environ):
+        if name not in keep_env:
+            del os.environ[name]
+    # `spawn` runs the server's main module again, with everything it imports and configures at import time
+    for name in ('__main__', '__mp_main__'):
+        sys.modules[name] = types.ModuleType(name)
+    needed = {module for module in sys.modules for kept in (__name__, 'src.static.metrics')
+              if kept == module or kept.startswith(f'{module}.')}
+    for name in [name for name in sys.modules if name.split('.')[0] == 'src' and name not in needed]:
+        del sys.modules[name]
+        parent, _, attribute = name.rpartition('.')
+        if parent in sys.modules:
+            sys.modules[parent].__dict__.pop(attribute, None)
+    gc.collect()
+
+
+def _worker_main(conn, cpu_seconds: float, memory_mb: int, max_output_chars: int, keep_env: list[str]):
+    # Ctrl-C in the server's terminal is for the server; it stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _forget_server(keep_env)
+    if hasattr(signal, 'SIGXCPU'):
+        signal.signal(signal.SIGXCPU, _raise_cpu_limit_exceeded)
+    _limit_memory(memory_mb)
+    conn.send(os.getpid())
+
+    while True:
+        try:
+            code = conn.recv()
+        except EOFError:
+            return
+        if code is None:
+            return
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        error, limit = None, None
+        _limit_cpu(cpu_seconds)
+        try:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                exec(code, {})
+        except CPULimitExceeded:
+            error, limit = f'CPU time limit of {cpu_seconds:g}s exceeded', 'cpu'
+        except MemoryError:
+            error, limit = f'Memory limit of {memory_mb} MB exceeded', 'memory'
+        except BaseException as e:  # SystemExit and KeyboardInterrupt raised by the snippet included
+            error = str(e) or type(e).__name__
+        finally:
+            _unlimit_cpu()
+
+        conn.send({
+            'stdout': _truncate(stdout.getvalue(), max_output_chars),
+            'stderr': _truncate(stderr.getvalue(), max_output_chars),
+            'error': error,
+            'limit': limit
+        })
+        if limit is not None:
+            # Let the server replace this worker; whatever the snippet left behind goes with it
+            return
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.calls = 0
+
+    def wait_ready(self, timeout: float):
+        # Starting the interpreter and importing this module takes up to a second; snippets wait for it
+        if not self.conn.poll(timeout):
+            self.stop(kill=True)
+            raise TimeoutError(f'Sandbox worker did not start within {timeout:g}s')
+        self.conn.recv()
+
+    def stop(self, kill: bool = False):
+        if not kill:
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                kill = True
+        if kill and self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+
+class SandboxPool:
+    """Runs snippets in `workers` reusable processes, one snippet per process at a time.
+
+    `run` waits up to the wall-clock limit for an idle worker and as long again for the snippet.
+    Workers are started on first use or by `warm_up`; a slot whose worker was killed or exited starts
+    a new one when it is next used.
+    """
+
+    def __init__(
+            self,
+            workers: int = SANDBOX_WORKERS,
+            cpu_seconds: float = SANDBOX_CPU_SECONDS,
+            wall_seconds: float = SANDBOX_WALL_SECONDS,
+            memory_mb: int = SANDBOX_MEMORY_MB,
+            max_calls_per_worker: int = SANDBOX_MAX_CALLS_PER_WORKER
+    ):
+        self.workers = workers
+        self.cpu_seconds = cpu_seconds
+        self.wall_seconds = wall_seconds
+        self.memory_mb = memory_mb
+        self.max_calls_per_worker = max_calls_per_worker
+        self._slots: queue.Queue[Optional[_Worker]] = queue.Queue()
+        for _ in range(workers):
+            self._slots.put(None)
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._stats = {'runs': 0, 'failed': 0, 'timeouts': 0, 'limits': 0, 'crashes': 0, 'started': 0, 'recycled': 0}
+
+    def run(self, code: str) -> dict:
+        """Returns the snippet's `stdout`, `stderr`, `error` (None if it ran through) and the `limit` it hit."""
+        start_time = time.perf_counter()
+        try:
+            worker = self._slots.get(timeout=self.wall_seconds)
+        except queue.Empty:
+            SANDBOX_LATENCY.observe(time.perf_counter() - start_time, outcome='busy')
+            raise TimeoutError(f'No sandbox worker became free within {self.wall_seconds:g}s')
+
+        result, outcome = None, 'ok'
+        try:
+            if worker is None or not worker.process.is_alive():
+                worker = self._start()
+            worker.calls += 1
+            worker.conn.send(code)
+            # poll() also returns once the worker died, recv() then raises EOFError
+            if worker.conn.poll(self.wall_seconds):
+                result = worker.conn.recv()
+                outcome = result['limit'] or ('error' if result['error'] else 'ok')
+            else:
+                outcome = 'timeout'
+                result = self._failed(f'Wall-clock limit of {self.wall_seconds:g}s exceeded', 'wall')
+        except (EOFError, OSError) as e:
+            outcome = 'crashed'
+            exitcode = None
+            if worker is not None:
+                # The pipe closes slightly before the process is reaped
+                worker.process.join(timeout=1)
+                exitcode = worker.process.exitcode
+            result = self._failed(f'Sandbox worker crashed (exit code {exitcode})' if exitcode is not None
+                                  else f'Sandbox worker failed: {e}', 'crashed')
+        finally:
+            worker = self._recycle(worker, outcome)
+            self._slots.put(worker)
+
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['failed'] += result['error'] is not None
+            self._stats['timeouts'] += outcome == 'timeout'
+            self._stats['limits'] += outcome in ('cpu', 'memory')
+            self._stats['crashes'] += outcome == 'crashed'
+        SANDBOX_LATENCY.observe(time.perf_counter() - start_time, outcome=outcome)
+        return result
+
+    def warm_up(self) -> int:
+        """Starts the workers of all idle slots, side by side; returns how many run."""
+        slots = []
+        while True:
+            try:
+                slots.append(self._slots.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            starting = [i for i, worker in enumerate(slots) if worker is None or not worker.process.is_alive()]
+            for i in starting:
+                slots[i] = self._start(wait=False)
+            for i in starting:
+                try:
+                    slots[i].wait_ready(SANDBOX_START_TIMEOUT)
+                except TimeoutError:
+                    slots[i] = None
+                    raise
+        finally:
+            for worker in slots:
+                self._slots.put(worker)
+        return sum(worker is not None for worker in slots)
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+        while True:
+            try:
+                worker = self._slots.get_nowait()
+            except queue.Empty:
+                return
+            if worker is not None:
+                worker.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'workers': self.workers, 'idle': self._slots.qsize(), **self._stats}
+
+    def _start(self, wait: bool = True) -> _Worker:
+        context = multiprocessing.get_context(SANDBOX_START_METHOD)
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=_worker_main,
+            args=(child_conn, self.cpu_seconds, self.memory_mb, SANDBOX_MAX_OUTPUT_CHARS, SANDBOX_ENV_ALLOWLIST),
+            name='sandbox',
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        with self._lock:
+            self._stats['started'] += 1
+        worker = _Worker(process, parent_conn)
+        if wait:
+            worker.wait_ready(SANDBOX_START_TIMEOUT)
+        return worker
+
+    def _recycle(self, worker: Optional[_Worker], outcome: str) -> Optional[_Worker]:
+        """Returns the worker to reuse for the slot, or None to start a fresh one on its next use."""
+        if worker is None:
+            return None
+        if outcome in ('ok', 'error') and worker.calls < self.max_calls_per_worker and not self._stopped:
+            return worker
+        if outcome not in ('ok', 'error'):
+            logging.warning(f'Replacing sandbox worker {worker.process.pid} after {outcome}')
+        # A worker stuck in the snippet is killed, the others stop after their current message
+        worker.stop(kill=outcome in ('timeout', 'crashed'))
+        with self._lock:
+            self._stats['recycled'] += 1
+        return None
+
+    @staticmethod
+    def _failed(error: str, limit: str) -> dict:
+        return {'stdout': '', 'stderr': '', 'error': error, 'limit': limit}
+
+
+SANDBOX_POOL = SandboxPool()
@@ -0,0 +1,97 @@
+"""Local columnar snapshot of the PIRLS data, queried with DuckDB.
+
+The PIRLS data is read-only, so `query_database` can run the agents' SQL against Parquet copies of the tables
+instead of going over the network to PostgreSQL. Enabled with `QUERY_BACKEND=duckdb`; queries DuckDB cannot
+run (PostgreSQL-only syntax or functions) fall back to PostgreSQL automatically.
+
+Requires the optional `duckdb` package.
+
+Usage:
+    python -m src.submission.tools.snapshot export   # dump every PIRLS table to SNAPSHOT_DIR as Parquet
+"""
+import argparse
+import os
+import threading
+import time
+from pathlib import Path
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+from src.static.util import DB_ENDPOINT, DB_PASSWORD, DB_PORT, DB_USER, PROJECT_ROOT
+from src.submission.aggregates import AGGREGATES
+from src.submission.gdp import GDP_TABLE
+
+QUERY_BACKEND = os.getenv('QUERY_BACKEND', 'postgres')
+SNAPSHOT_DIR = Path(os.getenv('SNAPSHOT_DIR', PROJECT_ROOT.parent / 'snapshot'))
+
+PIRLS_TABLES = [
+    'Students', 'StudentQuestionnaireEntries', 'StudentQuestionnaireAnswers',
+    'SchoolQuestionnaireEntries', 'SchoolQuestionnaireAnswers',
+    'TeacherQuestionnaireEntries', 'TeacherQuestionnaireAnswers',
+    'HomeQuestionnaireEntries', 'HomeQuestionnaireAnswers',
+    'CurriculumQuestionnaireEntries', 'CurriculumQuestionnaireAnswers',
+    'Schools', 'Teachers', 'StudentTeachers', 'Homes', 'Curricula',
+    'StudentScoreEntries', 'StudentScoreResults', 'Benchmarks', 'Countries',
+    *AGGREGATES, GDP_TABLE
+]
+
+__lock = threading.Lock()
+__database = None
+__local = threading.local()
+
+
+def snapshot_enabled() -> bool:
+    return QUERY_BACKEND == 'duckdb' and duckdb is not None and SNAPSHOT_DIR.is_dir()
+
+
+def _database():
+    global __database
+    with __lock:
+        if __database is None:
+            database = duckdb.connect(':memory:')
+            for path in sorted(SNAPSHOT_DIR.glob('*.parquet')):
+                database.execute(f"CREATE VIEW {path.stem} AS SELECT * FROM read_parquet('{path}')")
+            __database = database
+    return __database
+
+
+def snapshot_cursor():
+    """DuckDB cursor of the calling thread; all threads share one in-memory database of Parquet views."""
+    if not hasattr(__local, 'cursor'):
+        __local.cursor = _database().cursor()
+    return __local.cursor
+
+
+def export_snapshot(tables: list[str] = PIRLS_TABLES):
+    """Copies the tables from PostgreSQL to Parquet files through DuckDB's postgres extension."""
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    connection = duckdb.connect(':memory:')
+    connection.execute('INSTALL postgres')
+    connection.execute('LOAD postgres')
+    connection.execute(
+        f"ATTACH 'host={DB_ENDPOINT} port={DB_PORT} user={DB_USER} password={DB_PASSWORD} dbname=postgres' "
+        f"AS pirls (TYPE POSTGRES, READ_ONLY)"
+    )
+    for table in tables:
+        start_time = time.perf_counter()
+        # PostgreSQL folds unquoted names to lower case
+        name = table.lower()
+        path = SNAPSHOT_DIR / f'{name}.parquet'
+        connection.execute(f"COPY (SELECT * FROM pirls.public.{name}) TO '{path}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+        print(f'{name}: exported in {time.perf_counter() - start_time:.1f}s, {path.stat().st_size / 1e6:.1f} MB')
+    connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the PIRLS tables to a local Parquet snapshot.')
+    parser.add_argument('command', choices=['export'])
+    parser.add_argument('--tables', nargs='*', default=PIRLS_TABLES)
+    args = parser.parse_args()
+
+    if duckdb is None:
+        raise SystemExit('The snapshot requires the duckdb package: pip install duckdb')
+    export_snapshot(args.tables)
+    print(f'Done. Start the server with QUERY_BACKEND=duckdb SNAPSHOT_DIR={SNAPSHOT_DIR} to use it.')
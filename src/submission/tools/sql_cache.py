@@ -0,0 +1,17 @@
+import os
+from typing import Optional
+
+from src.static.cache import LRUCache
+
+SQL_CACHE_ENABLED = os.getenv('SQL_CACHE_ENABLED', '1') == '1'
+SQL_CACHE_MAX_BYTES = int(os.getenv('SQL_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Process-wide, the PIRLS data only changes together with DATASET_VERSION
+SQL_CACHE = LRUCache(max_bytes=SQL_CACHE_MAX_BYTES)
+
+
+def invalidate_sql_cache(dataset_version: Optional[str] = None) -> int:
+    """Drops cached results of `dataset_version`, or of every version when not given."""
+    if dataset_version is None:
+        return SQL_CACHE.clear()
+    return SQL_CACHE.invalidate_where(lambda key: key[0] == dataset_version)
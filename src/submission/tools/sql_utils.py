@@ -0,0 +1,85 @@
+import re
+
+_SQL_TOKENS = re.compile(r"""
+    (?P<string>'(?:[^']|'')*')
+    |(?P<identifier>"(?:[^"]|"")*")
+    |(?P<line_comment>--[^\n]*)
+    |(?P<block_comment>/\*.*?\*/)
+    |(?P<space>\s+)
+    |(?P<code>[^'"\s/-]+|[/-])
+""", re.DOTALL | re.VERBOSE)
+_WHITESPACE = re.compile(r'\s+')
+_PUNCTUATION_SPACING = re.compile(r'\s*([(),;=<>+*/])\s*')
+
+
+def canonicalize_sql(query: str) -> str:
+    """Canonical form of a query for use as a cache key.
+
+    Comments are dropped, whitespace is collapsed and keywords and unquoted identifiers are lower-cased.
+    String literals and quoted identifiers are kept verbatim since their case is significant.
+    """
+    parts = []
+    code = []
+
+    def flush_code():
+        if code:
+            parts.append(_PUNCTUATION_SPACING.sub(r'\1', _WHITESPACE.sub(' ', ''.join(code))))
+            code.clear()
+
+    for match in _SQL_TOKENS.finditer(query):
+        kind = match.lastgroup
+        if kind in ('string', 'identifier'):
+            flush_code()
+            parts.append(match.group())
+        elif kind == 'code':
+            code.append(match.group().lower())
+        else:
+            code.append(' ')
+    flush_code()
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LITERAL_LISTS = re.compile(r'\(\?(?:,\?)+\)')
+
+
+def query_shape(query: str) -> str:
+    """Canonical form of a query with its literals replaced by `?`, grouping queries that differ only in values."""
+    shape = _LITERALS.sub('?', canonicalize_sql(query))
+    return _LITERAL_LISTS.sub('(?)', shape)
+
+
+def returns_rows(query: str) -> bool:
+    """Whether the query is a plain row returning statement (as opposed to e.g. EXPLAIN, SHOW or DML)."""
+    return canonicalize_sql(query).startswith(('select', 'with', 'values', 'table'))
+
+
+def split_statements(query: str) -> list[str]:
+    """Statements of a query string, split at semicolons outside string literals, quoted identifiers and comments.
+
+    Statements consisting of whitespace and comments only are dropped.
+    """
+    statements, current = [], []
+    for match in _SQL_TOKENS.finditer(query):
+        if match.lastgroup == 'code' and ';' in match.group():
+            first, *rest = match.group().split(';')
+            current.append(first)
+            for piece in rest:
+                statements.append(''.join(current))
+                current = [piece]
+        else:
+            current.append(match.group())
+    statements.append(''.join(current))
+    return [statement.strip() for statement in statements if canonicalize_sql(statement)]
+
+
+_WORDS = re.compile(r'[a-z_][a-z0-9_$]*|[()]')
+
+
+def keywords(query: str) -> list[str]:
+    """Lower-cased keywords, unquoted identifiers, function names and parentheses of a query, in order of appearance."""
+    return [
+        word
+        for match in _SQL_TOKENS.finditer(query) if match.lastgroup == 'code'
+        for word in _WORDS.findall(match.group().lower())
+    ]
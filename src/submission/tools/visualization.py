@@ -1,12 +1,15 @@
 from langchain_core.tools import tool
 
 import json
-import io
+import time
+from concurrent.futures.process import BrokenProcessPool
 from typing import Literal
-import boto3
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+
+from src.static.metrics import CHART_BYTES, CHART_RENDER_LATENCY, CHART_UPLOAD_LATENCY
+from src.static.object_store import UPLOADER
+from src.static.tracing import span
+from src.submission.tools.charts import (CHART_CACHE, CHART_CACHE_ENABLED, CHART_DPI, CHART_FORMAT, CHART_RENDERER,
+                                         CONTENT_TYPES, chart_key)
 
 
 
@@ -23,6 +26,7 @@ def visualization(chart_type: Literal['scatter','line','bar'], data_json: str, f
         A JSON string containing the data to be plotted.
     filename : str
         The name of the file (including path if necessary) where the chart image will be saved.
+        Charts are stored under a name derived from their content, so identical charts are uploaded once.
     x_axis : str
         The name of the column in the data to be used for the x-axis.
     y_axis : str
@@ -38,42 +42,67 @@ def visualization(chart_type: Literal['scatter','line','bar'], data_json: str, f
         A message confirming that the chart has been saved, including the filename.
     """
     
-    # Convert JSON input to a pandas DataFrame
-    data = json.loads(data_json)
-    df = pd.DataFrame(data)
+    with span('tool.visualization', chart_type=chart_type, data_chars=len(data_json)) as tool_span:
+        data = json.loads(data_json)
 
-    # Create the Seaborn plot
-    plt.figure(figsize=(10, 6))
-        
-    if chart_type == "scatter":
-        sns.scatterplot(data=df, x=x_axis, y=y_axis, palette=palette)
-    elif chart_type == "line":
-        sns.lineplot(data=df, x=x_axis, y=y_axis, palette=palette)
-    elif chart_type == "bar":
-        ax = sns.barplot(data=df, x=x_axis, y=y_axis, palette=palette)
-    
-    # Set labels
-    plt.title("Visual representation of data")
-    
-    if rotate_xticks:
-        plt.xticks(rotation=xticks_rotation, ha='right')
-    
-    # Save the plot to a BytesIO object
-    img_data = io.BytesIO()
-    plt.savefig(img_data, format='png', dpi=300, bbox_inches='tight')
-    plt.close()
+        # Records or columns, as pandas accepts both
+        if isinstance(data, list):
+            rows = len(data)
+        else:
+            rows = max((len(column) if isinstance(column, (list, dict)) else 1 for column in data.values()), default=0)
+
+        # An identical chart uploaded before is returned without rendering or uploading it again
+        spec = {
+            'chart_type': chart_type,
+            'data': data,
+            'x_axis': x_axis,
+            'y_axis': y_axis,
+            'palette': palette,
+            'rotate_xticks': rotate_xticks,
+            'xticks_rotation': xticks_rotation,
+            'format': CHART_FORMAT,
+            'dpi': CHART_DPI
+        }
+        key = chart_key(spec)
+        url = CHART_CACHE.get(key) if CHART_CACHE_ENABLED else None
+        tool_span.set(cached=url is not None)
+        if url is not None:
+            return f"![Chart Preview]({url})"
+
+        with span('chart.render', rows=rows, format=CHART_FORMAT) as render_span:
+            # Drawn in a worker process, see charts.py
+            start_time = time.perf_counter()
+            try:
+                image = CHART_RENDERER.render(spec)
+            except (TimeoutError, BrokenProcessPool) as e:
+                # A pool broken by another chart's timeout or crash fails this render too; the pool is restarted
+                render_span.set(failed=True)
+                tool_span.set(failed=True)
+                return f"An error occurred: {str(e)}"
+            size = len(image)
+            CHART_RENDER_LATENCY.observe(time.perf_counter() - start_time, format=CHART_FORMAT)
+            CHART_BYTES.observe(size, format=CHART_FORMAT)
+            render_span.set(bytes=size)
+
+        object_name = f'charts/{key}.{CHART_FORMAT}'
 
-    # Reset the pointer of the BytesIO object
-    img_data.seek(0)
+        def uploaded(ok: bool, elapsed: float):
+            if ok:
+                CHART_UPLOAD_LATENCY.observe(elapsed, format=CHART_FORMAT)
+            else:
+                # The URL was handed out before the upload failed, the next request for the chart retries it
+                CHART_CACHE.invalidate(key)
 
-    # Upload the image to S3
-    session = boto3.Session()
-    s3 = session.client('s3')
-    bucket_name = 'bucket_name'
-    try:
-        s3.upload_fileobj(img_data, bucket_name, filename)
-        # Build and return the S3 URL
-        s3_url = f'https://{bucket_name}.s3.amazonaws.com/{filename}'
-        return f"![Chart Preview]({s3_url})"
-    except Exception as e:
-        return f"An error occurred: {str(e)}"
+        # Queued for upload in the background, the URL is final right away. It is cached first, so that
+        # a failed upload finds the entry to drop
+        with span('chart.upload', bytes=size, queued=UPLOADER.asynchronous) as upload_span:
+            if CHART_CACHE_ENABLED:
+                CHART_CACHE.put(key, UPLOADER.store.url(object_name))
+            try:
+                url = UPLOADER.submit(object_name, image, CONTENT_TYPES[CHART_FORMAT], on_done=uploaded)
+            except Exception as e:
+                CHART_CACHE.invalidate(key)
+                upload_span.set(failed=True)
+                tool_span.set(failed=True)
+                return f"An error occurred: {str(e)}"
+            return f"![Chart Preview]({url})"
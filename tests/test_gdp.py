@@ -0,0 +1,59 @@
+import pytest
+
+from src.submission.gdp import mentioned
+
+# country_gdp rows: (Country_ID, Country_Name, GDP_Name, GDP_USD)
+ROWS = [
+    (1, 'Oman', 'Oman', 108192000000),
+    (2, 'Georgia', 'Georgia', 30536000000),
+    (3, 'England', 'United Kingdom', 3340032000000),
+    (4, 'Northern Ireland', 'United Kingdom', 3340032000000),
+    (5, 'Russian Federation', 'Russian Federation', 2021421000000),
+    (6, 'Moscow City, Russian Fed.', 'Moscow City, Russian Federation', 2021421000000),
+    (7, 'Turkey', 'Türkiye', 1118125000000),
+    (8, 'United Arab Emirates', 'United Arab Emirates', 504173000000),
+    (9, 'Dubai, UAE', 'Dubai, United Arab Emirates', 504173000000),
+    (10, 'Chinese Taipei', 'Taiwan, China', 1180000000000),
+]
+
+
+def names(query: str) -> list[str]:
+    return sorted(row[1] for row in mentioned(query, ROWS))
+
+
+def test_several_countries():
+    assert names('GDP of Oman, Georgia and the UK') == ['England', 'Georgia', 'Northern Ireland', 'Oman']
+
+
+@pytest.mark.parametrize('query', ['UK', 'U.K.', 'Britain', 'Great Britain', 'the United Kingdom'])
+def test_united_kingdom(query):
+    assert names(f'GDP of {query}') == ['England', 'Northern Ireland']
+
+
+@pytest.mark.parametrize('query', ['England', 'Northern Ireland'])
+def test_parts_of_the_united_kingdom(query):
+    assert names(f'GDP of {query}') == [query]
+
+
+@pytest.mark.parametrize('query', ['Russia', 'the Russian Federation'])
+def test_russia(query):
+    assert names(f'GDP of {query}') == ['Russian Federation']
+
+
+def test_moscow_is_not_russia():
+    assert names('GDP of Moscow City') == ['Moscow City, Russian Fed.']
+
+
+@pytest.mark.parametrize('query', ['Turkey', 'Türkiye', 'Turkiye'])
+def test_turkey(query):
+    assert names(f'GDP of {query}') == ['Turkey']
+
+
+@pytest.mark.parametrize('query', ['UAE', 'the United Arab Emirates'])
+def test_united_arab_emirates(query):
+    assert names(f'GDP of {query}') == ['United Arab Emirates']
+
+
+@pytest.mark.parametrize('query', ['Taiwan', 'Chinese Taipei'])
+def test_taiwan(query):
+    assert names(f'GDP of {query}') == ['Chinese Taipei']